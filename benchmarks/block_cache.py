@@ -0,0 +1,117 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import argparse
+import random
+import time
+
+import vcfpy
+
+from common.tabix import BlockCache, TabixFile
+
+
+def load_positions(datafile: str) -> list:
+    """
+    Contig and position of every record, read without the block cache
+    """
+    tabix_file = TabixFile(datafile)
+    positions = []
+    for contig in tabix_file.contigs:
+        for line in tabix_file.fetch(contig, 0, 2**29, cache=False):
+            positions.append((contig, int(line.split("\t", 2)[1])))
+    tabix_file.close()
+    return positions
+
+
+def clustered_workload(
+    positions: list, lookups: int, cluster_size: int, spread: int, seed: int
+) -> list:
+    """
+    Lookups in bursts around random loci, like a user panning a browser view
+    """
+    rng = random.Random(seed)
+    workload = []
+    while len(workload) < lookups:
+        center = rng.randrange(len(positions))
+        for _ in range(cluster_size):
+            workload.append(
+                positions[
+                    min(
+                        len(positions) - 1,
+                        max(0, center + rng.randint(-spread, spread)),
+                    )
+                ]
+            )
+    return workload[:lookups]
+
+
+def run(datafile: str, workload: list, cache_size: int) -> dict:
+    block_cache = BlockCache(cache_size) if cache_size else None
+    info_end = "END" in vcfpy.Reader.from_path(datafile).header.info_ids()
+    tabix_file = TabixFile(datafile, block_cache=block_cache, info_end=info_end)
+    start = time.perf_counter()
+    for contig, pos in workload:
+        for _ in tabix_file.fetch(contig, pos - 1, pos):
+            pass
+    elapsed = time.perf_counter() - start
+    tabix_file.close()
+    return {
+        "lookups_per_second": round(len(workload) / elapsed),
+        "hit_rate": block_cache.stats()["hit_rate"] if block_cache else None,
+    }
+
+
+def main():
+    """
+    Compares single-variant lookups with and without the BGZF block cache,
+    on a clustered workload and on uniformly random lookups
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the BGZF block cache")
+    parser.add_argument(
+        "--datafile", type=str, required=True, help="bgzipped, tabix indexed VCF"
+    )
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument(
+        "--cluster_size", type=int, default=50, help="lookups per visited locus"
+    )
+    parser.add_argument(
+        "--spread", type=int, default=200, help="records either side of a locus"
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=64 * 1024 * 1024,
+        help="block cache size in bytes",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    positions = load_positions(args.datafile)
+    workloads = {
+        "clustered": clustered_workload(
+            positions, args.lookups, args.cluster_size, args.spread, args.seed
+        ),
+        "uniform": clustered_workload(positions, args.lookups, 1, 0, args.seed),
+    }
+    for name, workload in workloads.items():
+        for cache_size in (0, args.cache_size):
+            result = run(args.datafile, workload, cache_size)
+            print(
+                f"{name:<10} cache={cache_size:<10} {result['lookups_per_second']:>8} lookups/s"
+                f"  hit rate {result['hit_rate']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
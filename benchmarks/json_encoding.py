@@ -0,0 +1,115 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+
+from starlette.responses import JSONResponse
+
+from graphql_service import http_handler
+from graphql_service.client import decode_response
+from graphql_service.http_handler import ENCODERS, encode_json
+
+
+def load_payloads(examples: str) -> dict:
+    """
+    Example responses by path relative to the examples directory
+    """
+    payloads = {}
+    for path in sorted(
+        glob.glob(os.path.join(examples, "**", "*.json"), recursive=True)
+    ):
+        with open(path) as payload_file:
+            payloads[os.path.relpath(path, examples)] = json.load(payload_file)
+    return payloads
+
+
+def time_encoder(encode, payload, repeat: int) -> float:
+    """
+    Microseconds per encoding, best of three runs
+    """
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            encode(payload)
+        elapsed = (time.perf_counter() - start) / repeat * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    """
+    Compares encoding the example GraphQL responses with Starlette's
+    JSONResponse and with the encoder of the GraphQL HTTP handler, then the
+    size and the encoding and client decoding time of every media type the
+    handler can answer with
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark JSON encoding of GraphQL responses"
+    )
+    parser.add_argument(
+        "--examples",
+        type=str,
+        default="examples",
+        help="directory of example responses",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=200, help="encodings per payload and run"
+    )
+    args = parser.parse_args()
+
+    if http_handler.orjson is None:
+        print("orjson is not installed, the handler falls back to the stdlib encoder")
+    stdlib = JSONResponse(None).render
+    totals = [0.0, 0.0]
+    payloads = load_payloads(args.examples)
+    for name, payload in payloads.items():
+        if json.loads(encode_json(payload)) != payload:
+            raise ValueError(f"{name} does not round trip")
+        timings = [
+            time_encoder(stdlib, payload, args.repeat),
+            time_encoder(encode_json, payload, args.repeat),
+        ]
+        totals = [total + timing for total, timing in zip(totals, timings)]
+        print(
+            f"{name:<64} {len(stdlib(payload)):>8} bytes  stdlib {timings[0]:>8.1f}us"
+            f"  handler {timings[1]:>8.1f}us  x{timings[0] / timings[1]:.1f}"
+        )
+    print(
+        f"{'all payloads':<64} {'':>14}  stdlib {totals[0]:>8.1f}us  handler {totals[1]:>8.1f}us  x{totals[0] / totals[1]:.1f}"
+    )
+
+    print()
+    for media_type, encode in ENCODERS.items():
+        size = encode_time = decode_time = 0
+        for name, payload in payloads.items():
+            encoded = encode(payload)
+            if decode_response(media_type, encoded) != payload:
+                raise ValueError(f"{name} does not round trip as {media_type}")
+            size += len(encoded)
+            encode_time += time_encoder(encode, payload, args.repeat)
+            decode_time += time_encoder(
+                lambda body: decode_response(media_type, body), encoded, args.repeat
+            )
+        print(
+            f"{media_type:<24} {size:>8} bytes  encode {encode_time:>8.1f}us  decode {decode_time:>8.1f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Callable, Dict, List, Tuple
+import argparse
+import asyncio
+import gc
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+import ariadne
+import pysam
+import vcfpy
+
+from common.file_client import FileClient
+from common.file_model.csq_layout import get_csq_layout
+from common.genome_dataset import DATAFILE_NAME, GenomeDataset
+from graphql_service.ariadne_app import prepare_executable_schema
+
+VARIANT = "variant(by_id: {genome_id: $genome_id, variant_id: $variant_id})"
+SHAPES = {
+    "summary": """
+        name type
+        primary_source { accession_id url source { id name release } }
+        allele_type { accession_id value }
+        slice { location { start end length } region { name } strand { code } }
+    """,
+    "consequences": """
+        name
+        alleles { predicted_molecular_consequences { stable_id gene_symbol consequences { value } } }
+    """,
+    "frequencies": """
+        name
+        alleles { population_frequencies { population_name allele_frequency is_minor_allele is_hpmaf } }
+    """,
+    "full": """
+        name
+        alternative_names { accession_id }
+        primary_source { accession_id name description url source { id name description url release } }
+        allele_type { accession_id value }
+        slice { location { start end length } region { name code topology } strand { code value } }
+        prediction_results { result score analysis_method { tool qualifier version } }
+        ensembl_website_display_data { count_citations }
+        alleles {
+          name allele_sequence reference_sequence
+          allele_type { accession_id }
+          phenotype_assertions { feature phenotype { name } }
+          predicted_molecular_consequences {
+            stable_id gene_symbol transcript_biotype consequences { value }
+            prediction_results { score classification { label } analysis_method { tool } }
+            cdna_location { start end } cds_location { start end } protein_location { start end }
+          }
+          prediction_results { score analysis_method { tool } }
+          population_frequencies { population_name allele_frequency allele_count allele_number is_minor_allele is_hpmaf }
+          ensembl_website_display_data { count_transcript_consequences count_overlapped_genes }
+        }
+    """,
+}
+
+
+def shape_query(shape: str) -> str:
+    return f"query q($genome_id: String!, $variant_id: String!) {{ {VARIANT} {{ {SHAPES[shape]} }} }}"
+
+
+def list_variant_ids(datafile: str, limit: int) -> List[str]:
+    """
+    Ids of the first records of a VCF, as contig:position:identifier
+    """
+    dataset = GenomeDataset("", datafile)
+    variant_ids = []
+    for contig in dataset.tabix_file.contigs:
+        for line in dataset.fetch(contig, 0, 2**29, cache=False):
+            fields = line.split("\t", 3)
+            variant_ids.append(f"{fields[0]}:{fields[1]}:{fields[2]}")
+            if len(variant_ids) == limit:
+                return variant_ids
+    return variant_ids
+
+
+def write_synthetic_vcf(
+    template: str, datafile: str, csq_sizes: List[int]
+) -> List[Tuple[int, str]]:
+    """
+    Writes a bgzipped, indexed VCF with the header of template and one
+    variant per CSQ size, made from the template record with the most CSQ
+    entries repeated for distinct transcripts. Returns (size, variant id)
+    """
+    feature_index = get_csq_layout(vcfpy.Reader.from_path(template).header)["Feature"]
+    header, records = [], []
+    with gzip.open(template, "rt") as template_file:
+        for line in template_file:
+            (header if line.startswith("#") else records).append(line.rstrip("\n"))
+
+    def csq_entries(record: str) -> List[str]:
+        info = record.split("\t")[7]
+        csq = [item for item in info.split(";") if item.startswith("CSQ=")]
+        return csq[0][4:].split(",") if csq else []
+
+    fields = max(records, key=lambda record: len(csq_entries(record))).split("\t")
+    entries = csq_entries("\t".join(fields))
+    variant_ids = []
+    lines = list(header)
+    for offset, size in enumerate(sorted(csq_sizes)):
+        csq = []
+        for i in range(size):
+            entry = entries[i % len(entries)].split("|")
+            entry[feature_index] = f"{entry[feature_index]}_{i}"
+            csq.append("|".join(entry))
+        info = ";".join(
+            f"CSQ={','.join(csq)}" if item.startswith("CSQ=") else item
+            for item in fields[7].split(";")
+        )
+        pos = int(fields[1]) + offset
+        name = f"synthetic_csq_{size}"
+        lines.append(
+            "\t".join([fields[0], str(pos), name, *fields[3:7], info, *fields[8:]])
+        )
+        variant_ids.append((size, f"{fields[0]}:{pos}:{name}"))
+
+    plain = datafile[: -len(".gz")]
+    with open(plain, "w") as plain_file:
+        plain_file.write("\n".join(lines) + "\n")
+    pysam.tabix_compress(plain, datafile, force=True)
+    pysam.tabix_index(datafile, preset="vcf", force=True)
+    os.remove(plain)
+    return variant_ids
+
+
+def make_client(data_root: str) -> FileClient:
+    # Large variants are decoded in-process, where tracemalloc sees them
+    return FileClient(
+        {"data_root": data_root, "csq_offload_threshold": "0", "request_timeout": "600"}
+    )
+
+
+def graph_memory(build: Callable) -> Tuple[int, int]:
+    """
+    Bytes retained by the object graph returned by build, measured as what
+    is freed when it is dropped so that caches filled on the way are left
+    out, and peak bytes allocated while building it
+    """
+    gc.collect()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    graph = build()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    del graph
+    gc.collect()
+    return current - tracemalloc.get_traced_memory()[0], peak - before
+
+
+def variant_graph(client: FileClient, genome_uuid: str, variant_id: str) -> Tuple:
+    """
+    A Variant with its alleles and everything the resolvers decode from them
+    """
+    variant = client.get_variant_record(genome_uuid, variant_id)
+    alleles = variant.get_alleles()
+    for allele in alleles:
+        allele.get_predicted_molecular_consequences()
+        allele.get_population_allele_frequencies()
+    return variant, alleles
+
+
+async def request_memory(
+    client: FileClient, schema, shape: str, genome_uuid: str, variant_id: str
+) -> Tuple[int, int]:
+    """
+    Bytes a request leaves allocated once its result is dropped, and its
+    peak, both above what was allocated before it
+    """
+    gc.collect()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    success, result = await ariadne.graphql(
+        schema,
+        {
+            "query": shape_query(shape),
+            "variables": {"genome_id": genome_uuid, "variant_id": variant_id},
+        },
+        context_value={"file_client": client},
+    )
+    if not success or result.get("errors") or not result["data"]["variant"]:
+        raise RuntimeError(
+            f"{shape} query of {variant_id} failed: {result.get('errors')}"
+        )
+    peak = tracemalloc.get_traced_memory()[1]
+    del result
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] - before, peak - before
+
+
+async def leak_check(
+    client: FileClient,
+    schema,
+    shape: str,
+    genome_uuid: str,
+    variant_ids: List[str],
+    passes: int,
+    warmup: int,
+) -> Tuple[float, List]:
+    """
+    Growth in bytes per request over passes through variant_ids, after
+    passes of at least warmup requests that fill the caches, with the
+    allocation sites that grew most. Sizes are compared at the end of whole
+    passes, as what the last request leaves behind depends on its variant
+    """
+    for _ in range(max(1, -(-warmup // len(variant_ids)))):
+        for variant_id in variant_ids:
+            await request_memory(client, schema, shape, genome_uuid, variant_id)
+    gc.collect()
+    start = tracemalloc.take_snapshot()
+    start_size = tracemalloc.get_traced_memory()[0]
+    for _ in range(passes):
+        for variant_id in variant_ids:
+            await request_memory(client, schema, shape, genome_uuid, variant_id)
+    gc.collect()
+    growth = (tracemalloc.get_traced_memory()[0] - start_size) / (
+        passes * len(variant_ids)
+    )
+    top = tracemalloc.take_snapshot().compare_to(start, "lineno")[:5]
+    return growth, [stat for stat in top if stat.size_diff > 0]
+
+
+def run(options: argparse.Namespace) -> Dict[str, float]:
+    """
+    Metrics by name: object graph sizes of the bundled and synthetic
+    variants, peak and retained bytes of every request shape, and the
+    growth per request of the leak check
+    """
+    metrics = {}
+    schema = prepare_executable_schema()
+    bundled_datafile = GenomeDataset.datafile_for(
+        options.data_root, options.genome_uuid
+    )
+    bundled_ids = list_variant_ids(bundled_datafile, options.variants)
+    synthetic_root = tempfile.mkdtemp(prefix="memory_benchmark_")
+    os.makedirs(os.path.join(synthetic_root, options.genome_uuid))
+    synthetic_ids = write_synthetic_vcf(
+        bundled_datafile,
+        os.path.join(synthetic_root, options.genome_uuid, DATAFILE_NAME),
+        options.csq_sizes,
+    )
+    bundled, synthetic = make_client(options.data_root), make_client(synthetic_root)
+    try:
+        measure(
+            options, metrics, schema, bundled, bundled_ids, synthetic, synthetic_ids
+        )
+    finally:
+        shutil.rmtree(synthetic_root)
+    return metrics
+
+
+def measure(
+    options: argparse.Namespace,
+    metrics: Dict[str, float],
+    schema,
+    bundled: FileClient,
+    bundled_ids: List[str],
+    synthetic: FileClient,
+    synthetic_ids: List[Tuple[int, str]],
+) -> None:
+
+    tracemalloc.start(options.frames)
+    retained = []
+    for variant_id in bundled_ids:
+        retained.append(
+            graph_memory(
+                lambda: variant_graph(bundled, options.genome_uuid, variant_id)
+            )[0]
+        )
+    metrics["graph.bundled.mean_retained"] = sum(retained) / len(retained)
+    metrics["graph.bundled.max_retained"] = max(retained)
+    for size, variant_id in synthetic_ids:
+        graph_retained, graph_peak = graph_memory(
+            lambda: variant_graph(synthetic, options.genome_uuid, variant_id)
+        )
+        metrics[f"graph.csq_{size}.retained"] = graph_retained
+        metrics[f"graph.csq_{size}.peak"] = graph_peak
+        metrics[f"graph.csq_{size}.retained_per_entry"] = graph_retained / size
+
+    async def requests():
+        for shape in SHAPES:
+            peaks = []
+            for variant_id in bundled_ids:
+                peaks.append(
+                    (
+                        await request_memory(
+                            bundled, schema, shape, options.genome_uuid, variant_id
+                        )
+                    )[1]
+                )
+            metrics[f"request.{shape}.bundled.max_peak"] = max(peaks)
+            for size, variant_id in synthetic_ids:
+                first_retained, peak = await request_memory(
+                    synthetic, schema, shape, options.genome_uuid, variant_id
+                )
+                metrics[f"request.{shape}.csq_{size}.peak"] = peak
+                metrics[f"request.{shape}.csq_{size}.first_retained"] = first_retained
+        for shape in SHAPES:
+            growth, top = await leak_check(
+                bundled,
+                schema,
+                shape,
+                options.genome_uuid,
+                bundled_ids,
+                options.passes,
+                options.warmup,
+            )
+            metrics[f"leak.{shape}.growth_per_request"] = growth
+            if growth > options.max_growth_per_request:
+                print(f"{shape} requests grow by {growth:.0f} bytes each, most at:")
+                for stat in top:
+                    print(f"  {stat}")
+
+    asyncio.run(requests())
+    tracemalloc.stop()
+
+
+def main():
+    """
+    tracemalloc measurements of the variant object graph and of GraphQL
+    requests over the bundled VCF and a synthetic one with variants of
+    growing CSQ sizes, with a leak check over many requests. Metrics over
+    the limits of a budget file, or growth per request over
+    --max_growth_per_request, fail the run so that CI can catch regressions
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark memory retained by variants and requests"
+    )
+    parser.add_argument("--data_root", default=os.getenv("data_root"))
+    parser.add_argument("--genome_uuid", required=True)
+    parser.add_argument(
+        "--variants", type=int, default=100, help="bundled variants to measure"
+    )
+    parser.add_argument(
+        "--csq_sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[10, 100, 1000, 5000],
+        help="CSQ entries of the synthetic variants",
+    )
+    parser.add_argument(
+        "--passes",
+        type=int,
+        default=3,
+        help="passes through the bundled variants of the leak check",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=100,
+        help="requests before the leak check starts measuring",
+    )
+    parser.add_argument(
+        "--max_growth_per_request", type=float, default=64, help="bytes"
+    )
+    parser.add_argument("--budget", help="JSON file of metric name to maximum value")
+    parser.add_argument("--output", help="JSON file to write the metrics to")
+    parser.add_argument(
+        "--frames", type=int, default=1, help="traceback frames kept by tracemalloc"
+    )
+    options = parser.parse_args()
+
+    metrics = run(options)
+    for name, value in metrics.items():
+        print(f"{name:<48} {value:>14,.0f}")
+    if options.output:
+        with open(options.output, "w") as output_file:
+            json.dump(metrics, output_file, indent=2)
+
+    budget = {}
+    if options.budget:
+        with open(options.budget) as budget_file:
+            budget = json.load(budget_file)
+    # Metrics of the budget that were not measured, such as those of other
+    # CSQ sizes, are not checked
+    failures = [
+        f"{name} is {metrics[name]:,.0f}, over the budget of {limit:,.0f}"
+        for name, limit in budget.items()
+        if name in metrics and metrics[name] > limit
+    ]
+    failures += [
+        f"{name} is {value:,.0f} bytes, over {options.max_growth_per_request:,.0f}"
+        for name, value in metrics.items()
+        if name.startswith("leak.") and value > options.max_growth_per_request
+    ]
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+QUERY = """
+query q($genome_id: String!, $variant_id: String!) {
+  variant(by_id: {genome_id: $genome_id, variant_id: $variant_id}) {
+    name
+    alleles {
+      predicted_molecular_consequences { stable_id consequences { value } }
+      population_frequencies { population_name allele_frequency }
+    }
+  }
+}
+"""
+
+
+async def post_query(app, variables: dict) -> dict:
+    """
+    Sends a GraphQL request straight to the ASGI app
+    """
+    body = json.dumps({"query": QUERY, "variables": variables}).encode()
+    messages = []
+    received = False
+
+    async def receive():
+        nonlocal received
+        if received:
+            await asyncio.Event().wait()
+        received = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/",
+        "raw_path": b"/",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json")],
+        "scheme": "http",
+        "server": ("localhost", 8000),
+        "client": ("localhost", 0),
+        "http_version": "1.1",
+        "state": {},
+    }
+    await app(scope, receive, send)
+    result = json.loads(b"".join(message.get("body", b"") for message in messages[1:]))
+    if result.get("errors"):
+        raise RuntimeError(result["errors"])
+    return result
+
+
+def measure(genome_uuid: str, variant_id: str) -> dict:
+    """
+    Runs in a fresh interpreter: times importing the server module, which
+    builds or loads the schema, and its first and second requests
+    """
+    start = time.perf_counter()
+    from graphql_service import server
+
+    imported = time.perf_counter()
+    variables = {"genome_id": genome_uuid, "variant_id": variant_id}
+    asyncio.run(post_query(server.APP, variables))
+    first = time.perf_counter()
+    asyncio.run(post_query(server.APP, variables))
+    second = time.perf_counter()
+    return {
+        "import": imported - start,
+        "first_request": first - imported,
+        "second_request": second - first,
+    }
+
+
+def main():
+    """
+    Starts the service in fresh interpreters and reports the median import
+    time and latency of the first requests. Exits with an error when a
+    budget is exceeded, so that CI can guard startup time
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark import time and first request latency"
+    )
+    parser.add_argument("--data_root", default=os.getenv("data_root"))
+    parser.add_argument("--genome_uuid", required=True)
+    parser.add_argument(
+        "--variant_id",
+        required=True,
+        help="contig:position:identifier of a variant of the genome",
+    )
+    parser.add_argument(
+        "--schema_cache",
+        help="pickled schema written by python -m graphql_service.ariadne_app",
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--max_import", type=float, help="budget in seconds for the median import time"
+    )
+    parser.add_argument(
+        "--max_first_request",
+        type=float,
+        help="budget in seconds for the median first request",
+    )
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.genome_uuid, args.variant_id)))
+        return
+
+    env = dict(os.environ, data_root=args.data_root, PYTHONWARNINGS="ignore")
+    env.pop("schema_cache", None)
+    if args.schema_cache:
+        env["schema_cache"] = args.schema_cache
+    runs = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.startup",
+                "--child",
+                "--genome_uuid",
+                args.genome_uuid,
+                "--variant_id",
+                args.variant_id,
+            ],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        timings = json.loads(output.strip().splitlines()[-1])
+        timings["process"] = time.perf_counter() - start
+        runs.append(timings)
+
+    medians = {name: statistics.median(run[name] for run in runs) for name in runs[0]}
+    for name, median in medians.items():
+        print(f"{name:<16} {median * 1000:8.1f} ms")
+    failed = False
+    for name, budget in (
+        ("import", args.max_import),
+        ("first_request", args.max_first_request),
+    ):
+        if budget is not None and medians[name] > budget:
+            print(f"{name} takes {medians[name]:.3f}s, over the budget of {budget}s")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
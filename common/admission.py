@@ -0,0 +1,136 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Mapping
+import asyncio
+import collections
+import math
+import time
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is shed instead of being queued
+    """
+
+    def __init__(self, reason: str, retry_after: int) -> None:
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"Service overloaded ({reason}), retry after {retry_after}s")
+
+
+class AdmissionController:
+    """
+    Concurrency limit with a bounded FIFO wait queue, for use from the event
+    loop of one worker. A request is rejected straight away when the queue
+    is full or when the expected wait, estimated from the average time a
+    slot is held, would take it past its deadline, and it gives up waiting
+    when the deadline passes. A released slot is handed to the oldest waiter
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int) -> None:
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiters = collections.deque()
+        self.service_time = 0.0
+        self.counters = {
+            "admitted": 0,
+            "shed_queue_full": 0,
+            "shed_deadline": 0,
+            "timed_out": 0,
+        }
+
+    @classmethod
+    def from_config(
+        cls, config: Mapping, name: str, max_concurrent: int, max_queue: int
+    ) -> "AdmissionController":
+        return cls(
+            name,
+            int(config.get(f"max_concurrent_{name}", max_concurrent)),
+            int(config.get(f"{name}_queue_size", max_queue)),
+        )
+
+    def expected_wait(self) -> float:
+        """
+        Seconds until a request joining the queue now would get a slot
+        """
+        return (len(self.waiters) + 1) * self.service_time / self.max_concurrent
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.expected_wait()))
+
+    def shed(self, reason: str) -> Overloaded:
+        self.counters[f"shed_{reason}"] += 1
+        return Overloaded(f"{self.name} {reason.replace('_', ' ')}", self.retry_after())
+
+    async def acquire(self, deadline: float) -> float:
+        """
+        Wait for a slot until the monotonic deadline. Returns the time the
+        slot was granted, to be passed to release
+        """
+        if self.active < self.max_concurrent and not self.waiters:
+            self.active += 1
+            self.counters["admitted"] += 1
+            return time.monotonic()
+        if len(self.waiters) >= self.max_queue:
+            raise self.shed("queue_full")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or self.expected_wait() > remaining:
+            raise self.shed("deadline")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, remaining)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait ended
+                self.release(None)
+            elif waiter in self.waiters:
+                self.waiters.remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.counters["timed_out"] += 1
+            raise Overloaded(f"{self.name} deadline exceeded", self.retry_after())
+        self.counters["admitted"] += 1
+        return time.monotonic()
+
+    def release(self, granted: float) -> None:
+        """
+        Give the slot to the oldest waiter, or free it. May be called from a
+        worker thread through loop.call_soon_threadsafe
+        """
+        if granted is not None:
+            held = time.monotonic() - granted
+            self.service_time = (
+                held if not self.service_time else 0.9 * self.service_time + 0.1 * held
+            )
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Mapping:
+        return {
+            "active": self.active,
+            "queued": len(self.waiters),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "avg_service_time": round(self.service_time, 4),
+            **self.counters,
+        }
@@ -0,0 +1,190 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Iterable, Optional, Tuple
+import hashlib
+import math
+import mmap
+import os
+import struct
+
+import numpy as np
+
+BLOOM_FILTER_FILENAME = "variation.bloom"
+MAGIC = b"HYPBLOOM"
+LAYOUT_VERSION = 1
+# magic, version, hash count, bit count, item count, VCF size, VCF mtime_ns
+FILE_HEADER = struct.Struct("<8sIIQQQQ")
+FILE_HEADER_SIZE = 64
+MASK64 = (1 << 64) - 1
+
+
+def bloom_filter_path(datafile: str) -> str:
+    """
+    The filter lives in the same directory as the VCF it was built from
+    """
+    return os.path.join(os.path.dirname(datafile), BLOOM_FILTER_FILENAME)
+
+
+def key_hashes(key: str) -> Tuple[int, int]:
+    """
+    Two independent 64-bit hashes of a variant id, combined as h1 + i * h2
+    (mod 2**64) into the bit index of the i-th hash function
+    """
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    return struct.unpack("<QQ", digest)
+
+
+def filter_size(
+    items: int, false_positive_rate: float, max_bytes: int = None
+) -> Tuple[int, int]:
+    """
+    Bit and hash function counts for the target false positive rate,
+    capped at max_bytes
+    """
+    bits = max(
+        64, math.ceil(-max(items, 1) * math.log(false_positive_rate) / math.log(2) ** 2)
+    )
+    if max_bytes:
+        bits = min(bits, max_bytes * 8)
+    bits = (bits + 7) // 8 * 8
+    hashes = max(1, round(bits / max(items, 1) * math.log(2)))
+    return bits, hashes
+
+
+def expected_false_positive_rate(items: int, bits: int, hashes: int) -> float:
+    return (1 - math.exp(-hashes * items / bits)) ** hashes
+
+
+class BloomFilterBuilder:
+    """
+    Builds a filter in memory, hashing ids in batches with NumPy
+    """
+
+    def __init__(
+        self, items: int, false_positive_rate: float, max_bytes: int = None
+    ) -> None:
+        self.items = items
+        self.bits, self.hashes = filter_size(items, false_positive_rate, max_bytes)
+        self.array = np.zeros(self.bits // 8, dtype=np.uint8)
+        self.added = 0
+
+    def add_all(self, keys: Iterable[str], batch_size: int = 100000) -> None:
+        batch = []
+        for key in keys:
+            batch.append(key_hashes(key))
+            if len(batch) == batch_size:
+                self.add_hashes(batch)
+                batch = []
+        if batch:
+            self.add_hashes(batch)
+
+    def add_hashes(self, batch: list) -> None:
+        hashes = np.array(batch, dtype=np.uint64)
+        h1, h2 = hashes[:, 0], hashes[:, 1]
+        for i in range(self.hashes):
+            # uint64 arithmetic wraps like the & MASK64 of the lookup
+            indices = (h1 + np.uint64(i) * h2) % np.uint64(self.bits)
+            np.bitwise_or.at(
+                self.array,
+                indices >> np.uint64(3),
+                np.left_shift(1, indices & np.uint64(7)).astype(np.uint8),
+            )
+        self.added += len(batch)
+
+    def write(self, path: str, vcf_size: int, vcf_mtime_ns: int) -> None:
+        with open(path, "wb") as output:
+            output.write(
+                FILE_HEADER.pack(
+                    MAGIC,
+                    LAYOUT_VERSION,
+                    self.hashes,
+                    self.bits,
+                    self.added,
+                    vcf_size,
+                    vcf_mtime_ns,
+                ).ljust(FILE_HEADER_SIZE, b"\0")
+            )
+            output.write(self.array.tobytes())
+
+
+class BloomFilter:
+    """
+    Read-only, memory-mapped filter over the ids of a genome. A miss means
+    the variant is definitely not in the VCF; a hit may be a false positive
+    at the rate the filter was built for. Pages are shared by every process
+    mapping the file
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as input_file:
+            self.map = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            version,
+            self.hashes,
+            self.bits,
+            self.items,
+            self.vcf_size,
+            self.vcf_mtime_ns,
+        ) = FILE_HEADER.unpack_from(self.map)
+        if (
+            magic != MAGIC
+            or version != LAYOUT_VERSION
+            or len(self.map) < FILE_HEADER_SIZE + self.bits // 8
+        ):
+            self.map.close()
+            raise ValueError(f"{path} is not a variant Bloom filter")
+
+    @classmethod
+    def open_for(cls, datafile: str) -> Optional["BloomFilter"]:
+        """
+        Opens the filter next to a VCF, or returns None when there is none or
+        it was built from another version of the VCF
+        """
+        path = bloom_filter_path(datafile)
+        if not os.path.isfile(path):
+            return None
+        bloom_filter = cls(path)
+        stat = os.stat(datafile)
+        if (bloom_filter.vcf_size, bloom_filter.vcf_mtime_ns) != (
+            stat.st_size,
+            stat.st_mtime_ns,
+        ):
+            print(f"Ignoring {path}, it was built from another version of {datafile}")
+            bloom_filter.close()
+            return None
+        return bloom_filter
+
+    def __contains__(self, key: str) -> bool:
+        h1, h2 = key_hashes(key)
+        for i in range(self.hashes):
+            index = ((h1 + i * h2) & MASK64) % self.bits
+            if not self.map[FILE_HEADER_SIZE + (index >> 3)] & (1 << (index & 7)):
+                return False
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "items": self.items,
+            "bytes": self.bits // 8,
+            "hashes": self.hashes,
+            "expected_false_positive_rate": round(
+                expected_false_positive_rate(self.items, self.bits, self.hashes), 6
+            ),
+        }
+
+    def close(self) -> None:
+        self.map.close()
@@ -0,0 +1,133 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import List, Mapping, Optional
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import os
+import threading
+
+import vcfpy
+
+from common.file_model.variant import Variant
+from common.pipeline.precompute import DERIVED_FIELDS, derive_fields
+
+# Headers of the files decoded by a pool process, parsed once per process
+_readers = {}
+
+
+def decode_variant_csq(
+    datafile: str, genome_uuid: str, line: str, fields: List[str]
+) -> bytes:
+    """
+    Runs in a pool process: decodes the CSQ of every allele of the variant
+    on a VCF line and computes the given derived fields, which also walk the
+    whole CSQ. Returns them as compact JSON
+    """
+    reader = _readers.get(datafile)
+    if reader is None:
+        reader = _readers[datafile] = vcfpy.Reader.from_path(datafile)
+    variant = Variant(reader.parser.parse_line(line), reader.header, genome_uuid)
+    decoded = {
+        "alleles": {
+            allele.allele_sequence: allele.info_map for allele in variant.get_alleles()
+        },
+        "derived": derive_fields(variant, fields),
+    }
+    return json.dumps(decoded, separators=(",", ":")).encode()
+
+
+class CsqOffload:
+    """
+    Decodes the CSQ of variants with more than threshold entries in a pool
+    of processes, together with the derived fields that walk the whole CSQ
+    and are not in the sidecar. Decoding is pure Python and holds the GIL,
+    so a variant with thousands of transcript consequences would otherwise
+    stall every other request of the worker while its fields are resolved.
+    Smaller variants are decoded lazily in process as before.
+
+    The pool is started on first use, with spawn so that no lock held by
+    a thread of the serving process is inherited, and again in a process
+    forked after that
+    """
+
+    def __init__(self, threshold: int, processes: int) -> None:
+        self.threshold = threshold
+        self.processes = processes
+        self.pool = None
+        self.pool_pid = None
+        self.pool_lock = threading.Lock()
+        # Submitted decodes not done yet, cancelled when the pool is closed
+        self.futures = set()
+        self.counters = {"offloaded": 0, "failed": 0, "bytes": 0}
+
+    @classmethod
+    def from_config(cls, config: Mapping) -> Optional["CsqOffload"]:
+        threshold = int(config.get("csq_offload_threshold", 1000))
+        if threshold <= 0:
+            return None
+        return cls(threshold, int(config.get("csq_offload_processes", 2)))
+
+    def decode(self, variant: Variant, datafile: str, line: str) -> None:
+        """
+        Attaches the decoded CSQ to a variant when it is large enough to be
+        worth a round trip to the pool. Blocks the calling thread, not the
+        event loop, until it is done. On failure the variant is decoded in
+        process when its alleles are resolved
+        """
+        if len(variant.info.get("CSQ", [])) <= self.threshold:
+            return
+        with self.pool_lock:
+            if self.pool_pid != os.getpid():
+                self.pool = ProcessPoolExecutor(
+                    self.processes, mp_context=multiprocessing.get_context("spawn")
+                )
+                self.pool_pid = os.getpid()
+                self.futures = set()
+        try:
+            # Fields read from the sidecar need not be computed again
+            fields = [
+                field for field in DERIVED_FIELDS if field not in variant.precomputed
+            ]
+            future = self.pool.submit(
+                decode_variant_csq, datafile, variant.genome_uuid, line, fields
+            )
+            self.futures.add(future)
+            future.add_done_callback(self.futures.discard)
+            payload = future.result()
+        except Exception as e:
+            self.counters["failed"] += 1
+            print(f"Cannot decode the CSQ of {variant.name} in the pool - {e}")
+            return
+        decoded = json.loads(payload)
+        variant.decoded_csq = decoded["alleles"]
+        variant.precomputed = {**decoded["derived"], **variant.precomputed}
+        self.counters["offloaded"] += 1
+        self.counters["bytes"] += len(payload)
+
+    def stats(self) -> Mapping:
+        return {
+            "threshold": self.threshold,
+            "processes": self.processes,
+            **self.counters,
+        }
+
+    def close(self) -> None:
+        if self.pool and self.pool_pid == os.getpid():
+            # shutdown(cancel_futures=True) needs Python 3.9
+            for future in list(self.futures):
+                future.cancel()
+            self.pool.shutdown(wait=False)
+        self.pool = None
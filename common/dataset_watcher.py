@@ -0,0 +1,154 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import threading
+
+from common.genome_dataset import GenomeDataset
+
+
+class DatasetWatcher:
+    """
+    Polls data_root and swaps in genome datasets whose VCF, index or sidecar
+    changed, without restarting the service. Polling is used rather than
+    inotify because data_root is usually on NFS.
+
+    A change has to look the same on two polls in a row before the dataset
+    is rebuilt, so files still being copied are not picked up. The new
+    dataset is built and warmed in the background and the datasets dict of
+    the file client is then replaced as a whole, under its datasets_lock;
+    requests already holding the old dataset finish with it and it is
+    closed when the last of them releases it
+    """
+
+    def __init__(self, file_client, interval: float) -> None:
+        self.file_client = file_client
+        self.interval = interval
+        self.pending = {}
+        self.reloads = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or self.thread:
+            return
+        self.thread = threading.Thread(
+            target=self.run, name="dataset-watcher", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(
+                    f"Cannot check {self.file_client.data_root} for changed datasets - {e}"
+                )
+
+    def scan(self) -> dict:
+        """
+        Fingerprint of every genome under data_root that has a VCF
+        """
+        data_root = self.file_client.data_root
+        fingerprints = {}
+        for genome_uuid in os.listdir(data_root):
+            fingerprint = GenomeDataset.fingerprint(
+                GenomeDataset.datafile_for(data_root, genome_uuid)
+            )
+            if fingerprint:
+                fingerprints[genome_uuid] = fingerprint
+        return fingerprints
+
+    def poll(self) -> None:
+        """
+        Rebuild changed datasets, drop removed ones and retire both
+        """
+        fingerprints = self.scan()
+        datasets_lock = self.file_client.datasets_lock
+        with datasets_lock:
+            current = dict(self.file_client.datasets)
+
+        staging = self.file_client.staging
+        replacements = {}
+        for genome_uuid, fingerprint in fingerprints.items():
+            dataset = current.get(genome_uuid)
+            if dataset is None:
+                # Genomes that were never requested are loaded on first use
+                self.pending.pop(genome_uuid, None)
+                continue
+            evicted = False
+            if dataset.version == fingerprint:
+                self.pending.pop(genome_uuid, None)
+                if not staging:
+                    continue
+                if dataset.datafile == dataset.source:
+                    if not staging.ready(genome_uuid, dataset.source):
+                        continue
+                elif os.path.exists(dataset.datafile):
+                    if dataset.used:
+                        staging.touch(dataset.datafile)
+                        dataset.used = False
+                    continue
+                else:
+                    # The staged copy was evicted, open file handles keep it
+                    # readable until the swap. It is not queued for staging
+                    # again or copies of open datasets could evict each other
+                    # in a loop
+                    evicted = True
+            elif self.pending.get(genome_uuid) != fingerprint:
+                self.pending[genome_uuid] = fingerprint
+                continue
+            else:
+                del self.pending[genome_uuid]
+            try:
+                replacement = self.file_client.open_dataset(
+                    genome_uuid, stage=not evicted
+                )
+                replacement.load_sidecar()
+            except Exception as e:
+                print(
+                    f"Cannot reload genome {genome_uuid}, keeping the loaded dataset - {e}"
+                )
+                continue
+            replacements[genome_uuid] = replacement
+
+        # Datasets opened by requests since the snapshot are kept, built
+        # replacements are swapped in and removed genomes dropped in one go
+        retired = []
+        with datasets_lock:
+            datasets = {}
+            for genome_uuid, dataset in self.file_client.datasets.items():
+                if genome_uuid in replacements:
+                    datasets[genome_uuid] = replacements[genome_uuid]
+                    retired.append(dataset)
+                elif genome_uuid in current and genome_uuid not in fingerprints:
+                    retired.append(dataset)
+                else:
+                    datasets[genome_uuid] = dataset
+            if retired:
+                self.file_client.datasets = datasets
+        for genome_uuid, replacement in replacements.items():
+            self.reloads += 1
+            print(
+                f"Reloaded genome {genome_uuid} from {replacement.datafile} - {replacement.version}"
+            )
+        for dataset in retired:
+            dataset.retire()
@@ -30,3 +30,12 @@ class QueryExecutionTimeExtension(Extension):
                 (time.perf_counter_ns() - self.start_timestamp) / 1000000000, 2
             )
             return {"execution_time_in_seconds": exec_time_in_secs}
+
+
+class QueryCostExtension(Extension):
+    """
+    Reports the static cost computed when the query was validated
+    """
+    def format(self, context):
+        if isinstance(context, dict) and "query_cost" in context:
+            return {"query_cost": context["query_cost"]}
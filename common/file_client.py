@@ -11,11 +11,22 @@
    See the License for the specific language governing permissions and
    limitations under the License.
 """
-import vcfpy
+import asyncio
 import json
 import os
 import glob
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from common.admission import AdmissionController, Overloaded
+from common.csq_offload import CsqOffload
+from common.file_model.frequency_filter import FrequencyFilter
 from common.file_model.variant import Variant
+from common.genome_dataset import GenomeDataset
+from common.dataset_watcher import DatasetWatcher
+from common.shared_cache import SharedCache
+from common.staging import StagingArea
+from common.tabix import BlockCache
 
 class FileClient:
     """
@@ -23,18 +34,50 @@ class FileClient:
     """
     def __init__(self, config):
         self.data_root = config.get("data_root")
+        self.datasets = {}
+        self.shared_cache = SharedCache.from_config(config)
+        self.block_cache = BlockCache.from_config(config)
+        self.staging = StagingArea.from_config(config)
+        self.csq_offload = CsqOffload.from_config(config)
+        self.watcher = DatasetWatcher(self, float(config.get("dataset_reload_interval", 60)))
+        self.request_timeout = float(config.get("request_timeout", 10))
+        self.fetches = AdmissionController.from_config(config, "fetches", 8, 64)
+        self.executor = ThreadPoolExecutor(self.fetches.max_concurrent, thread_name_prefix="fetch")
+        self.datasets_lock = threading.Lock()
+        self.inflight = {}
+        self.coalesced = 0
+        self.bloom_rejections = 0
         
     
     def get_variant_record(self, genome_uuid: str, variant_id: str):
         """
         Get a variant entry from variant_id
         """
-        datafile = os.path.join(self.data_root, genome_uuid, "variation.vcf.gz")
+        datafile = GenomeDataset.datafile_for(self.data_root, genome_uuid)
         if datafile:
-            self.collection = vcfpy.Reader.from_path(datafile)
-            self.header = self.collection.header
+            collection = self.acquire_dataset(genome_uuid)
+            header = collection.header
         else:
             print("Please check the directory path for the given genome uuid")
+        try:
+            return self.read_variant_record(collection, genome_uuid, variant_id)
+        finally:
+            collection.release()
+
+    def read_variant_record(self, collection: GenomeDataset, genome_uuid: str, variant_id: str):
+        """
+        Get a variant entry from variant_id in an acquired dataset
+        """
+        if not collection.may_contain(variant_id):
+            self.bloom_rejections += 1
+            return None
+
+        cache_key = f"{genome_uuid}:{collection.version}:{variant_id}".encode()
+        if self.shared_cache:
+            payload = self.shared_cache.get(cache_key)
+            if payload:
+                line, precomputed = json.loads(payload)
+                return self.make_variant(collection, line, collection.parse(line), precomputed)
 
         try: 
             [contig, pos, id] = self.split_variant_id(variant_id)
@@ -46,16 +89,318 @@ class FileClient:
         data = {}
         variant = None
         try:
-            for rec in self.collection.fetch(contig, pos-1, pos):
+            for line in collection.fetch(contig, pos-1, pos):
+                rec = collection.parse(line)
                 if rec.ID[0] == id:
-                    variant = Variant(rec, self.header, genome_uuid)
+                    precomputed = collection.get_precomputed(rec)
+                    variant = self.make_variant(collection, line, rec, precomputed)
+                    if self.shared_cache:
+                        self.shared_cache.set(cache_key, json.dumps([line, precomputed]).encode())
                     break
             return variant
         except:
             # Return None when variant cannot be fetched
             return
         
-        
+    async def fetch_variant_record(self, genome_uuid: str, variant_id: str, deadline: float = None):
+        """
+        Get a variant entry without blocking the event loop. Concurrent
+        lookups of the same variant share a single read and its result or
+        error, each waiting for it until its own deadline
+        """
+        dataset = self.datasets.get(genome_uuid)
+        if dataset is not None and dataset.acquire():
+            try:
+                may_contain = dataset.may_contain(variant_id)
+            finally:
+                dataset.release()
+            if not may_contain:
+                # Definite misses need neither a fetch slot nor a thread
+                self.bloom_rejections += 1
+                return None
+        if deadline is None:
+            deadline = time.monotonic() + self.request_timeout
+        key = (genome_uuid, variant_id)
+        read = self.inflight.get(key)
+        if read is None:
+            read = asyncio.ensure_future(self.read(deadline, self.get_variant_record, genome_uuid, variant_id))
+            self.inflight[key] = read
+
+            def forget(read):
+                if self.inflight.get(key) is read:
+                    del self.inflight[key]
+                if not read.cancelled():
+                    # Retrieve the error so it is not reported when every caller gave up
+                    read.exception()
+
+            read.add_done_callback(forget)
+        else:
+            self.coalesced += 1
+        return await self.wait_for_read(read, deadline)
+
+    async def fetch_indexed_variants(
+        self, genome_uuid: str, index: str, value: str, first: int, after: tuple = None, deadline: float = None
+    ):
+        """
+        Get a page of the variants of a gene or phenotype without blocking
+        the event loop, see get_indexed_variants
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.request_timeout
+        read = asyncio.ensure_future(
+            self.read(deadline, self.get_indexed_variants, genome_uuid, index, value, first, after)
+        )
+        read.add_done_callback(lambda read: read.cancelled() or read.exception())
+        return await self.wait_for_read(read, deadline)
+
+    async def fetch_region_variants(
+        self,
+        genome_uuid: str,
+        region: tuple,
+        first: int,
+        after: tuple = None,
+        population: str = None,
+        max_af: float = None,
+        deadline: float = None,
+    ):
+        """
+        Get a page of the variants in a region without blocking the event
+        loop, see get_region_variants
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.request_timeout
+        read = asyncio.ensure_future(
+            self.read(deadline, self.get_region_variants, genome_uuid, region, first, after, population, max_af)
+        )
+        read.add_done_callback(lambda read: read.cancelled() or read.exception())
+        return await self.wait_for_read(read, deadline)
+
+    async def fetch_variant_density(self, genome_uuid: str, region: tuple, max_bins: int, deadline: float = None):
+        """
+        Get the density tiles of a region without blocking the event loop,
+        see get_variant_density
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.request_timeout
+        read = asyncio.ensure_future(self.read(deadline, self.get_variant_density, genome_uuid, region, max_bins))
+        read.add_done_callback(lambda read: read.cancelled() or read.exception())
+        return await self.wait_for_read(read, deadline)
+
+    async def wait_for_read(self, read: asyncio.Future, deadline: float):
+        """
+        Waits for a read until the deadline, the read itself carries on
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(read), max(0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self.fetches.counters["timed_out"] += 1
+            raise Overloaded("fetches deadline exceeded", self.fetches.retry_after())
+
+    async def read(self, deadline: float, function, *args):
+        """
+        Runs a read in the thread pool behind the fetch admission limit.
+        The slot is held until the read finishes even when every caller gave
+        up at its deadline, so a slow backend never has more than
+        max_concurrent_fetches reads
+        """
+        granted = await self.fetches.acquire(deadline)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        finally:
+            self.fetches.release(granted)
+
+    def make_variant(self, collection: GenomeDataset, line: str, rec, precomputed) -> Variant:
+        """
+        Builds a variant from a parsed VCF line, with its CSQ decoded in the
+        process pool when it is very large
+        """
+        variant = Variant(rec, collection.header, collection.genome_uuid, precomputed)
+        if self.csq_offload:
+            self.csq_offload.decode(variant, collection.datafile, line)
+        return variant
+
+    def get_indexed_variants(self, genome_uuid: str, index: str, value: str, first: int, after: tuple = None):
+        """
+        Get up to first variants with a gene ("gene" index) or a phenotype
+        ("phenotype" index), in file order, starting after the
+        (contig_rank, pos, variant_id) key of a previous page. Returns None
+        when there is no such genome
+        """
+        datafile = GenomeDataset.datafile_for(self.data_root, genome_uuid)
+        if not os.path.isfile(datafile):
+            return None
+        collection = self.acquire_dataset(genome_uuid)
+        try:
+            rows = collection.find_variants(index, value, after, first + 1)
+            page = rows[:first]
+            order = {(contig, pos, variant_id): index for index, (_, contig, pos, variant_id) in enumerate(page)}
+            variants = []
+            for line in collection.fetch_variants(list(order)):
+                rec = collection.parse(line)
+                variants.append(self.make_variant(collection, line, rec, collection.get_precomputed(rec)))
+        finally:
+            collection.release()
+        # Records at the same position come in file order, pages follow the index order
+        variants.sort(key=lambda variant: order[(variant.chromosome, variant.position, variant.name)])
+        return {
+            "variants": variants,
+            "end_key": (page[-1][0], page[-1][2], page[-1][3]) if page else None,
+            "has_next_page": len(rows) > first,
+        }
+
+    def get_dataset(self, genome_uuid: str, stage: bool = True) -> GenomeDataset:
+        """
+        Get the dataset of a genome, keeping its header and index between requests.
+        The watcher replaces self.datasets as a whole when data_root changes,
+        under datasets_lock, so datasets are only added to the current dict
+        """
+        dataset = self.datasets.get(genome_uuid)
+        if dataset is None:
+            with self.datasets_lock:
+                dataset = self.datasets.get(genome_uuid)
+                if dataset is None:
+                    dataset = self.open_dataset(genome_uuid, stage)
+                    self.datasets[genome_uuid] = dataset
+        dataset.used = True
+        return dataset
+
+    def acquire_dataset(self, genome_uuid: str) -> GenomeDataset:
+        """
+        Get the dataset of a genome for a read, to be released with
+        dataset.release() once its files are no longer read. A dataset
+        closed by the watcher in the meantime has already been replaced
+        """
+        while True:
+            dataset = self.get_dataset(genome_uuid)
+            if dataset.acquire():
+                return dataset
+
+    def open_dataset(self, genome_uuid: str, stage: bool = True) -> GenomeDataset:
+        """
+        Opens the dataset of a genome from its staged local copy when there
+        is one, from data_root otherwise, queueing it for staging unless
+        stage is False
+        """
+        datafile = GenomeDataset.datafile_for(self.data_root, genome_uuid)
+        local_datafile = self.staging.locate(genome_uuid, datafile, stage) if self.staging else None
+        return GenomeDataset(genome_uuid, local_datafile or datafile, self.block_cache, source=datafile)
+
+    def get_region_variants(
+        self,
+        genome_uuid: str,
+        region: tuple,
+        first: int,
+        after: tuple = None,
+        population: str = None,
+        max_af: float = None,
+    ):
+        """
+        Get up to first variants overlapping a (contig, beg, end) region in
+        file order, starting after the (pos, variant_id) key of a previous
+        page. With a population, only variants with an allele at most max_af
+        frequent in it are returned, filtered before records are parsed.
+        Returns None when there is no such genome
+        """
+        datafile = GenomeDataset.datafile_for(self.data_root, genome_uuid)
+        if not os.path.isfile(datafile):
+            return None
+        collection = self.acquire_dataset(genome_uuid)
+        try:
+            predicate = FrequencyFilter(genome_uuid, collection.header, population, max_af) if population else None
+            lines, end_key, has_next_page = collection.scan(*region, first, after, predicate)
+            variants = []
+            for line in lines:
+                rec = collection.parse(line)
+                variants.append(self.make_variant(collection, line, rec, collection.get_precomputed(rec)))
+        finally:
+            collection.release()
+        return {"variants": variants, "end_key": end_key, "has_next_page": has_next_page}
+
+    def get_variant_density(self, genome_uuid: str, region: tuple, max_bins: int):
+        """
+        Get the precomputed variant counts of the bins overlapping a
+        (contig, beg, end) region, in at most max_bins bins where the zoom
+        levels allow. Bins keep their full extent at the region edges.
+        Returns None when there is no such genome
+        """
+        datafile = GenomeDataset.datafile_for(self.data_root, genome_uuid)
+        if not os.path.isfile(datafile):
+            return None
+        contig, beg, end = region
+        collection = self.acquire_dataset(genome_uuid)
+        try:
+            bin_size, tiles = collection.density(contig, beg, end, max_bins)
+        finally:
+            collection.release()
+        return {
+            "bin_size": bin_size,
+            "bins": [
+                {
+                    "start": bin_index * bin_size + 1,
+                    "end": (bin_index + 1) * bin_size,
+                    "count": count,
+                    "allele_types": [{"value": key, "count": value} for key, value in allele_types.items()],
+                    "most_severe_consequences": [{"value": key, "count": value} for key, value in consequences.items()],
+                }
+                for bin_index, count, allele_types, consequences in tiles
+            ],
+        }
+
+    def start(self) -> None:
+        """
+        Starts the background work of a serving process
+        """
+        self.watcher.start()
+        if self.staging:
+            self.staging.prestage(self.data_root)
+            # Genomes preloaded from data_root before the fork are staged
+            # from here, the watcher swaps in the copies once they are ready
+            for genome_uuid, dataset in list(self.datasets.items()):
+                if dataset.datafile == dataset.source and not self.staging.ready(genome_uuid, dataset.source):
+                    self.staging.schedule(genome_uuid, dataset.source)
+
+    def stop(self) -> None:
+        self.watcher.stop()
+        if self.csq_offload:
+            self.csq_offload.close()
+
+    def preload(self):
+        """
+        Load the dataset of every genome under data_root up front. This runs
+        in the pre-fork master, so nothing is queued for staging: the copy
+        would start a thread there, start() queues it in each worker instead
+        """
+        for genome_uuid in sorted(os.listdir(self.data_root)):
+            if os.path.isfile(GenomeDataset.datafile_for(self.data_root, genome_uuid)):
+                try:
+                    self.get_dataset(genome_uuid, stage=False)
+                except Exception as e:
+                    print(f"Cannot preload genome {genome_uuid} - {e}")
+        return list(self.datasets)
+
+    def get_stats(self):
+        """
+        Cache statistics of this worker process
+        """
+        return {
+            "shared_cache": self.shared_cache.stats() if self.shared_cache else None,
+            "block_cache": self.block_cache.stats() if self.block_cache else None,
+            "staging": self.staging.stats() if self.staging else None,
+            "csq_offload": self.csq_offload.stats() if self.csq_offload else None,
+            "datasets": {genome_uuid: dataset.version for genome_uuid, dataset in self.datasets.items()},
+            "dataset_reloads": self.watcher.reloads,
+            "fetches": self.fetches.stats(),
+            "single_flight": {"inflight": len(self.inflight), "coalesced": self.coalesced},
+            "bloom_filters": {
+                "rejections": self.bloom_rejections,
+                "genomes": {
+                    genome_uuid: dataset.bloom_filter.stats()
+                    for genome_uuid, dataset in self.datasets.items()
+                    if dataset.bloom_filter
+                },
+            },
+        }
+
     def split_variant_id(self, variant_id: str):
         """
         Splits variant_id into separate fields
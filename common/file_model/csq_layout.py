@@ -0,0 +1,78 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Any, Dict, List, Mapping, Tuple
+import weakref
+
+from common.file_model.population_registry import get_population_registry
+
+# Column positions per header, keyed by id() as vcfpy headers are not
+# hashable, and dropped together with the header
+_csq_layouts: Dict[int, Dict] = {}
+_population_plans: Dict[int, Dict] = {}
+
+
+def _per_header(cache: Dict[int, Dict], header: Any) -> Dict:
+    key = id(header)
+    if key not in cache:
+        cache[key] = {}
+        weakref.finalize(header, cache.pop, key, None)
+    return cache[key]
+
+
+def get_csq_layout(header: Any, info_id: str = "CSQ") -> Mapping[str, int]:
+    """
+    Maps each field of a pipe-separated INFO field (CSQ by default) to its
+    column, as described by the "Format: " part of the header description.
+    Parsed once per header
+    """
+    layouts = _per_header(_csq_layouts, header)
+    if info_id not in layouts:
+        info_field = header.get_info_field_info(info_id).description
+        layout = {}
+        for index, value in enumerate(info_field.split("Format: ")[1].split("|")):
+            layout.setdefault(value, index)
+        layouts[info_id] = layout
+    return layouts[info_id]
+
+
+def get_population_plan(
+    genome_uuid: str, header: Any
+) -> List[Tuple[str, List[Tuple[str, int]]]]:
+    """
+    Lists every sub-population of a genome with the CSQ columns holding its
+    (frequency metric, column) pairs. Metrics missing from the file are left
+    out. Rebuilt when the population registry loads a new version
+    """
+    plans = _per_header(_population_plans, header)
+    registry = get_population_registry()
+    genome_populations = registry.get(genome_uuid)
+    version = registry.version
+    if genome_uuid not in plans or plans[genome_uuid][0] != version:
+        if genome_populations is None:
+            print(f"No population mapping for - {genome_uuid}")
+        frequency_fields = (
+            genome_populations.frequency_fields if genome_populations else []
+        )
+        layout = get_csq_layout(header)
+        plan = []
+        for population_name, frequencies in frequency_fields:
+            frequency_columns = [
+                (freq_key, layout[freq_val])
+                for freq_key, freq_val in frequencies.items()
+                if layout.get(freq_val)
+            ]
+            plan.append((population_name, frequency_columns))
+        plans[genome_uuid] = (version, plan)
+    return plans[genome_uuid][1]
@@ -0,0 +1,114 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Any, Optional
+
+from common.file_model.csq_layout import get_csq_layout, get_population_plan
+
+
+class UnknownPopulation(ValueError):
+    """
+    Raised when a genome has no frequencies for a population
+    """
+
+    def __init__(self, genome_uuid: str, population: str) -> None:
+        self.genome_uuid = genome_uuid
+        self.population = population
+        super().__init__(
+            f"No frequencies for population {population} in genome {genome_uuid}"
+        )
+
+
+class FrequencyFilter:
+    """
+    Tests the allele frequencies of a population on raw VCF lines, before
+    they are parsed. Only the CSQ columns of the population are read, with
+    the columns compiled in the population plan of the genome, and each
+    allele is looked at once however many transcripts it has records for.
+
+    A line passes when one of its alleles has a frequency of at most max_af
+    in the population, or no frequency at all, as absent alleles are the
+    rarest ones. Like traverse_population_info, the frequency is computed
+    from the allele count and number when the file has no AF for it
+    """
+
+    def __init__(
+        self, genome_uuid: str, header: Any, population: str, max_af: float
+    ) -> None:
+        columns = dict(get_population_plan(genome_uuid, header)).get(population)
+        if not columns:
+            raise UnknownPopulation(genome_uuid, population)
+        columns = dict(columns)
+        self.af_column = columns.get("af")
+        self.ac_column = columns.get("ac")
+        self.an_column = columns.get("an")
+        self.allele_column = get_csq_layout(header).get("Allele", 0)
+        used = [
+            column
+            for column in (
+                self.af_column,
+                self.ac_column,
+                self.an_column,
+                self.allele_column,
+            )
+            if column is not None
+        ]
+        # Columns after the last one needed are left unsplit
+        self.max_split = max(used) + 1
+        self.max_af = max_af
+
+    def allele_frequency(self, columns: list) -> Optional[float]:
+        if self.af_column is not None and columns[self.af_column]:
+            return float(columns[self.af_column])
+        if self.ac_column is not None and self.an_column is not None:
+            allele_count, allele_number = (
+                columns[self.ac_column],
+                columns[self.an_column],
+            )
+            if allele_count and allele_number and int(allele_number):
+                return int(allele_count) / int(allele_number)
+        return None
+
+    def __call__(self, info: str) -> bool:
+        """
+        Tests the INFO column of a VCF line
+        """
+        start = info.find("CSQ=")
+        if start < 0:
+            return True
+        if start and info[start - 1] != ";":
+            start = info.find(";CSQ=") + 1
+            if not start:
+                return True
+        end = info.find(";", start)
+        csq = info[start + 4 : end if end >= 0 else len(info)]
+        seen = set()
+        for csq_record in csq.split(","):
+            if self.allele_column == 0 and csq_record[: csq_record.find("|")] in seen:
+                # Records of transcripts of an allele that was already tested
+                continue
+            columns = csq_record.split("|", self.max_split)
+            if len(columns) <= self.max_split - 1:
+                continue
+            allele = columns[self.allele_column]
+            if allele in seen:
+                continue
+            seen.add(allele)
+            try:
+                allele_frequency = self.allele_frequency(columns)
+            except ValueError:
+                allele_frequency = None
+            if allele_frequency is None or allele_frequency <= self.max_af:
+                return True
+        return not seen
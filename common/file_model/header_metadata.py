@@ -0,0 +1,86 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Any, Dict, Mapping, Optional, Tuple
+from types import MappingProxyType
+import re
+import weakref
+
+# Snapshots per header, keyed by id() as vcfpy headers are not hashable,
+# and dropped together with the header
+_snapshots: Dict[int, "HeaderMetadata"] = {}
+
+
+class HeaderMetadata:
+    """
+    What variants need from the header of a VCF, parsed once: the VEP
+    version, the sources with their description, URL and version, the
+    contigs with their lengths and the INFO definitions. It is never
+    modified once built, so every Variant of the file, in any thread,
+    shares the same one
+    """
+
+    def __init__(self, header: Any) -> None:
+        vep_lines = header.get_lines("VEP")
+        vep_version = re.search(r"v\d+", vep_lines[0].value) if vep_lines else None
+        self.vep_version: Optional[str] = vep_version.group() if vep_version else None
+
+        sources = {}
+        # Source of the variants without a SOURCE, the first one of the header
+        self.default_source: Optional[str] = None
+        for source_line in header.get_lines("source"):
+            try:
+                source, source_info_line = source_line.value.split('" ', 1)
+            except ValueError:
+                print(
+                    f"Ignoring source header line without details - {source_line.value}"
+                )
+                continue
+            source = source.strip('"').replace(" ", "_")
+            if self.default_source is None:
+                self.default_source = source
+            # A later line for the same source replaces an earlier one
+            sources[source] = MappingProxyType(
+                dict(re.findall(r'(.+?)="(.+?)"\s*', source_info_line))
+            )
+        self.sources: Mapping[str, Mapping[str, str]] = MappingProxyType(sources)
+
+        self.contigs: Tuple[Tuple[str, Optional[int]], ...] = tuple(
+            (
+                line.mapping["ID"],
+                int(line.mapping["length"]) if "length" in line.mapping else None,
+            )
+            for line in header.get_lines("contig")
+        )
+        self.info: Mapping[str, Any] = MappingProxyType(
+            {
+                info_id: header.get_info_field_info(info_id)
+                for info_id in header.info_ids()
+            }
+        )
+
+
+def get_header_metadata(header: Any) -> HeaderMetadata:
+    """
+    The metadata snapshot of a header, built on first use. Two threads may
+    both build it, in which case one of the equal snapshots is kept
+    """
+    key = id(header)
+    snapshot = _snapshots.get(key)
+    if snapshot is None:
+        built = HeaderMetadata(header)
+        snapshot = _snapshots.setdefault(key, built)
+        if snapshot is built:
+            weakref.finalize(header, _snapshots.pop, key, None)
+    return snapshot
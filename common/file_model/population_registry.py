@@ -0,0 +1,191 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Dict, List, Mapping, Optional, Tuple
+from functools import lru_cache
+import json
+import os
+import threading
+import time
+
+DIRECTORY = os.path.dirname(__file__)
+# Descriptions of the populations of every genome and how they nest
+METADATA_FILE = os.path.join(DIRECTORY, "population_metadata.json")
+# CSQ fields holding the frequencies of the populations of every genome
+FREQUENCIES_FILE = os.path.join(DIRECTORY, "populations.json")
+
+
+class Population:
+    """
+    A population of a genome. Its super-population and sub-populations are
+    the Population objects of the same genome, not copies
+    """
+
+    def __init__(self, metadata: Mapping) -> None:
+        self.name = metadata["name"]
+        self.description = metadata.get("description")
+        self.type = metadata.get("type")
+        self.is_global = metadata.get("is_global")
+        self.display_group_name = metadata.get("display_group_name")
+        self.super_population: Optional["Population"] = None
+        self.sub_populations: List["Population"] = []
+
+
+class GenomePopulations:
+    """
+    The populations of one genome, indexed by name, by display group and by
+    whether they are global, with the CSQ fields of their frequencies
+    """
+
+    def __init__(
+        self, metadata: List[Mapping], frequencies: Mapping[str, List[Mapping]]
+    ) -> None:
+        self.populations = [Population(population) for population in metadata]
+        self.by_name: Dict[str, Population] = {
+            population.name: population for population in self.populations
+        }
+        for population, population_metadata in zip(self.populations, metadata):
+            super_population = population_metadata.get("super_population")
+            if super_population:
+                population.super_population = self.by_name.get(super_population["name"])
+            population.sub_populations = [
+                self.by_name[sub_population["name"]]
+                for sub_population in population_metadata.get("sub_populations") or []
+                if sub_population["name"] in self.by_name
+            ]
+        self.by_display_group: Dict[str, List[Population]] = {}
+        for population in self.populations:
+            self.by_display_group.setdefault(population.display_group_name, []).append(
+                population
+            )
+        self.global_populations = [
+            population for population in self.populations if population.is_global
+        ]
+        # (population, {frequency metric: CSQ field}) in the order of the frequencies file
+        self.frequency_fields: List[Tuple[str, Mapping[str, str]]] = [
+            (sub_population["name"], sub_population["frequencies"])
+            for group in frequencies.values()
+            for sub_population in group
+        ]
+
+    def find(
+        self,
+        name: Optional[str] = None,
+        is_global: Optional[bool] = None,
+        display_group_name: Optional[str] = None,
+    ) -> List[Population]:
+        """
+        Populations matching every filter given, in file order. The most
+        selective index available is used first
+        """
+        if name is not None:
+            candidates = [self.by_name[name]] if name in self.by_name else []
+        elif display_group_name is not None:
+            candidates = self.by_display_group.get(display_group_name, [])
+        elif is_global:
+            candidates = self.global_populations
+        else:
+            candidates = self.populations
+        return [
+            population
+            for population in candidates
+            if (is_global is None or population.is_global == is_global)
+            and (
+                display_group_name is None
+                or population.display_group_name == display_group_name
+            )
+        ]
+
+
+class PopulationRegistry:
+    """
+    Populations of every genome, loaded once from the metadata and
+    frequencies files. The files are checked for changes at most every
+    refresh_interval seconds when the registry is used, polling like the
+    dataset watcher does, and a changed pair is loaded and swapped in as a
+    whole. Callers holding the genomes of the previous version keep a
+    consistent view. version changes with every load
+    """
+
+    def __init__(
+        self, metadata_file: str, frequencies_file: str, refresh_interval: float
+    ) -> None:
+        self.metadata_file = metadata_file
+        self.frequencies_file = frequencies_file
+        self.refresh_interval = refresh_interval
+        self.genomes: Dict[str, GenomePopulations] = {}
+        self.version = 0
+        self.fingerprint = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+        self.refresh()
+
+    @classmethod
+    def from_config(cls, config: Mapping) -> "PopulationRegistry":
+        return cls(
+            METADATA_FILE,
+            FREQUENCIES_FILE,
+            float(config.get("population_refresh_interval", 60)),
+        )
+
+    def files_fingerprint(self) -> Tuple:
+        return tuple(
+            (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            for stat in (os.stat(self.metadata_file), os.stat(self.frequencies_file))
+        )
+
+    def refresh(self) -> None:
+        """
+        Loads the files when they changed since they were last loaded. A
+        file that cannot be read or parsed leaves the loaded populations in
+        place
+        """
+        with self.lock:
+            self.checked_at = time.monotonic()
+            try:
+                fingerprint = self.files_fingerprint()
+                if fingerprint == self.fingerprint:
+                    return
+                with open(self.metadata_file) as metadata_file:
+                    metadata = json.load(metadata_file)
+                with open(self.frequencies_file) as frequencies_file:
+                    frequencies = json.load(frequencies_file)
+                genomes = {
+                    genome_uuid: GenomePopulations(
+                        metadata.get(genome_uuid, []), frequencies.get(genome_uuid, {})
+                    )
+                    for genome_uuid in metadata.keys() | frequencies.keys()
+                }
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"Cannot load populations, keeping those loaded - {e}")
+                return
+            self.genomes = genomes
+            self.fingerprint = fingerprint
+            self.version += 1
+
+    def get(self, genome_uuid: str) -> Optional[GenomePopulations]:
+        if (
+            self.refresh_interval > 0
+            and time.monotonic() - self.checked_at >= self.refresh_interval
+        ):
+            self.refresh()
+        return self.genomes.get(genome_uuid)
+
+
+@lru_cache(maxsize=None)
+def get_population_registry() -> PopulationRegistry:
+    """
+    The registry of the process, loaded on first use
+    """
+    return PopulationRegistry.from_config(os.environ)
@@ -12,14 +12,17 @@
    limitations under the License.
 """
 
-from typing import Any, Mapping, List, Union
+from typing import Any, Mapping, List, Union, Tuple
 import re
 import os
 import json
 import operator
 from functools import reduce
+import numpy as np
 from common.file_model.variant_allele import VariantAllele
 from common.file_model.utils import minimise_allele
+from common.file_model.csq_layout import get_csq_layout, get_population_plan
+from common.file_model.header_metadata import get_header_metadata
 
 def reduce_allele_length(allele_list: List):
     allele_length = -1
@@ -28,60 +31,89 @@ def reduce_allele_length(allele_list: List):
             allele_length = len(allele.value)
     return allele_length
 
+def sum_rows(frequencies: np.ndarray) -> np.ndarray:
+    """
+    Adds up rows one at a time so that every column is summed
+    in allele order, exactly as a Python sum over the alleles would
+    """
+    total = np.zeros(frequencies.shape[1])
+    for row in frequencies:
+        total += row
+    return total
+
+def flag_minor_alleles(frequencies: np.ndarray, present: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Marks minor alleles and HPMAF in an alleles x populations frequency table.
+    Rows are in allele order with the reference allele last and
+    only cells set in present take part.
+
+    Within a population the minor allele is the allele with the highest
+    frequency below the major allele frequency; on a tie the allele
+    that comes last wins. A minor allele frequency of 0 marks every
+    remaining allele in that population. HPMAF marks every minor allele
+    sharing the highest minor allele frequency across all populations.
+    """
+    values = np.where(present, frequencies, -np.inf)
+    enough_alleles = present.sum(axis=0) >= 2
+    highest_frequency = values.max(axis=0)
+    below_highest = present & (frequencies < highest_frequency) & enough_alleles
+    maf_frequency = np.where(below_highest, frequencies, -np.inf).max(axis=0)
+    maf_candidates = below_highest & (frequencies == maf_frequency)
+
+    # last candidate row per population, counted from the bottom of the table
+    last_candidate = frequencies.shape[0] - 1 - np.argmax(maf_candidates[::-1], axis=0)
+    is_minor_allele = np.zeros(frequencies.shape, dtype=bool)
+    has_candidate = maf_candidates.any(axis=0)
+    is_minor_allele[last_candidate[has_candidate], np.flatnonzero(has_candidate)] = True
+    is_minor_allele |= maf_candidates & (maf_frequency == 0)
+
+    is_hpmaf = np.zeros(frequencies.shape, dtype=bool)
+    if is_minor_allele.any():
+        hpmaf_frequency = frequencies[is_minor_allele].max()
+        is_hpmaf = is_minor_allele & (frequencies == hpmaf_frequency)
+    return is_minor_allele, is_hpmaf
 
 
-class Variant ():
-    variant_sources = {}       ## used to cache source information, class attribute
 
-    def __init__(self, record: Any, header: Any, genome_uuid: str) -> None:
+class Variant ():
+    def __init__(self, record: Any, header: Any, genome_uuid: str, precomputed: Mapping = None) -> None:
         self.genome_uuid = genome_uuid
         self.name = record.ID[0]
         self.record = record 
         self.header = header
+        self.metadata = get_header_metadata(header)     ## shared by all variants of the file
         self.chromosome = record.CHROM         ###TODO: convert the contig name in the file to match the chromosome id given in the payload 
         self.position = record.POS
         self.alts = record.ALT
         self.ref = record.REF
         self.info = record.INFO
         self.type = "Variant"
-        self.vep_version = re.search("v\d+", self.header.get_lines("VEP")[0].value).group()
+        self.vep_version = self.metadata.vep_version
         self.population_map = {}
+        self.precomputed = precomputed or {}     ## derived fields read from the sidecar, if any
+        self.decoded_csq = None     ## allele info maps decoded in another process, see CsqOffload
     
     def get_alternative_names(self) -> List:
         return []
     
-    def parse_source_from_header(self) -> Mapping:
-        genome_uuid = self.genome_uuid
-        if genome_uuid not in self.variant_sources:
-            self.variant_sources[genome_uuid] = {}
-
-        source_header_lines = self.header.get_lines("source")
-        for source_header_line in source_header_lines:
-            source, source_info_line = source_header_line.value.split("\" ", 1)
-            
-            source = source.strip('"').replace(" ", "_")
-            source_info = dict(re.findall('(.+?)="(.+?)"\s*', source_info_line))
-
-            ## overwrite is allowed
-            self.variant_sources[genome_uuid][source] = source_info
-
     def get_primary_source(self) -> Mapping:
         """
         Fetches source from variant INFO columns
         Fallsback to fetching from the header
         """
+        if "primary_source" in self.precomputed:
+            return self.precomputed["primary_source"]
 
         try:
             if "SOURCE" in self.info:
                 source = self.info["SOURCE"]
+            elif self.metadata.default_source is not None:
+                source = self.metadata.default_source
             else:
-                source = self.header.get_lines("source")[0].value
+                return None
 
-            # Get source information from data file header header
-            genome_uuid = self.genome_uuid
-            if genome_uuid not in self.variant_sources or source not in self.variant_sources[genome_uuid]:     
-                self.parse_source_from_header()
-            variant_sources = self.variant_sources[genome_uuid]
+            # Get source information from data file header
+            variant_sources = self.metadata.sources
 
             if source in variant_sources:
                 source_info = variant_sources[source]
@@ -246,6 +278,8 @@ class Variant ():
         return variant_allele_list
     
     def get_most_severe_consequence(self) -> Mapping:
+        if "most_severe_consequence" in self.precomputed:
+            return self.precomputed["most_severe_consequence"]
         consequence_index = self.get_info_key_index("Consequence")
         consequence_map = {}
         directory = os.path.dirname(__file__)
@@ -294,143 +328,103 @@ class Variant ():
             return aa_prediction_result
     
     def get_info_key_index(self, key: str, info_id: str ="CSQ") -> int:
-            info_field = self.header.get_info_field_info(info_id).description
-            csq_list = info_field.split("Format: ")[1].split("|")
-            for index, value in enumerate(csq_list):
-                if value == key:
-                    return index   
+            return get_csq_layout(self.header, info_id).get(key)
                 
     def traverse_population_info(self) -> Mapping:
-        directory = os.path.dirname(__file__)
-        with open(os.path.join(directory,'populations.json')) as pop_file:
-            pop_mapping_all = json.load(pop_file)
-            try:
-                pop_mapping = pop_mapping_all[self.genome_uuid]
-            except:
-                pop_mapping = {}
-                print(f"No population mapping for - {self.genome_uuid}")
+        population_plan = get_population_plan(self.genome_uuid, self.header)
 
         population_frequency_map = {}
+        allele_index = self.get_info_key_index("Allele") 
         for csq_record in self.info["CSQ"]:
             csq_record_list = csq_record.split("|")
-            allele_index = self.get_info_key_index("Allele") 
             if csq_record_list[allele_index] is not None and csq_record_list[allele_index] not in population_frequency_map.keys():
                 population_frequency_map[csq_record_list[allele_index]] = {}
-                for pop_key, pop in pop_mapping.items():
-                    for sub_pop in pop:
-                        if sub_pop["name"] in population_frequency_map[csq_record_list[allele_index]]:
-                            continue
-                        allele_count = allele_number = allele_frequency = None
-                        for freq_key, freq_val in sub_pop["frequencies"].items():
-                            col_index = self.get_info_key_index(freq_val)
-                            if col_index and csq_record_list[col_index] is not None:
-                                if freq_key == "af":
-                                    allele_frequency = csq_record_list[col_index] or None
-                                elif freq_key == "an":
-                                    allele_number = csq_record_list[col_index] or None
-                                elif freq_key == "ac":
-                                    allele_count = csq_record_list[col_index] or None
-                                else:
-                                    raise Exception('Frequency metric is not recognised')
+                for pop_name, frequency_columns in population_plan:
+                    if pop_name in population_frequency_map[csq_record_list[allele_index]]:
+                        continue
+                    allele_count = allele_number = allele_frequency = None
+                    for freq_key, col_index in frequency_columns:
+                        if csq_record_list[col_index] is not None:
+                            if freq_key == "af":
+                                allele_frequency = csq_record_list[col_index] or None
+                            elif freq_key == "an":
+                                allele_number = csq_record_list[col_index] or None
+                            elif freq_key == "ac":
+                                allele_count = csq_record_list[col_index] or None
+                            else:
+                                raise Exception('Frequency metric is not recognised')
   
-                        if allele_frequency is None:
-                                try:  
-                                    # calculating allele frequency on fly
-                                    allele_frequency = int(allele_count)/int(allele_number)
-                                except:
-                                    print(f"Cannot calculate AF using expression - {allele_count}/{allele_number}")
-
-                        if allele_frequency is not None:
-                            population_frequency = {
-                                            "population_name": sub_pop["name"],
-                                            "allele_frequency": float(allele_frequency),
-                                            "allele_count": allele_count,
-                                            "allele_number": allele_number,
-                                            "is_minor_allele": False,
-                                            "is_hpmaf": False
-                                        }
-                            population_frequency_map[csq_record_list[allele_index]][sub_pop["name"]] = population_frequency
+                    if allele_frequency is None:
+                            try:  
+                                # calculating allele frequency on fly
+                                allele_frequency = int(allele_count)/int(allele_number)
+                            except:
+                                print(f"Cannot calculate AF using expression - {allele_count}/{allele_number}")
+
+                    if allele_frequency is not None:
+                        population_frequency = {
+                                        "population_name": pop_name,
+                                        "allele_frequency": float(allele_frequency),
+                                        "allele_count": allele_count,
+                                        "allele_number": allele_number,
+                                        "is_minor_allele": False,
+                                        "is_hpmaf": False
+                                    }
+                        population_frequency_map[csq_record_list[allele_index]][pop_name] = population_frequency
         return population_frequency_map
     
     def set_frequency_flags(self):
         """
-        Calculates MAF (minor allele frequency) and  HPMAF by iterating through each allele 
+        Calculates MAF (minor allele frequency) and  HPMAF over a dense
+        (alleles + reference) x populations frequency table
         """
+        if "population_frequencies" in self.precomputed:
+            return self.precomputed["population_frequencies"]
 
-        directory = os.path.dirname(__file__)
-        with open(os.path.join(directory,'populations.json')) as pop_file:
-            pop_mapping_all = json.load(pop_file)
-            try:
-                pop_mapping = pop_mapping_all[self.genome_uuid]
-            except:
-                pop_mapping = {}
-                print(f"No population mapping for - {self.genome_uuid}")
-        pop_names = []
-        for pop in pop_mapping.values():
-            pop_names.extend([sub_pop["name"] for sub_pop in pop])
-        hpmaf = []
+        population_plan = get_population_plan(self.genome_uuid, self.header)
+        pop_names = list(dict.fromkeys(pop_name for pop_name, _ in population_plan))
         pop_frequency_map = self.traverse_population_info()
         if not pop_frequency_map:
             return pop_frequency_map 
 
-        pop_frequency_map_transpose = {pop_name:{pop_allele:pop_frequency_map[pop_allele][pop_name] 
-                                                 for pop_allele in pop_frequency_map 
-                                                 if pop_name in pop_frequency_map[pop_allele]} 
-                                                 for pop_name in pop_names}
-
-        for pop_name in pop_frequency_map_transpose:
-            by_population = []
-            for pop_allele,pop_allele_freq in pop_frequency_map_transpose[pop_name].items():     
-                by_population.append([float(pop_allele_freq["allele_frequency"]),pop_allele, pop_name]) 
-            if not len(by_population):
-                continue
-            ## Add population frequency for reference allele
-            ref_allele = minimise_allele(self.ref,self.ref)
-            allele_frequency_ref = 1 - float(sum(list(zip(*by_population))[0]))
-            if allele_frequency_ref <= 1 and allele_frequency_ref >= 0:
-                population_frequency_ref = {
-                                                "population_name": pop_name,
-                                                "allele_frequency": allele_frequency_ref ,
-                                                "allele_count": None,
-                                                "allele_number": None,
-                                                "is_minor_allele": False,
-                                                "is_hpmaf": False
-                                            }
-                if ref_allele not in pop_frequency_map:
-                    pop_frequency_map[ref_allele] = {}
-                pop_frequency_map[ref_allele][pop_name] = population_frequency_ref
-                by_population.append([allele_frequency_ref,ref_allele,pop_name])    
-            
-            by_population_sorted = sorted(by_population, key=lambda item: item[0])
-            if len(by_population_sorted) >= 2:
-                highest_frequency = by_population_sorted[-1][0]
-                maf_frequency = None
-                # When more than one allele has same maf and is not 
-                # ref allele, we mark it as is_minor_allele
-                for pop in reversed(by_population_sorted[:-1]):
-                    if pop[0] == highest_frequency:
-                        continue
-                    elif pop[0] < highest_frequency and not maf_frequency:
-                        maf_frequency, maf_allele, maf_population = pop
-                        pop_frequency_map[maf_allele][maf_population]["is_minor_allele"] = True
-                        hpmaf.append([maf_frequency,maf_allele,maf_population])
-                    elif maf_frequency and pop[0] == maf_frequency and maf_allele != ref_allele:
-                        pop_frequency_map[maf_allele][maf_population]["is_minor_allele"] = True
-                        hpmaf.append([maf_frequency,maf_allele,maf_population])
-                    elif maf_frequency and pop[0] < maf_frequency:
-                        break
-        if len(hpmaf) > 0:
-            hpmaf_sorted = sorted(hpmaf, key=lambda item: item[0])
-            hpmaf_frequency, hpmaf_allele, hpmaf_population = hpmaf_sorted[-1]
-            pop_frequency_map[hpmaf_allele][hpmaf_population]["is_hpmaf"] = True
-            # When more than one allele has same maf, we mark it as is_hpmaf
-            for hpmaf_pop in reversed(hpmaf_sorted[:-1]):
-                if hpmaf_pop[0] == hpmaf_frequency:
-                    hpmaf_frequency, hpmaf_allele, hpmaf_population = hpmaf_pop
-                    pop_frequency_map[hpmaf_allele][hpmaf_population]["is_hpmaf"] = True
-                elif hpmaf_pop[0] < hpmaf_frequency:
-                    break
+        ## Last row is kept for the reference allele
+        alleles = list(pop_frequency_map.keys())
+        frequencies = np.zeros((len(alleles) + 1, len(pop_names)))
+        present = np.zeros(frequencies.shape, dtype=bool)
+        for row, pop_allele in enumerate(alleles):
+            for column, pop_name in enumerate(pop_names):
+                if pop_name in pop_frequency_map[pop_allele]:
+                    frequencies[row, column] = pop_frequency_map[pop_allele][pop_name]["allele_frequency"]
+                    present[row, column] = True
+
+        ## Add population frequency for reference allele
+        ref_allele = minimise_allele(self.ref,self.ref)
+        allele_frequency_ref = 1 - sum_rows(frequencies[:-1])
+        ref_present = present[:-1].any(axis=0) & (allele_frequency_ref >= 0) & (allele_frequency_ref <= 1)
+        frequencies[-1] = allele_frequency_ref
+        present[-1] = ref_present
+        for column in np.flatnonzero(ref_present):
+            pop_name = pop_names[column]
+            population_frequency_ref = {
+                                            "population_name": pop_name,
+                                            "allele_frequency": float(allele_frequency_ref[column]) ,
+                                            "allele_count": None,
+                                            "allele_number": None,
+                                            "is_minor_allele": False,
+                                            "is_hpmaf": False
+                                        }
+            if ref_allele not in pop_frequency_map:
+                pop_frequency_map[ref_allele] = {}
+            pop_frequency_map[ref_allele][pop_name] = population_frequency_ref
+        alleles.append(ref_allele)
+
+        is_minor_allele, is_hpmaf = flag_minor_alleles(frequencies, present)
+        for row, column in zip(*np.nonzero(is_minor_allele)):
+            pop_frequency_map[alleles[row]][pop_names[column]]["is_minor_allele"] = True
+        for row, column in zip(*np.nonzero(is_hpmaf)):
+            pop_frequency_map[alleles[row]][pop_names[column]]["is_hpmaf"] = True
         return pop_frequency_map
+
     def get_web_display_data(self)-> Mapping:
         n_citations = self.info["NCITE"] if "NCITE" in self.info else 0
         return {
@@ -438,6 +432,8 @@ class Variant ():
         }
     
     def get_statistics_info(self)-> Mapping:
+        if "statistics_info" in self.precomputed:
+            return self.precomputed["statistics_info"]
         alleles = [i.value for i in self.alts]
         statistics_info = {}
         
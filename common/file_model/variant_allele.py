@@ -31,7 +31,21 @@ class VariantAllele():
         self.allele_sequence = alt
         self.reference_sequence = variant.ref
         self.population_map = []
-        self.info_map = self.traverse_csq_info()
+        self._info_map = None
+
+    @property
+    def info_map(self) -> Mapping:
+        """
+        CSQ fields of this allele, decoded on first use. Variants with a
+        very large CSQ come with it already decoded in another process
+        """
+        if self._info_map is None:
+            decoded_csq = self.variant.decoded_csq
+            if decoded_csq is not None and self.allele_sequence in decoded_csq:
+                self._info_map = decoded_csq[self.allele_sequence]
+            else:
+                self._info_map = self.traverse_csq_info()
+        return self._info_map
 
     def get_allele_type(self):
         #TODO: change this to VariantAllele level
@@ -68,7 +82,8 @@ class VariantAllele():
     def traverse_csq_info(self) -> Mapping:
         """
         This function is to traverse the CSQ record and extract columns
-        corresponding to Consequence, SIFT, PolyPhen, CADD
+        corresponding to Consequence, SIFT, PolyPhen, CADD. Only the records
+        of this allele are decoded, the getters never look at the others
         """
         column_list = ["Allele", "PHENOTYPES", "Feature_type", "Feature", "Consequence",
                         "SIFT", "PolyPhen", "SPDI", "CADD_PHRED","Conservation", "Gene", "SYMBOL",
@@ -79,9 +94,12 @@ class VariantAllele():
                     prediction_index_map[col.lower()] = self.variant.get_info_key_index(col) 
 
         info_map = {}
+        min_alt = minimise_allele(self.alt, self.reference_sequence)
         for csq_record in self.variant.info["CSQ"]:
             csq_record_list = csq_record.split("|")
             allele = csq_record_list[prediction_index_map["allele"]]
+            if allele != min_alt:
+                continue
 
             if allele not in info_map.keys():
                 info_map[allele] = {"phenotype_assertions": [], "predicted_molecular_consequences": [], "prediction_results": []} 
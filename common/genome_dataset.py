@@ -0,0 +1,317 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Any, Callable, Iterator, List, Mapping, Optional, Tuple
+import os
+import threading
+
+import vcfpy
+
+from common.bloom_filter import BloomFilter, bloom_filter_path
+from common.file_model.csq_layout import get_csq_layout, get_population_plan
+from common.file_model.header_metadata import get_header_metadata
+from common.pipeline.sidecar import TILE_BIN_SIZES, Sidecar, sidecar_path
+from common.tabix import BlockCache, TabixFile
+
+DATAFILE_NAME = "variation.vcf.gz"
+# Variants found through an index that are at most this many bases apart
+# are read with a single tabix fetch
+MERGE_DISTANCE = 4096
+# Records looked at for one page of a region scan, so that a selective
+# filter over a large region returns within a bounded time
+MAX_SCANNED_RECORDS = 50000
+
+
+class IndexNotAvailable(Exception):
+    """
+    Raised when the sidecar of a genome is missing or has no such index
+    """
+
+    def __init__(self, genome_uuid: str, index: str) -> None:
+        self.genome_uuid = genome_uuid
+        self.index = index
+        super().__init__(f"No {index} index for genome {genome_uuid}")
+
+
+class GenomeDataset:
+    """
+    Read-only structures for the VCF of one genome: parsed header and its
+    metadata snapshot, record parser, CSQ layout, population plan and
+    tabix index. Built once per process, or once in the master before
+    workers are forked.
+
+    version identifies the files the dataset was built from, so that a
+    replaced VCF, index or sidecar gives a new dataset with a new version.
+    When datafile is a local copy, source is the file under data_root it
+    was copied from and the version is that of the source.
+
+    Every read of the files holds the dataset between acquire and release.
+    A dataset the watcher retired is closed when its last read releases
+    it, so long reads such as exports never lose their files
+    """
+
+    def __init__(
+        self,
+        genome_uuid: str,
+        datafile: str,
+        block_cache: BlockCache = None,
+        source: str = None,
+    ) -> None:
+        self.genome_uuid = genome_uuid
+        self.datafile = datafile
+        self.source = source or datafile
+        self.version = self.fingerprint(self.source)
+        # Set on every request, cleared by the dataset watcher
+        self.used = False
+        self.users = 0
+        self.retired = False
+        self.closed = False
+        self.users_lock = threading.Lock()
+        self.sidecar = None
+        self.sidecar_loaded = False
+        self.sidecar_lock = threading.Lock()
+        self.reader = vcfpy.Reader.from_path(datafile)
+        self.header = self.reader.header
+        self.metadata = get_header_metadata(self.header)
+        self.tabix_file = TabixFile(
+            datafile, block_cache=block_cache, info_end="END" in self.metadata.info
+        )
+        self.bloom_filter = BloomFilter.open_for(datafile)
+        get_csq_layout(self.header)
+        get_population_plan(genome_uuid, self.header)
+
+    @classmethod
+    def datafile_for(cls, data_root: str, genome_uuid: str) -> str:
+        return os.path.join(data_root, genome_uuid, DATAFILE_NAME)
+
+    @classmethod
+    def dataset_files(cls, datafile: str) -> List[str]:
+        """
+        The VCF and the files built from it: index, sidecar and Bloom filter
+        """
+        return [
+            datafile,
+            datafile + ".tbi",
+            sidecar_path(datafile),
+            bloom_filter_path(datafile),
+        ]
+
+    @classmethod
+    def fingerprint(cls, datafile: str) -> Optional[str]:
+        """
+        Inode, size and modification time of the VCF, its index, its
+        sidecar and its Bloom filter. None when there is no VCF
+        """
+        parts = []
+        for path in cls.dataset_files(datafile):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                if path == datafile:
+                    return None
+                parts.append("-")
+                continue
+            parts.append(f"{stat.st_ino:x}.{stat.st_size:x}.{stat.st_mtime_ns:x}")
+        return "/".join(parts)
+
+    def parse(self, line: str) -> Any:
+        """
+        Parses one VCF line into a vcfpy record
+        """
+        return self.reader.parser.parse_line(line)
+
+    def fetch(
+        self, contig: str, beg: int, end: int, cache: bool = True
+    ) -> Iterator[str]:
+        """
+        Yields raw VCF lines overlapping the 0-based half-open [beg, end)
+        """
+        return self.tabix_file.fetch(contig, beg, end, cache)
+
+    def find_variants(
+        self, index: str, value: str, after: Optional[Tuple[int, int, str]], limit: int
+    ) -> List[Tuple[int, str, int, str]]:
+        """
+        (contig_rank, contig, pos, variant_id) of the variants with a gene
+        or phenotype, in file order, from the sidecar indexes
+        """
+        self.load_sidecar()
+        if not self.sidecar or index not in self.sidecar.indexes:
+            raise IndexNotAvailable(self.genome_uuid, index)
+        return self.sidecar.lookup(index, value, after, limit)
+
+    def density(
+        self, contig: str, beg: int, end: int, max_bins: int
+    ) -> Tuple[int, List[Tuple[int, int, Mapping, Mapping]]]:
+        """
+        Bin size and non-empty bins of the density tiles covering the
+        0-based half-open [beg, end), from the finest zoom level that needs
+        at most max_bins bins, or the coarsest one
+        """
+        self.load_sidecar()
+        if not self.sidecar or not self.sidecar.has_tiles:
+            raise IndexNotAvailable(self.genome_uuid, "density")
+        for bin_size in TILE_BIN_SIZES:
+            if (end - 1) // bin_size - beg // bin_size + 1 <= max_bins:
+                break
+        return bin_size, self.sidecar.tiles(
+            contig, bin_size, beg // bin_size, (end - 1) // bin_size
+        )
+
+    def fetch_variants(self, variants: List[Tuple[str, int, str]]) -> Iterator[str]:
+        """
+        Yields the raw VCF lines of (contig, pos, variant_id) sorted in file
+        order. Nearby variants are read together so that each BGZF block is
+        read once
+        """
+        ranges = []
+        for contig, pos, variant_id in variants:
+            if (
+                ranges
+                and ranges[-1][0] == contig
+                and pos - ranges[-1][2] <= MERGE_DISTANCE
+            ):
+                ranges[-1][2] = pos
+                ranges[-1][3].add((pos, variant_id))
+            else:
+                ranges.append([contig, pos, pos, {(pos, variant_id)}])
+        for contig, beg, end, wanted in ranges:
+            for line in self.fetch(contig, beg - 1, end):
+                columns = line.split("\t", 3)
+                if (int(columns[1]), columns[2].split(";")[0]) in wanted:
+                    yield line
+
+    def scan(
+        self,
+        contig: str,
+        beg: int,
+        end: int,
+        limit: int,
+        after: Optional[Tuple[int, str]] = None,
+        predicate: Callable[[str], bool] = None,
+    ) -> Tuple[List[str], Optional[Tuple[int, str]], bool]:
+        """
+        Raw VCF lines of up to limit records overlapping the 0-based
+        half-open [beg, end) whose INFO column passes predicate, resuming
+        after the record at (pos, variant_id). Lines that fail the predicate
+        are never parsed. Returns the lines, the (pos, variant_id) of the last
+        record looked at and whether the region has records after it, which
+        stops short of limit when MAX_SCANNED_RECORDS are looked at
+        """
+        if after:
+            after_pos, after_id = after
+            beg = max(beg, after_pos - 1)
+        lines = []
+        last = None
+        scanned = 0
+        records = self.fetch(contig, beg, end)
+        for line in records:
+            columns = line.split("\t", 8)
+            pos, variant_id = int(columns[1]), columns[2].split(";")[0]
+            if after:
+                if pos < after_pos:
+                    continue
+                if pos == after_pos:
+                    if variant_id == after_id:
+                        after = None
+                    continue
+                after = None
+            if scanned == MAX_SCANNED_RECORDS or len(lines) == limit:
+                return lines, last, True
+            scanned += 1
+            last = (pos, variant_id)
+            if predicate is None or predicate(columns[7]):
+                lines.append(line)
+        return lines, last, False
+
+    def load_sidecar(self) -> None:
+        """
+        Opens the sidecar on first use, SQLite connections must not be
+        shared with forked processes. Fetch threads of the same dataset
+        may get here together, the lock has only one of them open it
+        """
+        if not self.sidecar_loaded:
+            with self.sidecar_lock:
+                if not self.sidecar_loaded:
+                    self.sidecar = Sidecar.open_for(self.datafile)
+                    self.sidecar_loaded = True
+
+    def may_contain(self, variant_id: str) -> bool:
+        """
+        False when the Bloom filter rules the variant out, without reading the
+        VCF. The filter holds ids at the start position of their record, so
+        a variant addressed at another position of its span, such as inside
+        a deletion, is ruled out
+        """
+        if self.bloom_filter is None:
+            return True
+        try:
+            contig, pos, identifier = variant_id.split(":")
+            key = f"{contig}:{int(pos)}:{identifier}"
+        except ValueError:
+            # Malformed ids are reported by the lookup
+            return True
+        return key in self.bloom_filter
+
+    def get_precomputed(self, rec: Any) -> Optional[Mapping]:
+        """
+        Derived fields of a record stored in the sidecar, if there is one
+        """
+        self.load_sidecar()
+        return self.sidecar.get(rec.CHROM, rec.POS, rec.ID[0]) if self.sidecar else None
+
+    def acquire(self) -> bool:
+        """
+        Registers a read of the dataset, ended by release. False when the
+        dataset is already closed, once retired and released by every read
+        """
+        with self.users_lock:
+            if self.closed:
+                return False
+            self.users += 1
+            return True
+
+    def release(self) -> None:
+        with self.users_lock:
+            self.users -= 1
+            self.closed = self.retired and not self.users
+            closing = self.closed
+        if closing:
+            self.close_retired()
+
+    def retire(self) -> None:
+        """
+        Marks a dataset replaced or removed by the watcher, closing it now
+        when no read holds it
+        """
+        with self.users_lock:
+            self.retired = True
+            self.closed = not self.users
+            closing = self.closed
+        if closing:
+            self.close_retired()
+
+    def close_retired(self) -> None:
+        try:
+            self.close()
+        except Exception as e:
+            print(f"Cannot close dataset of genome {self.genome_uuid} - {e}")
+
+    def close(self) -> None:
+        self.tabix_file.close()
+        self.reader.close()
+        if self.sidecar:
+            self.sidecar.close()
+        if self.bloom_filter:
+            self.bloom_filter.close()
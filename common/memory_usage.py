@@ -0,0 +1,47 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Mapping, Optional, Union
+
+SMAPS_FIELDS = (
+    "Rss",
+    "Pss",
+    "Shared_Clean",
+    "Shared_Dirty",
+    "Private_Clean",
+    "Private_Dirty",
+)
+
+
+def read_memory_usage(pid: Union[int, str] = "self") -> Optional[Mapping]:
+    """
+    Unique and shared resident memory of a process in bytes, from
+    /proc/<pid>/smaps_rollup. Pages still shared copy-on-write with the
+    master after a fork count as shared. None when /proc is not available
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as smaps:
+            sizes = {}
+            for line in smaps:
+                field, _, value = line.partition(":")
+                if field in SMAPS_FIELDS:
+                    sizes[field] = int(value.split()[0]) * 1024
+    except OSError:
+        return None
+    return {
+        "rss": sizes.get("Rss", 0),
+        "pss": sizes.get("Pss", 0),
+        "unique": sizes.get("Private_Clean", 0) + sizes.get("Private_Dirty", 0),
+        "shared": sizes.get("Shared_Clean", 0) + sizes.get("Shared_Dirty", 0),
+    }
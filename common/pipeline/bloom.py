@@ -0,0 +1,137 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Any, Iterator
+import argparse
+import gzip
+import logging
+import os
+import tempfile
+import time
+
+from common.bloom_filter import (
+    BloomFilterBuilder,
+    bloom_filter_path,
+    expected_false_positive_rate,
+)
+from common.pipeline.precompute import find_datafiles
+from common.tabix import TabixIndex
+
+log = logging.getLogger(__name__)
+
+
+def variant_ids(datafile: str) -> Iterator[str]:
+    """
+    Yields the contig:position:identifier id of every record, the form the
+    API looks variants up by
+    """
+    with gzip.open(datafile, "rt") as vcf:
+        for line in vcf:
+            if line[0] == "#":
+                continue
+            contig, pos, identifier = line.split("\t", 3)[:3]
+            if identifier != ".":
+                yield f"{contig}:{pos}:{identifier.split(';', 1)[0]}"
+
+
+def count_records(datafile: str) -> int:
+    """
+    Record count from the tabix index, or from a pass over the VCF when the
+    index does not hold one
+    """
+    counts = TabixIndex.from_path(datafile + ".tbi").record_counts
+    if all(count is not None for count in counts):
+        return sum(counts)
+    return sum(1 for _ in variant_ids(datafile))
+
+
+def build_bloom_filter(
+    datafile: str, false_positive_rate: float, max_bytes: int = None
+) -> BloomFilterBuilder:
+    """
+    Builds the filter for one VCF and swaps it in place of any previous one
+    """
+    stat = os.stat(datafile)
+    builder = BloomFilterBuilder(
+        count_records(datafile), false_positive_rate, max_bytes
+    )
+    builder.add_all(variant_ids(datafile))
+    with tempfile.NamedTemporaryFile(
+        prefix=".bloom-", dir=os.path.dirname(datafile), delete=False
+    ) as output:
+        temporary_path = output.name
+    try:
+        builder.write(temporary_path, stat.st_size, stat.st_mtime_ns)
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, bloom_filter_path(datafile))
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+    return builder
+
+
+def main(args: Any = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Build a Bloom filter of variant ids next to each variation.vcf.gz"
+    )
+    parser.add_argument(
+        "--data_root",
+        default=os.getenv("data_root"),
+        help="directory holding <genome_uuid>/variation.vcf.gz",
+    )
+    parser.add_argument(
+        "--genome_uuid",
+        action="append",
+        help="only process this genome, can be repeated",
+    )
+    parser.add_argument(
+        "--false_positive_rate",
+        type=float,
+        default=0.001,
+        help="target false positive rate",
+    )
+    parser.add_argument(
+        "--max_size",
+        type=int,
+        help="upper bound on the filter size in bytes, raises the false positive rate",
+    )
+    options = parser.parse_args(args)
+    if not options.data_root:
+        parser.error(
+            "--data_root is required when data_root is not set in the environment"
+        )
+    if not 0 < options.false_positive_rate < 1:
+        parser.error("--false_positive_rate must be between 0 and 1")
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    for genome_uuid, datafile in find_datafiles(options.data_root, options.genome_uuid):
+        start = time.perf_counter()
+        builder = build_bloom_filter(
+            datafile, options.false_positive_rate, options.max_size
+        )
+        log.info(
+            "%s: %s ids in %s bytes, %s hash functions, expected false positive rate %.6f, %.1fs",
+            genome_uuid,
+            builder.added,
+            builder.bits // 8,
+            builder.hashes,
+            expected_false_positive_rate(builder.added, builder.bits, builder.hashes),
+            time.perf_counter() - start,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Dict, Mapping, Optional, Tuple
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+import pysam
+
+from common.tabix import BGZFFile, TabixIndex
+
+log = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "variation.sidecar.manifest.json"
+PARTS_DIRNAME = "variation.sidecar.parts"
+
+# Files other than the VCF that derived fields are computed from
+DERIVED_INPUTS = [
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "file_model", name)
+    for name in ("populations.json", "variation_consequence_rank.json")
+]
+
+# Compressed bytes hashed per read
+READ_SIZE = 1024 * 1024
+
+
+def manifest_path(datafile: str) -> str:
+    return os.path.join(os.path.dirname(datafile), MANIFEST_FILENAME)
+
+
+def parts_dir(datafile: str) -> str:
+    """
+    Directory of the per-contig sidecars kept between builds, next to the VCF
+    """
+    return os.path.join(os.path.dirname(datafile), PARTS_DIRNAME)
+
+
+def inputs_fingerprint(genome_uuid: str, datafile: str) -> str:
+    """
+    Hash of everything derived fields depend on besides the records: the
+    genome, the VCF header and the population and consequence rank files.
+    When it changes every contig is rebuilt
+    """
+    digest = hashlib.sha256(genome_uuid.encode())
+    with gzip.open(datafile, "rb") as vcf:
+        for line in vcf:
+            if not line.startswith(b"#"):
+                break
+            digest.update(line)
+    for path in DERIVED_INPUTS:
+        with open(path, "rb") as input_file:
+            digest.update(input_file.read())
+    return digest.hexdigest()
+
+
+def contig_byte_ranges(datafile: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Compressed offsets of the first and last BGZF blocks holding records of
+    every contig, from the chunks of its tabix index
+    """
+    index = TabixIndex.from_path(datafile + ".tbi")
+    ranges = {}
+    for contig, bins in zip(index.contigs, index.bins):
+        chunks = [chunk for chunk_list in bins.values() for chunk in chunk_list]
+        if chunks:
+            ranges[contig] = (
+                min(chunk[0] for chunk in chunks) >> 16,
+                max(chunk[1] for chunk in chunks) >> 16,
+            )
+    return ranges
+
+
+def contig_byte_fingerprints(datafile: str) -> Dict[str, str]:
+    """
+    Hash of the compressed blocks of every contig. Blocks shared with a
+    neighbouring contig are included, so a change next to a contig can mark
+    it as changed too, which the record checksum then rules out. Reading
+    compressed bytes is much cheaper than decompressing the records
+    """
+    bgzf = BGZFFile(datafile)
+    fingerprints = {}
+    try:
+        for contig, (first_block, last_block) in contig_byte_ranges(datafile).items():
+            end = last_block + bgzf.inflate_block(last_block)[1]
+            digest = hashlib.sha256()
+            for offset in range(first_block, end, READ_SIZE):
+                digest.update(os.pread(bgzf.fd, min(READ_SIZE, end - offset), offset))
+            fingerprints[contig] = digest.hexdigest()
+    finally:
+        bgzf.close()
+    return fingerprints
+
+
+def contig_record_checksum(datafile: str, contig: str) -> Tuple[str, int]:
+    """
+    Hash and count of the records of a contig, which only change when the
+    records do, whatever the compression or the rest of the file
+    """
+    digest = hashlib.sha256(contig.encode())
+    count = 0
+    tabix_file = pysam.TabixFile(datafile)
+    try:
+        for line in tabix_file.fetch(contig):
+            digest.update(line.encode())
+            digest.update(b"\n")
+            count += 1
+    finally:
+        tabix_file.close()
+    return digest.hexdigest(), count
+
+
+def load_manifest(datafile: str) -> Optional[Mapping]:
+    """
+    The manifest of the last build, None when there is none or it cannot be read
+    """
+    try:
+        with open(manifest_path(datafile)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        log.warning("Ignoring manifest %s - %s", manifest_path(datafile), e)
+        return None
+
+
+def publish_manifest(datafile: str, manifest: Mapping) -> None:
+    """
+    Replaces the manifest in a single rename
+    """
+    path = manifest_path(datafile)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(temporary_path, path)
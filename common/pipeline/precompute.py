@@ -0,0 +1,384 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Any, Iterator, List, Mapping, Optional, Tuple
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+import pysam
+import vcfpy
+
+from common.file_model.csq_layout import get_csq_layout
+from common.file_model.variant import Variant
+from common.pipeline.manifest import (
+    contig_byte_fingerprints,
+    contig_record_checksum,
+    inputs_fingerprint,
+    load_manifest,
+    parts_dir,
+    publish_manifest,
+)
+from common.pipeline.sidecar import (
+    INDEX_TABLES,
+    SIDECAR_FILENAME,
+    TileWriter,
+    create_sidecar,
+    datafile_fingerprint,
+    sidecar_path,
+    write_annotations,
+    write_contigs,
+    write_index_entries,
+    write_metadata,
+)
+
+log = logging.getLogger(__name__)
+
+DATAFILE_NAME = "variation.vcf.gz"
+
+# Variant methods whose results only depend on the file contents
+DERIVED_FIELDS = {
+    "most_severe_consequence": Variant.get_most_severe_consequence,
+    "population_frequencies": Variant.set_frequency_flags,
+    "statistics_info": Variant.get_statistics_info,
+    "primary_source": Variant.get_primary_source,
+}
+
+# Consequences that place a variant near a gene rather than in it
+NON_GENIC_CONSEQUENCES = {
+    "upstream_gene_variant",
+    "downstream_gene_variant",
+    "intergenic_variant",
+}
+
+
+def find_datafiles(
+    data_root: str, genome_uuids: Optional[List[str]] = None
+) -> List[Tuple[str, str]]:
+    """
+    Lists (genome_uuid, datafile) for every <data_root>/<genome_uuid>/variation.vcf.gz
+    """
+    datafiles = []
+    for genome_uuid in genome_uuids or sorted(os.listdir(data_root)):
+        datafile = os.path.join(data_root, genome_uuid, DATAFILE_NAME)
+        if os.path.isfile(datafile):
+            datafiles.append((genome_uuid, datafile))
+        else:
+            log.warning("No %s for genome %s", DATAFILE_NAME, genome_uuid)
+    return datafiles
+
+
+def derive_fields(variant: Variant, fields: Optional[List[str]] = None) -> Mapping:
+    """
+    Computes the derived fields of a variant, all of them unless fields
+    are given. A field that cannot be computed is left out so that Variant
+    falls back to live computation
+    """
+    derived = {}
+    for field, method in DERIVED_FIELDS.items():
+        if fields is not None and field not in fields:
+            continue
+        try:
+            derived[field] = method(variant)
+        except Exception as e:
+            log.debug("Cannot precompute %s for %s - %s", field, variant.name, e)
+    return derived
+
+
+def index_entries(rec: Any, layout: Mapping[str, int]) -> Iterator[Tuple[str, str]]:
+    """
+    Yields the (index, value) pairs of a record: the Gene and SYMBOL of
+    every consequence within a gene, and the phenotypes associated with the
+    variant itself, leaving out those that come from an overlapping gene
+    """
+    gene_columns = [layout[name] for name in ("Gene", "SYMBOL") if name in layout]
+    consequence_column = layout.get("Consequence")
+    phenotypes_column = layout.get("PHENOTYPES")
+    for csq_record in rec.INFO.get("CSQ", []):
+        columns = csq_record.split("|")
+        if consequence_column is None or not NON_GENIC_CONSEQUENCES.issuperset(
+            columns[consequence_column].split("&")
+        ):
+            for column in gene_columns:
+                if columns[column]:
+                    yield "gene", columns[column]
+        if phenotypes_column is not None:
+            for phenotype in columns[phenotypes_column].split("&"):
+                splits = phenotype.split("+")
+                if len(splits) >= 3 and splits[0] and not splits[2].startswith("ENS"):
+                    yield "phenotype", splits[0]
+
+
+def tile_keys(
+    variant: Variant, derived: Mapping
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Allele type and most severe consequence a variant is counted under in
+    the density tiles
+    """
+    try:
+        allele_type = variant.get_allele_type(variant.alts)["accession_id"]
+    except Exception:
+        allele_type = None
+    consequence = (derived.get("most_severe_consequence") or {}).get("result")
+    return allele_type, consequence
+
+
+def precompute_contig(task: Tuple[str, str, str, int, str]) -> Tuple[str, int]:
+    """
+    Streams one contig of a VCF into a partial sidecar, with the derived
+    fields and the index entries of every record and the density tiles
+    """
+    genome_uuid, datafile, contig, contig_rank, part_path = task
+    reader = vcfpy.Reader.from_path(datafile)
+    layout = get_csq_layout(reader.header)
+    connection = create_sidecar(part_path)
+    tiles = TileWriter(connection, contig_rank)
+
+    def annotations():
+        for rec in reader.fetch(contig):
+            write_index_entries(
+                connection, contig_rank, rec.POS, rec.ID[0], index_entries(rec, layout)
+            )
+            variant = Variant(rec, reader.header, genome_uuid)
+            derived = derive_fields(variant)
+            tiles.add(rec.POS, *tile_keys(variant, derived))
+            yield rec.CHROM, rec.POS, rec.ID[0], derived
+        tiles.close()
+
+    with connection:
+        count = write_annotations(connection, annotations())
+    connection.close()
+    reader.close()
+    return contig, count
+
+
+def refresh_contig(task: Tuple[str, str, str, int, str, str, bool]) -> Mapping:
+    """
+    Manifest entry of one contig whose compressed blocks changed. Its part
+    is named after the inputs and record checksums, so an existing part
+    with that name already holds its fields and is reused, unless full.
+    Otherwise the contig is precomputed into a new part
+    """
+    genome_uuid, datafile, contig, contig_rank, parts, inputs, full = task
+    records_sha256, records = contig_record_checksum(datafile, contig)
+    part = (
+        hashlib.sha256(f"{inputs} {records_sha256}".encode()).hexdigest()[:32] + ".db"
+    )
+    part_path = os.path.join(parts, part)
+    rebuilt = full or not os.path.exists(part_path)
+    if rebuilt:
+        temporary_path = f"{part_path}.{os.getpid()}.tmp"
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        precompute_contig((genome_uuid, datafile, contig, contig_rank, temporary_path))
+        os.replace(temporary_path, part_path)
+    return {
+        "name": contig,
+        "records_sha256": records_sha256,
+        "records": records,
+        "part": part,
+        "rebuilt": rebuilt,
+    }
+
+
+def merge_parts(
+    output: str, datafile: str, contigs: List[str], entries: List[Mapping], parts: str
+) -> None:
+    """
+    Writes the sidecar from the parts of every contig. Parts may have been
+    built when the contig had another rank, so ranks are set again
+    """
+    connection = create_sidecar(output)
+    with connection:
+        for rank, entry in enumerate(entries):
+            connection.execute(
+                "ATTACH DATABASE ? AS part", (os.path.join(parts, entry["part"]),)
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO variant_annotation SELECT * FROM part.variant_annotation"
+            )
+            for table in INDEX_TABLES.values():
+                connection.execute(
+                    f"INSERT OR REPLACE INTO {table} SELECT key, ?, pos, variant_id FROM part.{table}",
+                    (rank,),
+                )
+            connection.execute(
+                "INSERT OR REPLACE INTO density_tile SELECT ?, bin_size, bin, variant_count, allele_types, consequences"
+                " FROM part.density_tile",
+                (rank,),
+            )
+            connection.commit()
+            connection.execute("DETACH DATABASE part")
+        write_contigs(connection, contigs)
+        write_metadata(
+            connection,
+            {**datafile_fingerprint(datafile), "built_at": str(int(time.time()))},
+        )
+    connection.close()
+
+
+def precompute_genome(
+    genome_uuid: str, datafile: str, processes: int, full: bool = False
+) -> Tuple[int, int]:
+    """
+    Builds the sidecar for one genome and swaps it in place of any previous
+    sidecar in a single rename. Contigs are ranked in the order of the
+    tabix index, so that variants found through the gene and phenotype
+    indexes are read in file order.
+
+    Every contig is precomputed into a part kept next to the VCF, and the
+    manifest records the fingerprints each part was built from. On a new
+    release only the contigs whose compressed blocks and then records
+    changed are precomputed again, one per task; the others reuse their
+    part. The new manifest is published once the sidecar is in place.
+    Returns the number of variants and of contigs precomputed
+    """
+    contigs = pysam.TabixFile(datafile).contigs
+    inputs = inputs_fingerprint(genome_uuid, datafile)
+    previous = None if full else load_manifest(datafile)
+    if previous and previous.get("inputs") != inputs:
+        log.info(
+            "%s: VCF header or derived field inputs changed, precomputing every contig",
+            genome_uuid,
+        )
+        previous = None
+    previous_entries = (
+        {entry["name"]: entry for entry in previous["contigs"]} if previous else {}
+    )
+    parts = parts_dir(datafile)
+    os.makedirs(parts, exist_ok=True)
+
+    byte_fingerprints = contig_byte_fingerprints(datafile)
+    entries: List[Optional[Mapping]] = [None] * len(contigs)
+    tasks = []
+    for rank, contig in enumerate(contigs):
+        entry = previous_entries.get(contig)
+        if (
+            entry
+            and entry["bytes_sha256"] == byte_fingerprints.get(contig)
+            and os.path.exists(os.path.join(parts, entry["part"]))
+        ):
+            entries[rank] = {**entry, "rebuilt": False}
+        else:
+            tasks.append((genome_uuid, datafile, contig, rank, parts, inputs, full))
+
+    ranks = {contig: rank for rank, contig in enumerate(contigs)}
+    if tasks:
+        with multiprocessing.Pool(min(processes, len(tasks))) as pool:
+            for entry in pool.imap_unordered(refresh_contig, tasks):
+                if entry["rebuilt"]:
+                    log.info(
+                        "%s: %s variants precomputed on contig %s",
+                        genome_uuid,
+                        entry["records"],
+                        entry["name"],
+                    )
+                entries[ranks[entry["name"]]] = entry
+    for contig, entry in zip(contigs, entries):
+        entry["bytes_sha256"] = byte_fingerprints.get(contig)
+
+    with tempfile.TemporaryDirectory(
+        prefix=".precompute-", dir=os.path.dirname(datafile)
+    ) as tmp_dir:
+        output = os.path.join(tmp_dir, SIDECAR_FILENAME)
+        merge_parts(output, datafile, contigs, entries, parts)
+        os.replace(output, sidecar_path(datafile))
+
+    publish_manifest(
+        datafile,
+        {
+            "inputs": inputs,
+            **datafile_fingerprint(datafile),
+            "built_at": int(time.time()),
+            "contigs": [
+                {
+                    key: entry[key]
+                    for key in (
+                        "name",
+                        "bytes_sha256",
+                        "records_sha256",
+                        "records",
+                        "part",
+                    )
+                }
+                for entry in entries
+            ],
+        },
+    )
+    # Parts of contigs that changed, and parts left by interrupted builds
+    kept = {entry["part"] for entry in entries}
+    for name in os.listdir(parts):
+        if name not in kept:
+            os.remove(os.path.join(parts, name))
+    return sum(entry["records"] for entry in entries), sum(
+        entry["rebuilt"] for entry in entries
+    )
+
+
+def main(args: Any = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Precompute derived variant fields, the gene and phenotype indexes and the density tiles into a sidecar next to each variation.vcf.gz"
+    )
+    parser.add_argument(
+        "--data_root",
+        default=os.getenv("data_root"),
+        help="directory holding <genome_uuid>/variation.vcf.gz",
+    )
+    parser.add_argument(
+        "--genome_uuid",
+        action="append",
+        help="only process this genome, can be repeated",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count(),
+        help="number of contigs processed in parallel",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="precompute every contig, even those that did not change",
+    )
+    options = parser.parse_args(args)
+    if not options.data_root:
+        parser.error(
+            "--data_root is required when data_root is not set in the environment"
+        )
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    for genome_uuid, datafile in find_datafiles(options.data_root, options.genome_uuid):
+        start = time.perf_counter()
+        total, rebuilt = precompute_genome(
+            genome_uuid, datafile, options.processes, options.full
+        )
+        log.info(
+            "%s: %s variants written to %s in %.1fs, %s contigs precomputed again",
+            genome_uuid,
+            total,
+            sidecar_path(datafile),
+            time.perf_counter() - start,
+            rebuilt,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Iterable, List, Mapping, Optional, Tuple
+from collections import Counter
+import json
+import os
+import sqlite3
+
+SIDECAR_FILENAME = "variation.sidecar.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS variant_annotation (
+    contig TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    variant_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    PRIMARY KEY (contig, pos, variant_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS contig (
+    rank INTEGER PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS gene_variant (
+    key TEXT NOT NULL,
+    contig_rank INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    variant_id TEXT NOT NULL,
+    PRIMARY KEY (key, contig_rank, pos, variant_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS phenotype_variant (
+    key TEXT NOT NULL,
+    contig_rank INTEGER NOT NULL,
+    pos INTEGER NOT NULL,
+    variant_id TEXT NOT NULL,
+    PRIMARY KEY (key, contig_rank, pos, variant_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS density_tile (
+    contig_rank INTEGER NOT NULL,
+    bin_size INTEGER NOT NULL,
+    bin INTEGER NOT NULL,
+    variant_count INTEGER NOT NULL,
+    allele_types TEXT NOT NULL,
+    consequences TEXT NOT NULL,
+    PRIMARY KEY (contig_rank, bin_size, bin)
+) WITHOUT ROWID;
+"""
+
+# Inverted indexes from a CSQ value to the variants carrying it, in the
+# order of the contigs in the tabix index and then by position
+INDEX_TABLES = {"gene": "gene_variant", "phenotype": "phenotype_variant"}
+
+# Bin sizes of the density tiles, one zoom level each. Bins without
+# variants are not stored
+TILE_BIN_SIZES = (10_000, 100_000, 1_000_000, 10_000_000)
+
+
+def sidecar_path(datafile: str) -> str:
+    """
+    The sidecar lives in the same directory as the VCF it was built from
+    """
+    return os.path.join(os.path.dirname(datafile), SIDECAR_FILENAME)
+
+
+def datafile_fingerprint(datafile: str) -> Mapping:
+    """
+    Size and modification time of the VCF, used to tell whether a
+    sidecar still describes the file next to it
+    """
+    stat = os.stat(datafile)
+    return {"vcf_size": str(stat.st_size), "vcf_mtime_ns": str(stat.st_mtime_ns)}
+
+
+def create_sidecar(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def write_annotations(
+    connection: sqlite3.Connection, rows: Iterable[Tuple[str, int, str, Mapping]]
+) -> int:
+    """
+    Stores (contig, pos, variant_id, derived fields) rows, returns the row count
+    """
+    count = 0
+    for contig, pos, variant_id, payload in rows:
+        connection.execute(
+            "INSERT OR REPLACE INTO variant_annotation VALUES (?, ?, ?, ?)",
+            (contig, pos, variant_id, json.dumps(payload, separators=(",", ":"))),
+        )
+        count += 1
+    return count
+
+
+def index_key(index: str, value: str) -> str:
+    """
+    Normalised form of an index key, so that lookups ignore case and, for
+    phenotypes, whether words are separated by spaces or by the underscores
+    used in the VCF
+    """
+    if index == "phenotype":
+        return " ".join(value.replace("_", " ").split()).casefold()
+    return value.strip().upper()
+
+
+def write_index_entries(
+    connection: sqlite3.Connection,
+    contig_rank: int,
+    pos: int,
+    variant_id: str,
+    entries: Iterable[Tuple[str, str]],
+) -> None:
+    """
+    Stores the (index, value) pairs of one variant
+    """
+    for index, value in entries:
+        connection.execute(
+            f"INSERT OR IGNORE INTO {INDEX_TABLES[index]} VALUES (?, ?, ?, ?)",
+            (index_key(index, value), contig_rank, pos, variant_id),
+        )
+
+
+def write_contigs(connection: sqlite3.Connection, contigs: List[str]) -> None:
+    connection.executemany(
+        "INSERT OR REPLACE INTO contig VALUES (?, ?)", list(enumerate(contigs))
+    )
+
+
+class TileWriter:
+    """
+    Summarises a contig's variants, streamed in position order, into bins
+    of every size in TILE_BIN_SIZES: the number of variants and their
+    counts by allele type and by most severe consequence. A bin is written
+    as soon as the stream moves past it, so only the current bin of each
+    size is held in memory
+    """
+
+    def __init__(self, connection: sqlite3.Connection, contig_rank: int) -> None:
+        self.connection = connection
+        self.contig_rank = contig_rank
+        self.bins = {bin_size: None for bin_size in TILE_BIN_SIZES}
+
+    def add(
+        self, pos: int, allele_type: Optional[str], consequence: Optional[str]
+    ) -> None:
+        for bin_size, current in self.bins.items():
+            bin_index = (pos - 1) // bin_size
+            if current is None or current[0] != bin_index:
+                if current:
+                    self.write(bin_size, *current)
+                current = self.bins[bin_size] = (bin_index, Counter(), Counter())
+            _, allele_types, consequences = current
+            allele_types[allele_type] += 1
+            consequences[consequence] += 1
+
+    def write(
+        self,
+        bin_size: int,
+        bin_index: int,
+        allele_types: Counter,
+        consequences: Counter,
+    ) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO density_tile VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                self.contig_rank,
+                bin_size,
+                bin_index,
+                sum(allele_types.values()),
+                json.dumps(
+                    {key: count for key, count in allele_types.items() if key},
+                    separators=(",", ":"),
+                ),
+                json.dumps(
+                    {key: count for key, count in consequences.items() if key},
+                    separators=(",", ":"),
+                ),
+            ),
+        )
+
+    def close(self) -> None:
+        for bin_size, current in self.bins.items():
+            if current:
+                self.write(bin_size, *current)
+        self.bins = {bin_size: None for bin_size in TILE_BIN_SIZES}
+
+
+def write_metadata(connection: sqlite3.Connection, metadata: Mapping) -> None:
+    connection.executemany(
+        "INSERT OR REPLACE INTO metadata VALUES (?, ?)", list(metadata.items())
+    )
+
+
+class Sidecar:
+    """
+    Read-only access to the derived fields precomputed for a VCF
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.connection = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, check_same_thread=False
+        )
+        self.metadata = dict(self.connection.execute("SELECT key, value FROM metadata"))
+        tables = {
+            row[0]
+            for row in self.connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+        # Sidecars built before the indexes were added have no index tables
+        self.indexes = {
+            index
+            for index, table in INDEX_TABLES.items()
+            if table in tables and "contig" in tables
+        }
+        self.has_tiles = "density_tile" in tables and "contig" in tables
+
+    @classmethod
+    def open_for(cls, datafile: str) -> Optional["Sidecar"]:
+        """
+        Returns the sidecar for datafile, or None when there is no sidecar
+        or it was built from a different version of the file
+        """
+        path = sidecar_path(datafile)
+        if not os.path.exists(path):
+            return None
+        try:
+            sidecar = cls(path)
+        except sqlite3.Error as e:
+            print(f"Cannot open sidecar {path} - {e}")
+            return None
+        for key, value in datafile_fingerprint(datafile).items():
+            if sidecar.metadata.get(key) != value:
+                print(
+                    f"Ignoring sidecar {path}, it was built from a different {datafile}"
+                )
+                sidecar.close()
+                return None
+        return sidecar
+
+    def get(self, contig: str, pos: int, variant_id: str) -> Optional[Mapping]:
+        row = self.connection.execute(
+            "SELECT payload FROM variant_annotation WHERE contig = ? AND pos = ? AND variant_id = ?",
+            (contig, pos, variant_id),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def lookup(
+        self, index: str, value: str, after: Optional[Tuple[int, int, str]], limit: int
+    ) -> List[Tuple[int, str, int, str]]:
+        """
+        (contig_rank, contig, pos, variant_id) of up to limit variants with
+        the given index value, in file order, starting after the given
+        (contig_rank, pos, variant_id)
+        """
+        table = INDEX_TABLES[index]
+        after = after or (-1, 0, "")
+        return self.connection.execute(
+            f"SELECT i.contig_rank, c.name, i.pos, i.variant_id FROM {table} i"
+            " JOIN contig c ON c.rank = i.contig_rank"
+            " WHERE i.key = ? AND (i.contig_rank, i.pos, i.variant_id) > (?, ?, ?)"
+            " ORDER BY i.contig_rank, i.pos, i.variant_id LIMIT ?",
+            (index_key(index, value), *after, limit),
+        ).fetchall()
+
+    def tiles(
+        self, contig: str, bin_size: int, first_bin: int, last_bin: int
+    ) -> List[Tuple[int, int, Mapping, Mapping]]:
+        """
+        (bin, variant count, counts by allele type, counts by most severe
+        consequence) of the non-empty bins from first_bin to last_bin
+        """
+        rows = self.connection.execute(
+            "SELECT t.bin, t.variant_count, t.allele_types, t.consequences FROM density_tile t"
+            " JOIN contig c ON c.rank = t.contig_rank"
+            " WHERE c.name = ? AND t.bin_size = ? AND t.bin BETWEEN ? AND ? ORDER BY t.bin",
+            (contig, bin_size, first_bin, last_bin),
+        )
+        return [
+            (bin_index, count, json.loads(allele_types), json.loads(consequences))
+            for bin_index, count, allele_types, consequences in rows
+        ]
+
+    def close(self) -> None:
+        self.connection.close()
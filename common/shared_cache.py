@@ -0,0 +1,214 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Mapping, Optional
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = b"HYPSCACH"
+# magic, layout version, number of sets, ways per set, slot size
+FILE_HEADER = struct.Struct("<8sIIII")
+FILE_HEADER_SIZE = 64
+# sequence, key hash, last used, key length, value length, crc32 of key + value
+SLOT_HEADER = struct.Struct("<QQQIII")
+SLOT_HEADER_SIZE = 40
+LAYOUT_VERSION = 1
+
+
+class SharedCache:
+    """
+    Bounded key/value cache shared by all worker processes on a host.
+
+    The table lives in a memory-mapped file (ideally on /dev/shm) split into
+    sets of a few fixed-size slots. Reads take no lock: every slot carries a
+    sequence number that is odd while a write is in progress, plus a crc32 of
+    its contents, so a reader never waits and treats a torn slot as a miss.
+    Writers lock the set they write to, both across processes (fcntl
+    byte-range lock) and across threads, and evict the least recently used
+    slot of the set. Values that do not fit in a slot are not cached.
+    """
+
+    def __init__(
+        self, path: str, size: int, slot_size: int = 65536, ways: int = 4
+    ) -> None:
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            existing = os.fstat(self.fd).st_size
+            if existing >= FILE_HEADER_SIZE:
+                header = os.pread(self.fd, FILE_HEADER.size, 0)
+                magic, version, n_sets, ways, slot_size = FILE_HEADER.unpack(header)
+                if magic != MAGIC or version != LAYOUT_VERSION:
+                    raise ValueError(f"{path} is not a shared cache file")
+            else:
+                n_sets = max(1, (size - FILE_HEADER_SIZE) // (slot_size * ways))
+                os.ftruncate(self.fd, FILE_HEADER_SIZE + n_sets * ways * slot_size)
+                os.pwrite(
+                    self.fd,
+                    FILE_HEADER.pack(MAGIC, LAYOUT_VERSION, n_sets, ways, slot_size),
+                    0,
+                )
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.n_sets = n_sets
+        self.ways = ways
+        self.slot_size = slot_size
+        self.map = mmap.mmap(self.fd, FILE_HEADER_SIZE + n_sets * ways * slot_size)
+        self.write_lock = threading.Lock()
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "too_large": 0,
+            "torn_reads": 0,
+        }
+
+    @classmethod
+    def from_config(cls, config: Mapping) -> Optional["SharedCache"]:
+        """
+        Returns the cache configured by shared_cache_path / shared_cache_size,
+        or None when no path is configured
+        """
+        path = config.get("shared_cache_path")
+        if not path:
+            return None
+        return cls(
+            path,
+            int(config.get("shared_cache_size", 256 * 1024 * 1024)),
+            int(config.get("shared_cache_slot_size", 65536)),
+        )
+
+    def slot_offsets(self, key_hash: int):
+        first = (key_hash % self.n_sets) * self.ways
+        return [
+            FILE_HEADER_SIZE + (first + way) * self.slot_size
+            for way in range(self.ways)
+        ]
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        key_hash = hash_key(key)
+        for offset in self.slot_offsets(key_hash):
+            (
+                sequence,
+                slot_hash,
+                _,
+                key_length,
+                value_length,
+                crc,
+            ) = SLOT_HEADER.unpack_from(self.map, offset)
+            if sequence & 1 or slot_hash != key_hash or not value_length:
+                continue
+            start = offset + SLOT_HEADER_SIZE
+            data = self.map[start : start + key_length + value_length]
+            if (
+                SLOT_HEADER.unpack_from(self.map, offset)[0] != sequence
+                or zlib.crc32(data) != crc
+            ):
+                self.counters["torn_reads"] += 1
+                continue
+            if data[:key_length] != key:
+                continue
+            # Recency is only a hint for eviction, a racing update is harmless
+            struct.pack_into("<Q", self.map, offset + 16, time.monotonic_ns())
+            self.counters["hits"] += 1
+            return data[key_length:]
+        self.counters["misses"] += 1
+        return None
+
+    def set(self, key: bytes, value: bytes) -> bool:
+        if SLOT_HEADER_SIZE + len(key) + len(value) > self.slot_size or not value:
+            self.counters["too_large"] += 1
+            return False
+        key_hash = hash_key(key)
+        set_index = key_hash % self.n_sets
+        offsets = self.slot_offsets(key_hash)
+        with self.write_lock:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, set_index)
+            try:
+                victim, evicting = None, True
+                oldest = None
+                for offset in offsets:
+                    (
+                        sequence,
+                        slot_hash,
+                        last_used,
+                        key_length,
+                        value_length,
+                        _,
+                    ) = SLOT_HEADER.unpack_from(self.map, offset)
+                    start = offset + SLOT_HEADER_SIZE
+                    if (
+                        value_length
+                        and slot_hash == key_hash
+                        and self.map[start : start + key_length] == key
+                    ):
+                        victim, evicting = offset, False
+                        break
+                    if not value_length:
+                        if evicting:
+                            victim, evicting = offset, False
+                    elif evicting and (oldest is None or last_used < oldest):
+                        victim, oldest = offset, last_used
+                # Odd while writing, even once done, also for a slot a dead
+                # writer left odd
+                sequence = SLOT_HEADER.unpack_from(self.map, victim)[0] | 1
+                data = key + value
+                struct.pack_into("<Q", self.map, victim, sequence)
+                self.map[
+                    victim + SLOT_HEADER_SIZE : victim + SLOT_HEADER_SIZE + len(data)
+                ] = data
+                SLOT_HEADER.pack_into(
+                    self.map,
+                    victim,
+                    sequence + 1,
+                    key_hash,
+                    time.monotonic_ns(),
+                    len(key),
+                    len(value),
+                    zlib.crc32(data),
+                )
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, set_index)
+        self.counters["stores"] += 1
+        if evicting:
+            self.counters["evictions"] += 1
+        return True
+
+    def stats(self) -> Mapping:
+        """
+        Hit statistics of this worker process
+        """
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "pid": os.getpid(),
+            **self.counters,
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else None,
+            "capacity_bytes": self.n_sets * self.ways * self.slot_size,
+        }
+
+    def close(self) -> None:
+        self.map.close()
+        os.close(self.fd)
+
+
+def hash_key(key: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
@@ -0,0 +1,307 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import List, Mapping, Optional
+from concurrent.futures import ThreadPoolExecutor
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from common.genome_dataset import GenomeDataset
+
+MANIFEST_NAME = "MANIFEST.json"
+LOCK_NAME = ".lock"
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+def copy_with_checksum(source: str, target: str) -> str:
+    """
+    Copies a file, keeping its modification time, and returns the sha256 of
+    what was read from the source
+    """
+    digest = hashlib.sha256()
+    with open(source, "rb") as input_file, open(target, "wb") as output_file:
+        while True:
+            data = input_file.read(COPY_BUFFER_SIZE)
+            if not data:
+                break
+            digest.update(data)
+            output_file.write(data)
+        output_file.flush()
+        os.fsync(output_file.fileno())
+    # The sidecar and Bloom filter check the VCF size and mtime, keep them valid
+    shutil.copystat(source, target)
+    return digest.hexdigest()
+
+
+def file_checksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as input_file:
+        while True:
+            data = input_file.read(COPY_BUFFER_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class StagingArea:
+    """
+    Copies of genome datasets on local disk, so that reads do not go over
+    NFS. A dataset is copied in the background the first time it is asked
+    for, or at startup for the genomes listed in staging_genomes, and reads
+    stay on data_root until the copy is complete and its checksums verified.
+
+    Copies live in <root>/<genome_uuid>/<version>/ where the version is
+    derived from the fingerprint of the source files, so a replaced dataset
+    is copied again. Whole datasets are evicted, least recently used first,
+    to stay under max_bytes. All workers of a pod share the area: copies and
+    evictions take a lock file so only one process copies at a time
+    """
+
+    def __init__(self, root: str, max_bytes: int, genomes: List[str] = None) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.genomes = genomes or []
+        # Genomes queued or being copied, discarded by the staging thread
+        self.pending = set()
+        self.pending_lock = threading.Lock()
+        self.executor = None
+        self.executor_pid = None
+        self.counters = {
+            "local_opens": 0,
+            "nfs_fallbacks": 0,
+            "staged": 0,
+            "failed": 0,
+            "evicted": 0,
+            "too_large": 0,
+        }
+        os.makedirs(root, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config: Mapping) -> Optional["StagingArea"]:
+        root = config.get("staging_root")
+        if not root:
+            return None
+        genomes = [
+            genome for genome in config.get("staging_genomes", "").split(",") if genome
+        ]
+        return cls(root, int(config.get("staging_size", 100 * 1024**3)), genomes)
+
+    def version_dir(self, genome_uuid: str, version: str) -> str:
+        return os.path.join(
+            self.root, genome_uuid, hashlib.sha1(version.encode()).hexdigest()[:16]
+        )
+
+    def ready(self, genome_uuid: str, datafile: str) -> Optional[str]:
+        """
+        Local copy of the datafile when the current version of the dataset
+        is completely staged, None otherwise
+        """
+        version = GenomeDataset.fingerprint(datafile)
+        if version is None:
+            return None
+        directory = self.version_dir(genome_uuid, version)
+        try:
+            with open(os.path.join(directory, MANIFEST_NAME)) as manifest_file:
+                manifest = json.load(manifest_file)
+            for name, entry in manifest["files"].items():
+                if os.path.getsize(os.path.join(directory, name)) != entry["size"]:
+                    return None
+        except (OSError, ValueError, KeyError):
+            return None
+        return os.path.join(directory, os.path.basename(datafile))
+
+    def locate(
+        self, genome_uuid: str, datafile: str, stage: bool = True
+    ) -> Optional[str]:
+        """
+        Local copy to read the dataset from, or None to read it from
+        data_root, in which case the dataset is queued for staging
+        """
+        local_datafile = self.ready(genome_uuid, datafile)
+        if local_datafile:
+            self.touch(local_datafile)
+            self.counters["local_opens"] += 1
+            return local_datafile
+        self.counters["nfs_fallbacks"] += 1
+        if stage:
+            self.schedule(genome_uuid, datafile)
+        return None
+
+    def touch(self, local_datafile: str) -> None:
+        """
+        Marks a copy as used, the directory mtime orders copies for eviction
+        """
+        try:
+            os.utime(os.path.dirname(local_datafile))
+        except FileNotFoundError:
+            pass
+
+    def prestage(self, data_root: str) -> None:
+        """
+        Queues the genomes listed in staging_genomes, "*" for all of them
+        """
+        genomes = (
+            sorted(os.listdir(data_root)) if self.genomes == ["*"] else self.genomes
+        )
+        for genome_uuid in genomes:
+            datafile = GenomeDataset.datafile_for(data_root, genome_uuid)
+            if os.path.isfile(datafile) and not self.ready(genome_uuid, datafile):
+                self.schedule(genome_uuid, datafile)
+
+    def schedule(self, genome_uuid: str, datafile: str) -> None:
+        if self.executor_pid != os.getpid():
+            # Threads do not survive fork, a forked worker needs its own,
+            # and a new lock in case a thread of the parent held it
+            self.executor = ThreadPoolExecutor(1, thread_name_prefix="staging")
+            self.executor_pid = os.getpid()
+            self.pending = set()
+            self.pending_lock = threading.Lock()
+        with self.pending_lock:
+            if genome_uuid in self.pending:
+                return
+            self.pending.add(genome_uuid)
+        self.executor.submit(self.stage, genome_uuid, datafile)
+
+    def stage(self, genome_uuid: str, datafile: str) -> None:
+        try:
+            with open(os.path.join(self.root, LOCK_NAME), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                if not self.ready(genome_uuid, datafile):
+                    self.copy_dataset(genome_uuid, datafile)
+        except Exception as e:
+            self.counters["failed"] += 1
+            print(
+                f"Cannot stage genome {genome_uuid}, reading it from {datafile} - {e}"
+            )
+        finally:
+            with self.pending_lock:
+                self.pending.discard(genome_uuid)
+
+    def copy_dataset(self, genome_uuid: str, datafile: str) -> None:
+        version = GenomeDataset.fingerprint(datafile)
+        sources = [
+            path
+            for path in GenomeDataset.dataset_files(datafile)
+            if os.path.isfile(path)
+        ]
+        size = sum(os.path.getsize(path) for path in sources)
+        if size > self.max_bytes:
+            self.counters["too_large"] += 1
+            print(
+                f"Not staging genome {genome_uuid}, {size} bytes do not fit in {self.max_bytes}"
+            )
+            return
+        directory = self.version_dir(genome_uuid, version)
+        genome_dir = os.path.dirname(directory)
+        self.evict(size, keep=genome_uuid)
+        # Older versions of this genome are no longer read from
+        if os.path.isdir(genome_dir):
+            for name in os.listdir(genome_dir):
+                shutil.rmtree(os.path.join(genome_dir, name), ignore_errors=True)
+
+        start = time.perf_counter()
+        partial = directory + ".partial"
+        os.makedirs(partial)
+        try:
+            files = {}
+            for source in sources:
+                name = os.path.basename(source)
+                target = os.path.join(partial, name)
+                checksum = copy_with_checksum(source, target)
+                if file_checksum(target) != checksum:
+                    raise ValueError(f"checksum mismatch for {name}")
+                files[name] = {"size": os.path.getsize(target), "sha256": checksum}
+            if GenomeDataset.fingerprint(datafile) != version:
+                raise ValueError("source changed while it was copied")
+            with open(os.path.join(partial, MANIFEST_NAME), "w") as manifest_file:
+                json.dump(
+                    {"source": datafile, "version": version, "files": files},
+                    manifest_file,
+                )
+            os.rename(partial, directory)
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        self.counters["staged"] += 1
+        print(
+            f"Staged genome {genome_uuid} ({size} bytes) in {time.perf_counter() - start:.1f}s"
+        )
+
+    def staged(self) -> List[Mapping]:
+        """
+        Staged copies with their size and last use, oldest first
+        """
+        copies = []
+        for genome_uuid in os.listdir(self.root):
+            genome_dir = os.path.join(self.root, genome_uuid)
+            if not os.path.isdir(genome_dir):
+                continue
+            for name in os.listdir(genome_dir):
+                directory = os.path.join(genome_dir, name)
+                try:
+                    size = sum(
+                        entry.stat().st_size
+                        for entry in os.scandir(directory)
+                        if entry.is_file()
+                    )
+                    last_used = os.path.getmtime(directory)
+                except FileNotFoundError:
+                    # Evicted by another worker meanwhile
+                    continue
+                copies.append(
+                    {
+                        "genome_uuid": genome_uuid,
+                        "directory": directory,
+                        "bytes": size,
+                        "last_used": last_used,
+                    }
+                )
+        return sorted(copies, key=lambda copy: copy["last_used"])
+
+    def evict(self, needed: int, keep: str) -> None:
+        """
+        Removes the least recently used copies of other genomes until needed
+        bytes fit. Workers still reading an evicted copy keep their open
+        files, and the dataset watcher moves them back to data_root
+        """
+        copies = self.staged()
+        used = sum(copy["bytes"] for copy in copies if copy["genome_uuid"] != keep)
+        copies = [copy for copy in copies if copy["genome_uuid"] != keep]
+        for copy in copies:
+            if used + needed <= self.max_bytes:
+                break
+            shutil.rmtree(copy["directory"], ignore_errors=True)
+            used -= copy["bytes"]
+            self.counters["evicted"] += 1
+            print(
+                f"Evicted staged genome {copy['genome_uuid']} ({copy['bytes']} bytes)"
+            )
+
+    def stats(self) -> Mapping:
+        copies = self.staged()
+        with self.pending_lock:
+            pending = sorted(self.pending)
+        return {
+            **self.counters,
+            "pending": pending,
+            "bytes": sum(copy["bytes"] for copy in copies),
+            "max_bytes": self.max_bytes,
+            "genomes": sorted({copy["genome_uuid"] for copy in copies}),
+        }
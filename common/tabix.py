@@ -0,0 +1,341 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Iterator, List, Mapping, Optional, Tuple
+from collections import OrderedDict
+import gzip
+import os
+import struct
+import threading
+import zlib
+
+# BGZF blocks are at most 64 KiB, compressed or not
+MAX_BLOCK_SIZE = 65536
+BGZF_HEADER = struct.Struct("<4BI2BH")
+# Tabix bins are 16 KiB wide at the lowest level, 512 MiB at the top
+MIN_SHIFT = 14
+PSEUDO_BIN = 37450
+TABIX_VCF_FORMAT = 2
+
+
+def reg2bins(beg: int, end: int) -> List[int]:
+    """
+    Bins that may hold records overlapping the 0-based half-open [beg, end)
+    """
+    end -= 1
+    bins = [0]
+    for shift, offset in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+        bins.extend(range(offset + (beg >> shift), offset + (end >> shift) + 1))
+    return bins
+
+
+class TabixIndex:
+    """
+    A .tbi index held in memory. Once loaded it is never modified, so it can be
+    built before forking workers and shared copy-on-write
+    """
+
+    def __init__(self, data: bytes) -> None:
+        if data[:4] != b"TBI\x01":
+            raise ValueError("Not a tabix index")
+        (
+            n_ref,
+            self.format,
+            self.col_seq,
+            self.col_beg,
+            self.col_end,
+            meta,
+            self.skip,
+            l_nm,
+        ) = struct.unpack_from("<8i", data, 4)
+        self.meta = chr(meta)
+        offset = 36
+        self.contigs = data[offset : offset + l_nm].split(b"\x00")[:n_ref]
+        self.contigs = [contig.decode() for contig in self.contigs]
+        offset += l_nm
+        self.bins: List[Mapping[int, List[Tuple[int, int]]]] = []
+        self.linear: List[List[int]] = []
+        # Records per contig, from the pseudo-bin htslib writes; None when it is missing
+        self.record_counts: List[Optional[int]] = []
+        for _ in range(n_ref):
+            (n_bin,) = struct.unpack_from("<i", data, offset)
+            offset += 4
+            bins = {}
+            record_count = None
+            for _ in range(n_bin):
+                bin_number, n_chunk = struct.unpack_from("<Ii", data, offset)
+                offset += 8
+                chunks = struct.unpack_from(f"<{2 * n_chunk}Q", data, offset)
+                offset += 16 * n_chunk
+                if bin_number != PSEUDO_BIN:
+                    bins[bin_number] = list(zip(chunks[::2], chunks[1::2]))
+                elif n_chunk == 2:
+                    record_count = chunks[2]
+            (n_intv,) = struct.unpack_from("<i", data, offset)
+            offset += 4
+            self.linear.append(list(struct.unpack_from(f"<{n_intv}Q", data, offset)))
+            offset += 8 * n_intv
+            self.bins.append(bins)
+            self.record_counts.append(record_count)
+        self.contig_ids = {contig: tid for tid, contig in enumerate(self.contigs)}
+
+    @classmethod
+    def from_path(cls, path: str) -> "TabixIndex":
+        with gzip.open(path, "rb") as index_file:
+            return cls(index_file.read())
+
+    def chunks(self, contig: str, beg: int, end: int) -> List[Tuple[int, int]]:
+        """
+        Sorted, merged virtual offset ranges to scan for records overlapping
+        the 0-based half-open [beg, end) on contig
+        """
+        tid = self.contig_ids.get(contig)
+        if tid is None:
+            return []
+        linear = self.linear[tid]
+        if linear:
+            min_offset = linear[min(beg >> MIN_SHIFT, len(linear) - 1)]
+        else:
+            min_offset = 0
+        bins = self.bins[tid]
+        chunks = sorted(
+            chunk
+            for bin_number in reg2bins(beg, end)
+            for chunk in bins.get(bin_number, ())
+            if chunk[1] > min_offset
+        )
+        merged: List[Tuple[int, int]] = []
+        for chunk_beg, chunk_end in chunks:
+            if merged and chunk_beg <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], chunk_end))
+            else:
+                merged.append((chunk_beg, chunk_end))
+        return merged
+
+
+class BlockCache:
+    """
+    Byte-bounded LRU of decompressed BGZF blocks, shared by every file of a
+    worker. Entries are keyed by file identity and compressed offset, where
+    the identity includes the inode, size and modification time, so blocks
+    of a replaced file are never served and simply age out
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.blocks = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @classmethod
+    def from_config(cls, config: Mapping) -> Optional["BlockCache"]:
+        max_bytes = int(config.get("block_cache_size", 64 * 1024 * 1024))
+        return cls(max_bytes) if max_bytes > 0 else None
+
+    def get(self, key: Tuple) -> Optional[Tuple[bytes, int]]:
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is None:
+                self.counters["misses"] += 1
+                return None
+            self.blocks.move_to_end(key)
+            self.counters["hits"] += 1
+            return block
+
+    def put(self, key: Tuple, block: Tuple[bytes, int]) -> None:
+        size = len(block[0])
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.blocks:
+                return
+            self.blocks[key] = block
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (data, _) = self.blocks.popitem(last=False)
+                self.bytes -= len(data)
+                self.counters["evictions"] += 1
+
+    def stats(self) -> Mapping:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else None,
+            "blocks": len(self.blocks),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+class BGZFFile:
+    """
+    Random access to a BGZF compressed file. Blocks are read with pread, so one
+    open descriptor can be shared by threads and forked processes
+    """
+
+    def __init__(self, path: str, block_cache: BlockCache = None) -> None:
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.block_cache = block_cache
+        stat = os.fstat(self.fd)
+        self.identity = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def read_block(self, coffset: int, cache: bool = True) -> Tuple[bytes, int]:
+        """
+        Returns the decompressed block starting at coffset and its compressed size
+        """
+        if self.block_cache is None or not cache:
+            return self.inflate_block(coffset)
+        key = (self.identity, coffset)
+        block = self.block_cache.get(key)
+        if block is None:
+            block = self.inflate_block(coffset)
+            self.block_cache.put(key, block)
+        return block
+
+    def inflate_block(self, coffset: int) -> Tuple[bytes, int]:
+        raw = os.pread(self.fd, MAX_BLOCK_SIZE, coffset)
+        if len(raw) < BGZF_HEADER.size:
+            return b"", 0
+        id1, id2, _, flags, _, _, _, extra_length = BGZF_HEADER.unpack_from(raw)
+        if id1 != 31 or id2 != 139 or not flags & 4:
+            raise ValueError(f"{self.path} is not BGZF compressed at offset {coffset}")
+        block_size = None
+        extra = BGZF_HEADER.size
+        while extra < BGZF_HEADER.size + extra_length:
+            si1, si2, subfield_length = struct.unpack_from("<2BH", raw, extra)
+            if si1 == 66 and si2 == 67:
+                (block_size,) = struct.unpack_from("<H", raw, extra + 4)
+                block_size += 1
+            extra += 4 + subfield_length
+        if block_size is None:
+            raise ValueError(f"{self.path} has no BGZF block size at offset {coffset}")
+        return zlib.decompress(raw[extra : block_size - 8], -15), block_size
+
+    def lines(
+        self, chunks: List[Tuple[int, int]], cache: bool = True
+    ) -> Iterator[bytes]:
+        """
+        Yields the lines starting inside the virtual offset ranges in chunks.
+        Scans that would only flush the block cache pass cache=False
+        """
+        for chunk_beg, chunk_end in chunks:
+            coffset, uoffset = chunk_beg >> 16, chunk_beg & 0xFFFF
+            pending = b""
+            line_start = chunk_beg
+            while True:
+                data, block_size = self.read_block(coffset, cache)
+                if not block_size:
+                    break
+                position = uoffset
+                while True:
+                    if not pending:
+                        line_start = (coffset << 16) | position
+                        if line_start >= chunk_end:
+                            break
+                    newline = data.find(b"\n", position)
+                    if newline == -1:
+                        pending += data[position:]
+                        break
+                    yield pending + data[position:newline]
+                    pending = b""
+                    position = newline + 1
+                if not pending and line_start >= chunk_end:
+                    break
+                coffset += block_size
+                uoffset = 0
+            if pending:
+                yield pending
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class TabixFile:
+    """
+    Region queries over a bgzipped, tabix indexed VCF without htslib
+    """
+
+    def __init__(
+        self,
+        datafile: str,
+        index: TabixIndex = None,
+        block_cache: BlockCache = None,
+        info_end: bool = True,
+    ) -> None:
+        self.datafile = datafile
+        self.index = index or TabixIndex.from_path(datafile + ".tbi")
+        self.bgzf = BGZFFile(datafile, block_cache)
+        # Whether VCF records may carry INFO END, which callers can rule out from the header
+        self.info_end = info_end
+
+    @property
+    def contigs(self) -> List[str]:
+        return self.index.contigs
+
+    def fetch(
+        self, contig: str, beg: int, end: int, cache: bool = True
+    ) -> Iterator[str]:
+        """
+        Yields the lines of records overlapping the 0-based half-open [beg, end).
+        Lines are only split up to the columns tabix needs and only decoded
+        when they are yielded, since a query scans every record of a 16 KiB
+        window of the index. An empty region has no records, as with htslib
+        """
+        if beg >= end:
+            return
+        index = self.index
+        meta = index.meta.encode()
+        is_vcf = index.format & 0xFFFF == TABIX_VCF_FORMAT
+        max_split = max(index.col_seq, index.col_beg, index.col_end, 4 if is_vcf else 0)
+        contig_name = contig.encode()
+        for raw_line in self.bgzf.lines(index.chunks(contig, beg, end), cache):
+            if not raw_line or raw_line[:1] == meta:
+                continue
+            columns = raw_line.split(b"\t", max_split)
+            if columns[index.col_seq - 1] != contig_name:
+                continue
+            record_beg = int(columns[index.col_beg - 1]) - 1
+            if record_beg >= end:
+                break
+            if self.record_end(raw_line, columns, is_vcf, record_beg) > beg:
+                yield raw_line.decode()
+
+    def record_end(
+        self, raw_line: bytes, columns: List[bytes], is_vcf: bool, record_beg: int
+    ) -> int:
+        """
+        End of a record as htslib computes it: REF length, or INFO END for VCF
+        """
+        if is_vcf:
+            end = record_beg + len(columns[3])
+            if not self.info_end:
+                return end
+            fields = raw_line.split(b"\t", 8)
+            info = fields[7] if len(fields) > 7 else b""
+            position = info.find(b"END=")
+            if position == 0 or (
+                position > 0 and info[position - 1 : position] == b";"
+            ):
+                value = info[position + 4 :].split(b";", 1)[0]
+                if value.isdigit():
+                    end = int(value)
+            return end
+        if self.index.col_end:
+            return int(columns[self.index.col_end - 1])
+        return record_beg + 1
+
+    def close(self) -> None:
+        self.bgzf.close()
@@ -0,0 +1,139 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from common.admission import AdmissionController, Overloaded
+
+
+def later(seconds: float = 10) -> float:
+    return time.monotonic() + seconds
+
+
+def test_requests_under_the_limit_are_admitted_at_once():
+    async def scenario():
+        controller = AdmissionController("requests", 2, 1)
+        granted = [await controller.acquire(later()) for _ in range(2)]
+        assert controller.active == 2
+        for slot in granted:
+            controller.release(slot)
+        assert controller.active == 0
+        return controller
+
+    controller = asyncio.run(scenario())
+    assert controller.counters["admitted"] == 2
+
+
+def test_full_queue_sheds_with_retry_after():
+    async def scenario():
+        controller = AdmissionController("requests", 1, 1)
+        controller.service_time = 2.5
+        granted = await controller.acquire(later())
+        waiting = asyncio.ensure_future(controller.acquire(later()))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as shed:
+            await controller.acquire(later())
+        controller.release(granted)
+        controller.release(await waiting)
+        return controller, shed.value
+
+    controller, error = asyncio.run(scenario())
+    assert error.reason == "requests queue full"
+    # One waiter ahead: (1 + 1) * 2.5s for one slot
+    assert error.retry_after == 5
+    assert controller.counters["shed_queue_full"] == 1
+    assert controller.counters["admitted"] == 2
+    assert controller.active == 0
+
+
+def test_request_that_cannot_start_before_its_deadline_is_shed():
+    async def scenario():
+        controller = AdmissionController("fetches", 1, 10)
+        controller.service_time = 3.2
+        granted = await controller.acquire(later())
+        with pytest.raises(Overloaded) as late:
+            await controller.acquire(later(1))
+        with pytest.raises(Overloaded) as past:
+            await controller.acquire(time.monotonic() - 1)
+        controller.release(granted)
+        return controller, late.value, past.value
+
+    controller, late, past = asyncio.run(scenario())
+    assert late.reason == past.reason == "fetches deadline"
+    assert late.retry_after == 4
+    assert controller.counters["shed_deadline"] == 2
+    assert not controller.waiters
+
+
+def test_waiter_gives_up_at_its_deadline():
+    async def scenario():
+        controller = AdmissionController("requests", 1, 10)
+        granted = await controller.acquire(later())
+        with pytest.raises(Overloaded) as timed_out:
+            await controller.acquire(later(0.05))
+        assert not controller.waiters
+        controller.release(granted)
+        return controller, timed_out.value
+
+    controller, error = asyncio.run(scenario())
+    assert error.reason == "requests deadline exceeded"
+    assert error.retry_after >= 1
+    assert controller.counters["timed_out"] == 1
+    assert controller.active == 0
+
+
+def test_released_slots_go_to_waiters_in_arrival_order():
+    async def scenario():
+        controller = AdmissionController("requests", 1, 10)
+        order = []
+
+        async def request(number: int) -> None:
+            granted = await controller.acquire(later())
+            order.append(number)
+            await asyncio.sleep(0)
+            controller.release(granted)
+
+        granted = await controller.acquire(later())
+        requests = []
+        for number in range(5):
+            requests.append(asyncio.ensure_future(request(number)))
+            await asyncio.sleep(0)
+        assert len(controller.waiters) == 5
+        controller.release(granted)
+        await asyncio.gather(*requests)
+        return controller, order
+
+    controller, order = asyncio.run(scenario())
+    assert order == [0, 1, 2, 3, 4]
+    assert controller.active == 0
+    assert controller.counters["admitted"] == 6
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController("requests", 1, 10)
+        granted = await controller.acquire(later())
+        waiting = asyncio.ensure_future(controller.acquire(later()))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert not controller.waiters
+        controller.release(granted)
+        return controller
+
+    assert asyncio.run(scenario()).active == 0
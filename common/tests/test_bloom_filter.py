@@ -0,0 +1,75 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import shutil
+
+import pytest
+
+from common.file_client import FileClient
+from common.pipeline.bloom import build_bloom_filter, variant_ids
+
+GENOME_UUID = "a7335667-93e7-11ec-a39d-005056b38ce3"
+BUNDLED_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data", GENOME_UUID)
+
+
+@pytest.fixture
+def file_client(tmp_path):
+    genome_dir = tmp_path / GENOME_UUID
+    genome_dir.mkdir()
+    for name in ("variation.vcf.gz", "variation.vcf.gz.tbi"):
+        shutil.copy2(os.path.join(BUNDLED_DIR, name), genome_dir / name)
+    build_bloom_filter(str(genome_dir / "variation.vcf.gz"), 0.001)
+    client = FileClient(
+        {
+            "data_root": str(tmp_path),
+            "dataset_reload_interval": "0",
+            "csq_offload_threshold": "0",
+        }
+    )
+    assert client.get_dataset(GENOME_UUID).bloom_filter is not None
+    yield client
+    for dataset in client.datasets.values():
+        dataset.close()
+
+
+def test_every_variant_passes_the_filter(file_client):
+    dataset = file_client.get_dataset(GENOME_UUID)
+    ids = list(variant_ids(dataset.datafile))
+    assert ids
+    assert all(dataset.may_contain(variant_id) for variant_id in ids)
+
+
+def test_position_is_normalised_before_the_lookup(file_client):
+    dataset = file_client.get_dataset(GENOME_UUID)
+    assert dataset.may_contain("1:0010007:rs1639538116")
+    variant = file_client.get_variant_record(GENOME_UUID, "1:0010007:rs1639538116")
+    assert variant is not None and variant.name == "rs1639538116"
+    assert file_client.bloom_rejections == 0
+
+
+def test_unknown_id_is_rejected_without_a_read(file_client):
+    assert file_client.get_variant_record(GENOME_UUID, "1:10007:rs0") is None
+    assert file_client.bloom_rejections == 1
+
+
+def test_deletion_is_only_found_at_its_start(file_client):
+    # 1:10123 CCCTAA>C spans 10123-10128
+    variant = file_client.get_variant_record(GENOME_UUID, "1:10123:rs1639546401")
+    assert variant is not None and variant.name == "rs1639546401"
+    assert not file_client.get_dataset(GENOME_UUID).may_contain("1:10125:rs1639546401")
+
+
+def test_malformed_id_is_left_to_the_lookup(file_client):
+    assert file_client.get_dataset(GENOME_UUID).may_contain("rs1639538116")
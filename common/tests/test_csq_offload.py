@@ -0,0 +1,84 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import threading
+
+import pytest
+
+from common.csq_offload import CsqOffload
+from common.file_client import FileClient
+from common.file_model.variant import Variant
+
+GENOME_UUID = "a7335667-93e7-11ec-a39d-005056b38ce3"
+DATA_ROOT = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+
+
+@pytest.fixture
+def dataset():
+    file_client = FileClient(
+        {
+            "data_root": DATA_ROOT,
+            "dataset_reload_interval": "0",
+            "csq_offload_threshold": "0",
+        }
+    )
+    dataset = file_client.get_dataset(GENOME_UUID)
+    yield dataset
+    dataset.close()
+
+
+def variants(dataset, contig: str) -> list:
+    result = []
+    for line in dataset.fetch(contig, 0, 2**29):
+        record = dataset.parse(line)
+        if record.INFO.get("CSQ"):
+            result.append((Variant(record, dataset.header, GENOME_UUID), line))
+    return result
+
+
+def test_offloaded_decode_matches_in_process(dataset):
+    offload = CsqOffload(0, 1)
+    try:
+        for variant, line in variants(dataset, "13")[:5]:
+            offload.decode(variant, dataset.datafile, line)
+            in_process = Variant(dataset.parse(line), dataset.header, GENOME_UUID)
+            assert variant.decoded_csq == {
+                allele.allele_sequence: allele.info_map
+                for allele in in_process.get_alleles()
+            }
+    finally:
+        offload.close()
+    assert offload.counters["failed"] == 0 and offload.counters["offloaded"] == 5
+
+
+def test_close_cancels_queued_decodes(dataset):
+    offload = CsqOffload(0, 1)
+    queued = variants(dataset, "1")
+    threads = [
+        threading.Thread(target=offload.decode, args=(variant, dataset.datafile, line))
+        for variant, line in queued
+    ]
+    for thread in threads:
+        thread.start()
+    while len(offload.futures) + offload.counters["offloaded"] + offload.counters[
+        "failed"
+    ] < len(queued):
+        threading.Event().wait(0.01)
+    offload.close()
+    for thread in threads:
+        thread.join()
+    assert offload.counters["failed"] > 0
+    assert offload.counters["failed"] + offload.counters["offloaded"] == len(queued)
+    assert not offload.futures
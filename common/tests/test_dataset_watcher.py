@@ -0,0 +1,172 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+from common import genome_dataset
+from common.file_client import FileClient
+from common.genome_dataset import GenomeDataset
+
+GENOME_UUID = "a7335667-93e7-11ec-a39d-005056b38ce3"
+BUNDLED_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data", GENOME_UUID)
+VARIANT_ID = "1:10007:rs1639538116"
+
+
+def copy_genome(data_root: str, genome_uuid: str) -> None:
+    """
+    Copies the bundled VCF and index under data_root, moving them into place
+    so that a copy over an existing genome replaces its files
+    """
+    genome_dir = os.path.join(data_root, genome_uuid)
+    os.makedirs(genome_dir, exist_ok=True)
+    for name in ("variation.vcf.gz", "variation.vcf.gz.tbi"):
+        shutil.copyfile(
+            os.path.join(BUNDLED_DIR, name), os.path.join(genome_dir, name + ".tmp")
+        )
+        os.replace(
+            os.path.join(genome_dir, name + ".tmp"), os.path.join(genome_dir, name)
+        )
+
+
+@pytest.fixture
+def file_client(tmp_path):
+    copy_genome(str(tmp_path), GENOME_UUID)
+    client = FileClient(
+        {
+            "data_root": str(tmp_path),
+            "dataset_reload_interval": "0",
+            "csq_offload_threshold": "0",
+        }
+    )
+    yield client
+    for dataset in client.datasets.values():
+        dataset.close()
+
+
+def replace_and_reload(file_client: FileClient) -> None:
+    """
+    Replaces the files of the genome and polls until the watcher swapped in
+    the new dataset, which takes two polls seeing the same files
+    """
+    copy_genome(file_client.data_root, GENOME_UUID)
+    file_client.watcher.poll()
+    file_client.watcher.poll()
+
+
+def is_open(fd: int) -> bool:
+    try:
+        os.fstat(fd)
+        return True
+    except OSError:
+        return False
+
+
+def test_retired_dataset_is_closed_when_last_read_releases_it(file_client):
+    dataset = file_client.acquire_dataset(GENOME_UUID)
+    replace_and_reload(file_client)
+
+    assert file_client.datasets[GENOME_UUID] is not dataset
+    assert dataset.retired and not dataset.closed
+    # The read holding the old dataset can carry on with its files
+    assert any(
+        line.split("\t")[2] == "rs1639538116"
+        for line in dataset.fetch("1", 10006, 10007)
+    )
+
+    fd = dataset.tabix_file.bgzf.fd
+    dataset.release()
+    assert dataset.closed
+    assert not is_open(fd)
+
+
+def test_retired_dataset_without_reads_is_closed_at_once(file_client):
+    dataset = file_client.get_dataset(GENOME_UUID)
+    replace_and_reload(file_client)
+    assert dataset.closed
+    # Reads that looked it up before the swap get the new dataset instead
+    assert not dataset.acquire()
+    replacement = file_client.acquire_dataset(GENOME_UUID)
+    assert replacement is file_client.datasets[GENOME_UUID]
+    replacement.release()
+
+
+def test_variant_is_read_while_dataset_is_reloaded(file_client):
+    dataset = file_client.acquire_dataset(GENOME_UUID)
+    replace_and_reload(file_client)
+    variant = file_client.get_variant_record(GENOME_UUID, VARIANT_ID)
+    assert variant is not None and variant.name == "rs1639538116"
+    dataset.release()
+    assert dataset.closed
+    assert not file_client.datasets[GENOME_UUID].retired
+
+
+def test_dataset_opened_during_a_reload_is_kept(file_client):
+    other_uuid = "other-genome"
+    copy_genome(file_client.data_root, other_uuid)
+    file_client.get_dataset(GENOME_UUID)
+    copy_genome(file_client.data_root, GENOME_UUID)
+    file_client.watcher.poll()
+
+    opened = []
+    open_dataset = file_client.open_dataset
+
+    def open_dataset_with_request(genome_uuid, stage=True):
+        if genome_uuid == GENOME_UUID:
+            # A request for another genome comes in while the reload is built
+            opened.append(file_client.get_dataset(other_uuid))
+        return open_dataset(genome_uuid, stage)
+
+    file_client.open_dataset = open_dataset_with_request
+    file_client.watcher.poll()
+
+    assert file_client.datasets[other_uuid] is opened[0]
+    assert not opened[0].closed
+    assert file_client.watcher.reloads == 1
+
+
+def test_release_of_a_live_dataset_keeps_it_open(file_client):
+    dataset = file_client.acquire_dataset(GENOME_UUID)
+    dataset.release()
+    assert not dataset.closed
+    assert isinstance(file_client.get_dataset(GENOME_UUID), GenomeDataset)
+
+
+def test_sidecar_is_opened_once_by_concurrent_reads(file_client, monkeypatch):
+    dataset = file_client.get_dataset(GENOME_UUID)
+    opened = []
+    barrier = threading.Barrier(8)
+
+    def slow_open_for(datafile):
+        opened.append(datafile)
+        time.sleep(0.05)
+        return None
+
+    monkeypatch.setattr(genome_dataset.Sidecar, "open_for", slow_open_for)
+
+    def load():
+        barrier.wait()
+        dataset.load_sidecar()
+
+    threads = [threading.Thread(target=load) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert opened == [dataset.datafile]
+    assert dataset.sidecar_loaded
@@ -0,0 +1,229 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import copy
+import os
+import random
+
+import pytest
+import vcfpy
+
+from common.file_model import variant as variant_module
+from common.file_model.utils import minimise_allele
+from common.file_model.variant import Variant
+
+GENOME_UUID = "a7335667-93e7-11ec-a39d-005056b38ce3"
+VCF_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "data", GENOME_UUID, "variation.vcf.gz"
+)
+POPULATIONS = ["pop_a", "pop_b", "pop_c"]
+
+
+def legacy_frequency_flags(pop_frequency_map, pop_names, ref):
+    """
+    The per-allele sort-and-walk implementation that flag_minor_alleles
+    replaced, kept as the reference the vectorised flags must match
+    """
+    hpmaf = []
+    pop_frequency_map_transpose = {
+        pop_name: {
+            pop_allele: pop_frequency_map[pop_allele][pop_name]
+            for pop_allele in pop_frequency_map
+            if pop_name in pop_frequency_map[pop_allele]
+        }
+        for pop_name in pop_names
+    }
+    for pop_name in pop_frequency_map_transpose:
+        by_population = []
+        for pop_allele, pop_allele_freq in pop_frequency_map_transpose[
+            pop_name
+        ].items():
+            by_population.append(
+                [float(pop_allele_freq["allele_frequency"]), pop_allele, pop_name]
+            )
+        if not len(by_population):
+            continue
+        ref_allele = minimise_allele(ref, ref)
+        allele_frequency_ref = 1 - float(sum(list(zip(*by_population))[0]))
+        if allele_frequency_ref <= 1 and allele_frequency_ref >= 0:
+            population_frequency_ref = {
+                "population_name": pop_name,
+                "allele_frequency": allele_frequency_ref,
+                "allele_count": None,
+                "allele_number": None,
+                "is_minor_allele": False,
+                "is_hpmaf": False,
+            }
+            if ref_allele not in pop_frequency_map:
+                pop_frequency_map[ref_allele] = {}
+            pop_frequency_map[ref_allele][pop_name] = population_frequency_ref
+            by_population.append([allele_frequency_ref, ref_allele, pop_name])
+
+        by_population_sorted = sorted(by_population, key=lambda item: item[0])
+        if len(by_population_sorted) >= 2:
+            highest_frequency = by_population_sorted[-1][0]
+            maf_frequency = None
+            for pop in reversed(by_population_sorted[:-1]):
+                if pop[0] == highest_frequency:
+                    continue
+                elif pop[0] < highest_frequency and not maf_frequency:
+                    maf_frequency, maf_allele, maf_population = pop
+                    pop_frequency_map[maf_allele][maf_population][
+                        "is_minor_allele"
+                    ] = True
+                    hpmaf.append([maf_frequency, maf_allele, maf_population])
+                elif (
+                    maf_frequency
+                    and pop[0] == maf_frequency
+                    and maf_allele != ref_allele
+                ):
+                    pop_frequency_map[maf_allele][maf_population][
+                        "is_minor_allele"
+                    ] = True
+                    hpmaf.append([maf_frequency, maf_allele, maf_population])
+                elif maf_frequency and pop[0] < maf_frequency:
+                    break
+    if len(hpmaf) > 0:
+        hpmaf_sorted = sorted(hpmaf, key=lambda item: item[0])
+        hpmaf_frequency, hpmaf_allele, hpmaf_population = hpmaf_sorted[-1]
+        pop_frequency_map[hpmaf_allele][hpmaf_population]["is_hpmaf"] = True
+        for hpmaf_pop in reversed(hpmaf_sorted[:-1]):
+            if hpmaf_pop[0] == hpmaf_frequency:
+                hpmaf_frequency, hpmaf_allele, hpmaf_population = hpmaf_pop
+                pop_frequency_map[hpmaf_allele][hpmaf_population]["is_hpmaf"] = True
+            elif hpmaf_pop[0] < hpmaf_frequency:
+                break
+    return pop_frequency_map
+
+
+def frequency_map(frequencies):
+    """
+    {allele: {population: frequency}} as traverse_population_info returns it
+    """
+    return {
+        allele: {
+            pop_name: {
+                "population_name": pop_name,
+                "allele_frequency": frequency,
+                "allele_count": None,
+                "allele_number": None,
+                "is_minor_allele": False,
+                "is_hpmaf": False,
+            }
+            for pop_name, frequency in by_population.items()
+        }
+        for allele, by_population in frequencies.items()
+    }
+
+
+def vectorised_frequency_flags(monkeypatch, pop_frequency_map, pop_names, ref):
+    monkeypatch.setattr(
+        variant_module,
+        "get_population_plan",
+        lambda genome_uuid, header: [(name, []) for name in pop_names],
+    )
+    variant = Variant.__new__(Variant)
+    variant.genome_uuid = GENOME_UUID
+    variant.header = None
+    variant.ref = ref
+    variant.precomputed = {}
+    variant.traverse_population_info = lambda: pop_frequency_map
+    return variant.set_frequency_flags()
+
+
+def assert_same_flags(monkeypatch, frequencies, ref="A", pop_names=POPULATIONS):
+    pop_frequency_map = frequency_map(frequencies)
+    expected = legacy_frequency_flags(copy.deepcopy(pop_frequency_map), pop_names, ref)
+    assert (
+        vectorised_frequency_flags(monkeypatch, pop_frequency_map, pop_names, ref)
+        == expected
+    )
+
+
+@pytest.mark.parametrize(
+    "frequencies",
+    [
+        # biallelic
+        {"G": {"pop_a": 0.1, "pop_b": 0.6, "pop_c": 0.5}},
+        # multi-allelic
+        {
+            "G": {"pop_a": 0.1, "pop_b": 0.3},
+            "T": {"pop_a": 0.2, "pop_b": 0.05},
+            "C": {"pop_a": 0.3},
+        },
+        # alternative alleles tied on the minor allele frequency
+        {"G": {"pop_a": 0.2, "pop_b": 0.25}, "T": {"pop_a": 0.2, "pop_b": 0.25}},
+        # minor allele tied with the reference allele
+        {"G": {"pop_a": 0.25}, "T": {"pop_a": 0.5}},
+        # alternative allele tied with the major allele
+        {"G": {"pop_a": 0.4}, "T": {"pop_a": 0.4}},
+        # minor allele frequencies tied across populations
+        {"G": {"pop_a": 0.3, "pop_b": 0.3, "pop_c": 0.1}},
+        # minor allele frequency of 0
+        {"G": {"pop_a": 0.0, "pop_b": 1.0}, "T": {"pop_a": 0.0, "pop_b": 0.0}},
+        # missing frequencies
+        {"G": {"pop_a": 0.1}, "T": {"pop_b": 0.2}, "C": {}},
+        # frequencies adding up to more than 1 leave the reference out
+        {"G": {"pop_a": 0.7}, "T": {"pop_a": 0.6, "pop_b": 0.1}},
+        # a single population with a single allele
+        {"G": {"pop_c": 1.0}},
+        # no frequencies at all
+        {"G": {}},
+    ],
+)
+def test_matches_legacy_flags(monkeypatch, frequencies):
+    assert_same_flags(monkeypatch, frequencies)
+
+
+def test_reference_among_the_alleles(monkeypatch):
+    assert_same_flags(monkeypatch, {"A": {"pop_a": 0.2}, "G": {"pop_a": 0.3}}, ref="A")
+
+
+def test_matches_legacy_flags_on_random_tables(monkeypatch):
+    rng = random.Random(26)
+    choices = [0.0, 0.05, 0.1, 0.2, 0.25, 0.3, 0.5, 0.6, 0.7, 1.0]
+    for _ in range(2000):
+        alleles = rng.sample(["A", "C", "G", "T", "-", "AT", "GG"], rng.randint(1, 5))
+        frequencies = {
+            allele: {
+                pop_name: rng.choice(choices) if rng.random() < 0.7 else rng.random()
+                for pop_name in POPULATIONS
+                if rng.random() < 0.8
+            }
+            for allele in alleles
+        }
+        assert_same_flags(
+            monkeypatch, frequencies, ref=rng.choice(["A", "T", "AT", "C"])
+        )
+
+
+def test_matches_legacy_flags_on_bundled_variants():
+    reader = vcfpy.Reader.from_path(VCF_PATH)
+    try:
+        for record in reader:
+            variant = Variant(record, reader.header, GENOME_UUID)
+            pop_names = list(
+                dict.fromkeys(
+                    name
+                    for name, _ in variant_module.get_population_plan(
+                        GENOME_UUID, reader.header
+                    )
+                )
+            )
+            expected = legacy_frequency_flags(
+                variant.traverse_population_info(), pop_names, variant.ref
+            )
+            assert variant.set_frequency_flags() == expected, variant.name
+    finally:
+        reader.close()
@@ -0,0 +1,188 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import json
+import os
+
+import pytest
+
+from common.file_model.population_registry import (
+    FREQUENCIES_FILE,
+    METADATA_FILE,
+    PopulationRegistry,
+)
+
+GENOME_UUID = "a7335667-93e7-11ec-a39d-005056b38ce3"
+
+METADATA = {
+    "genome-a": [
+        {
+            "name": "ALL",
+            "description": "Everyone",
+            "type": "regional",
+            "is_global": True,
+            "display_group_name": "Project",
+            "super_population": None,
+            "sub_populations": [{"name": "EUR"}, {"name": "AFR"}],
+        },
+        {
+            "name": "EUR",
+            "is_global": False,
+            "display_group_name": "Project",
+            "super_population": {"name": "ALL"},
+            "sub_populations": [],
+        },
+        {
+            "name": "AFR",
+            "is_global": False,
+            "display_group_name": "Project",
+            "super_population": {"name": "ALL"},
+            "sub_populations": [],
+        },
+        {
+            "name": "Other:ALL",
+            "is_global": True,
+            "display_group_name": "Other",
+            "super_population": None,
+            "sub_populations": [],
+        },
+    ],
+    "genome-b": [{"name": "B", "is_global": True, "display_group_name": "Project"}],
+}
+FREQUENCIES = {
+    "genome-a": {
+        "Project": [
+            {"name": "ALL", "frequencies": {"af": "AF"}},
+            {"name": "EUR", "frequencies": {"af": "EUR_AF"}},
+        ]
+    }
+}
+
+
+def write_files(directory, metadata: dict, frequencies: dict) -> tuple:
+    metadata_file = os.path.join(directory, "population_metadata.json")
+    frequencies_file = os.path.join(directory, "populations.json")
+    with open(metadata_file, "w") as output:
+        json.dump(metadata, output)
+    with open(frequencies_file, "w") as output:
+        json.dump(frequencies, output)
+    return metadata_file, frequencies_file
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return PopulationRegistry(*write_files(str(tmp_path), METADATA, FREQUENCIES), 0)
+
+
+def names(populations) -> list:
+    return [population.name for population in populations]
+
+
+def test_lookup_by_genome_and_name(registry):
+    genome = registry.get("genome-a")
+    assert names(genome.populations) == ["ALL", "EUR", "AFR", "Other:ALL"]
+    assert genome.find(name="EUR")[0].display_group_name == "Project"
+    assert genome.find(name="ALL")[0].description == "Everyone"
+    assert genome.find(name="XYZ") == []
+    assert names(registry.get("genome-b").populations) == ["B"]
+    assert registry.get("genome-b").frequency_fields == []
+    assert registry.get("genome-c") is None
+    assert genome.frequency_fields == [("ALL", {"af": "AF"}), ("EUR", {"af": "EUR_AF"})]
+
+
+def test_find_filters(registry):
+    genome = registry.get("genome-a")
+    assert names(genome.find(is_global=True)) == ["ALL", "Other:ALL"]
+    assert names(genome.find(is_global=False)) == ["EUR", "AFR"]
+    assert names(genome.find(display_group_name="Project")) == ["ALL", "EUR", "AFR"]
+    assert names(genome.find(display_group_name="Other", is_global=True)) == [
+        "Other:ALL"
+    ]
+    assert names(genome.find(display_group_name="Project", is_global=False)) == [
+        "EUR",
+        "AFR",
+    ]
+    assert genome.find(name="EUR", is_global=True) == []
+    assert genome.find(name="EUR", display_group_name="Other") == []
+    assert genome.find(display_group_name="None") == []
+
+
+def test_super_and_sub_populations_are_shared_objects(registry):
+    genome = registry.get("genome-a")
+    everyone, european, african = genome.find(name="ALL") + genome.find(is_global=False)
+    assert everyone.sub_populations == [european, african]
+    assert all(sub is genome.by_name[sub.name] for sub in everyone.sub_populations)
+    assert european.super_population is everyone
+    assert african.super_population is everyone
+    assert everyone.super_population is None
+
+
+def test_bundled_files_link_every_population():
+    registry = PopulationRegistry(METADATA_FILE, FREQUENCIES_FILE, 0)
+    genome = registry.get(GENOME_UUID)
+    assert genome.populations
+    for population in genome.populations:
+        if population.super_population:
+            assert population in population.super_population.sub_populations
+        for sub_population in population.sub_populations:
+            assert sub_population.super_population is population
+
+
+def test_changed_files_are_loaded_on_refresh(tmp_path, registry):
+    metadata = {**METADATA, "genome-c": [{"name": "C", "is_global": True}]}
+    write_files(str(tmp_path), metadata, FREQUENCIES)
+    stat = os.stat(registry.metadata_file)
+    os.utime(registry.metadata_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    previous = registry.get("genome-a")
+    assert registry.get("genome-c") is None
+    registry.refresh()
+    assert registry.version == 2
+    assert names(registry.get("genome-c").populations) == ["C"]
+    # Callers holding the previous genomes keep them
+    assert registry.get("genome-a") is not previous
+    assert names(previous.populations) == ["ALL", "EUR", "AFR", "Other:ALL"]
+
+
+def test_unchanged_files_are_not_loaded_again(registry):
+    genome = registry.get("genome-a")
+    registry.refresh()
+    assert registry.version == 1
+    assert registry.get("genome-a") is genome
+
+
+def test_registry_checks_files_every_refresh_interval(tmp_path):
+    registry = PopulationRegistry(
+        *write_files(str(tmp_path), METADATA, FREQUENCIES), 60
+    )
+    write_files(str(tmp_path), {"genome-c": [{"name": "C"}]}, {})
+    os.utime(registry.metadata_file, ns=(0, 10**18))
+    assert registry.get("genome-c") is None
+    registry.checked_at -= 60
+    assert names(registry.get("genome-c").populations) == ["C"]
+
+
+def test_broken_file_keeps_the_loaded_registry(tmp_path, registry):
+    genome = registry.get("genome-a")
+    with open(registry.metadata_file, "w") as output:
+        output.write('{"genome-a": [')
+    registry.refresh()
+    assert registry.version == 1
+    assert registry.get("genome-a") is genome
+    # A population without a name cannot be loaded either
+    write_files(str(tmp_path), {"genome-a": [{"description": "unnamed"}]}, {})
+    registry.refresh()
+    assert registry.get("genome-a") is genome
+    write_files(str(tmp_path), METADATA, {})
+    registry.refresh()
+    assert registry.version == 2
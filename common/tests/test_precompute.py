@@ -0,0 +1,165 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import gzip
+import json
+import os
+import shutil
+
+import pysam
+import pytest
+import vcfpy
+
+from common.file_model.variant import Variant
+from common.genome_dataset import GenomeDataset
+from common.pipeline.manifest import load_manifest, parts_dir
+from common.pipeline.precompute import DERIVED_FIELDS, precompute_genome
+from common.pipeline.sidecar import Sidecar, sidecar_path
+
+GENOME_UUID = "a7335667-93e7-11ec-a39d-005056b38ce3"
+BUNDLED_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data", GENOME_UUID)
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+@pytest.fixture
+def datafile(tmp_path):
+    """
+    A copy of the bundled genome, precomputed
+    """
+    genome_dir = tmp_path / GENOME_UUID
+    genome_dir.mkdir()
+    for name in ("variation.vcf.gz", "variation.vcf.gz.tbi"):
+        shutil.copy2(os.path.join(BUNDLED_DIR, name), genome_dir / name)
+    datafile = str(genome_dir / "variation.vcf.gz")
+    assert precompute_genome(GENOME_UUID, datafile, 1) == (86, 6)
+    return datafile
+
+
+def test_precomputed_fields_equal_the_lazily_computed_ones(datafile):
+    sidecar = Sidecar.open_for(datafile)
+    assert sidecar is not None
+    reader = vcfpy.Reader.from_path(datafile)
+    records = 0
+    try:
+        for rec in reader:
+            precomputed = sidecar.get(rec.CHROM, rec.POS, rec.ID[0])
+            assert set(precomputed) == set(DERIVED_FIELDS), rec.ID[0]
+            lazy = Variant(rec, reader.header, GENOME_UUID)
+            stored = Variant(rec, reader.header, GENOME_UUID, precomputed)
+            for field, method in DERIVED_FIELDS.items():
+                # The sidecar holds JSON, so tuples come back as lists
+                assert method(stored) == json.loads(json.dumps(method(lazy))), (
+                    rec.ID[0],
+                    field,
+                )
+            records += 1
+    finally:
+        reader.close()
+        sidecar.close()
+    assert records == 86
+
+
+def get_precomputed(datafile: str):
+    dataset = GenomeDataset(GENOME_UUID, datafile)
+    try:
+        return dataset.get_precomputed(next(vcfpy.Reader.from_path(datafile)))
+    finally:
+        dataset.close()
+
+
+def test_sidecar_of_the_same_file_is_used(datafile):
+    sidecar = Sidecar.open_for(datafile)
+    assert sidecar is not None
+    sidecar.close()
+    assert set(get_precomputed(datafile)) == set(DERIVED_FIELDS)
+
+
+def test_sidecar_is_ignored_when_the_vcf_mtime_changes(datafile):
+    stat = os.stat(datafile)
+    os.utime(datafile, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert Sidecar.open_for(datafile) is None
+    assert get_precomputed(datafile) is None
+
+
+def test_sidecar_is_ignored_when_the_vcf_size_changes(datafile):
+    stat = os.stat(datafile)
+    # An extra empty BGZF block, keeping the file valid and its mtime
+    with open(datafile, "ab") as vcf:
+        vcf.write(BGZF_EOF)
+    os.utime(datafile, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.stat(datafile).st_mtime_ns == stat.st_mtime_ns
+    assert Sidecar.open_for(datafile) is None
+    assert get_precomputed(datafile) is None
+
+
+def test_missing_or_unreadable_sidecar_is_ignored(datafile):
+    with open(sidecar_path(datafile), "wb") as sidecar_file:
+        sidecar_file.write(b"not a database")
+    assert Sidecar.open_for(datafile) is None
+    os.remove(sidecar_path(datafile))
+    assert Sidecar.open_for(datafile) is None
+    assert get_precomputed(datafile) is None
+
+
+def rewrite_vcf(datafile: str, contig: str) -> None:
+    """
+    Compresses the VCF again with the QUAL of the first record of contig
+    changed, and indexes it again
+    """
+    with gzip.open(datafile, "rt") as vcf:
+        lines = vcf.readlines()
+    for number, line in enumerate(lines):
+        columns = line.split("\t")
+        if columns[0] == contig:
+            columns[5] = "50"
+            lines[number] = "\t".join(columns)
+            break
+    plain = datafile[: -len(".gz")]
+    with open(plain, "w") as vcf:
+        vcf.writelines(lines)
+    pysam.tabix_index(plain, preset="vcf", force=True)
+
+
+def test_unchanged_vcf_rebuilds_no_contig(datafile):
+    parts = sorted(os.listdir(parts_dir(datafile)))
+    assert len(parts) == 6
+    manifest = load_manifest(datafile)
+    assert precompute_genome(GENOME_UUID, datafile, 1) == (86, 0)
+    assert sorted(os.listdir(parts_dir(datafile))) == parts
+    assert load_manifest(datafile)["contigs"] == manifest["contigs"]
+    assert Sidecar.open_for(datafile) is not None
+
+
+def test_changed_contig_is_the_only_one_rebuilt(datafile):
+    before = {entry["name"]: entry for entry in load_manifest(datafile)["contigs"]}
+    rewrite_vcf(datafile, "13")
+    # Compressing again moves the blocks of every contig, the record
+    # checksums tell that only contig 13 changed
+    assert precompute_genome(GENOME_UUID, datafile, 1) == (86, 1)
+    after = {entry["name"]: entry for entry in load_manifest(datafile)["contigs"]}
+    assert after.keys() == before.keys()
+    changed = {name for name in after if after[name]["part"] != before[name]["part"]}
+    assert changed == {"13"}
+    assert sorted(os.listdir(parts_dir(datafile))) == sorted(
+        entry["part"] for entry in after.values()
+    )
+    sidecar = Sidecar.open_for(datafile)
+    assert sidecar is not None
+    assert sidecar.get("13", 32341045, "rs919611062")
+    sidecar.close()
+    assert precompute_genome(GENOME_UUID, datafile, 1) == (86, 0)
+
+
+def test_full_precompute_rebuilds_every_contig(datafile):
+    assert precompute_genome(GENOME_UUID, datafile, 1, full=True) == (86, 6)
@@ -0,0 +1,128 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import struct
+
+import pytest
+
+from common.shared_cache import (
+    FILE_HEADER_SIZE,
+    SLOT_HEADER,
+    SLOT_HEADER_SIZE,
+    SharedCache,
+    hash_key,
+)
+
+SLOT_SIZE = 256
+WAYS = 4
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """
+    A cache of a single set, so that every key competes for the same slots
+    """
+    cache = SharedCache(
+        str(tmp_path / "cache"), FILE_HEADER_SIZE + WAYS * SLOT_SIZE, SLOT_SIZE, WAYS
+    )
+    yield cache
+    cache.close()
+
+
+def slot_of(cache: SharedCache, key: bytes) -> int:
+    for offset in cache.slot_offsets(hash_key(key)):
+        _, _, _, key_length, value_length, _ = SLOT_HEADER.unpack_from(
+            cache.map, offset
+        )
+        start = offset + SLOT_HEADER_SIZE
+        if value_length and cache.map[start : start + key_length] == key:
+            return offset
+    raise KeyError(key)
+
+
+def test_values_are_shared_through_the_file(cache):
+    assert cache.n_sets == 1
+    assert cache.get(b"1:10007:rs1") is None
+    assert cache.set(b"1:10007:rs1", b"value")
+    assert cache.get(b"1:10007:rs1") == b"value"
+    other = SharedCache(cache.path, 1 << 20)
+    try:
+        # The layout of an existing file wins over the configured size
+        assert (other.n_sets, other.ways, other.slot_size) == (1, WAYS, SLOT_SIZE)
+        assert other.get(b"1:10007:rs1") == b"value"
+        assert other.set(b"1:10007:rs1", b"replaced")
+    finally:
+        other.close()
+    assert cache.get(b"1:10007:rs1") == b"replaced"
+    assert cache.counters["hits"] == 2 and cache.counters["misses"] == 1
+
+
+def test_slot_being_written_is_a_miss(cache):
+    cache.set(b"key", b"value")
+    offset = slot_of(cache, b"key")
+    sequence = SLOT_HEADER.unpack_from(cache.map, offset)[0]
+    assert sequence % 2 == 0
+    # A writer that died half way leaves an odd sequence
+    struct.pack_into("<Q", cache.map, offset, sequence + 1)
+    assert cache.get(b"key") is None
+    # The next write of the key goes to the same slot and completes it
+    assert cache.set(b"key", b"again")
+    assert slot_of(cache, b"key") == offset
+    assert cache.get(b"key") == b"again"
+
+
+def test_torn_contents_fail_the_crc_and_are_a_miss(cache):
+    cache.set(b"key", b"value")
+    offset = slot_of(cache, b"key")
+    value_start = offset + SLOT_HEADER_SIZE + len(b"key")
+    cache.map[value_start : value_start + 5] = b"VALUE"
+    assert cache.get(b"key") is None
+    assert cache.counters["torn_reads"] == 1
+    assert cache.counters["misses"] == 1
+
+
+def test_least_recently_used_slot_of_the_set_is_evicted(cache):
+    keys = [f"key{index}".encode() for index in range(WAYS)]
+    for key in keys:
+        assert cache.set(key, key + b"-value")
+    assert cache.counters["evictions"] == 0
+    # key0 is read, so key1 is now the least recently used
+    assert cache.get(keys[0]) == b"key0-value"
+    assert cache.set(b"key4", b"key4-value")
+    assert cache.counters["evictions"] == 1
+    assert cache.get(keys[1]) is None
+    for key in (keys[0], keys[2], keys[3], b"key4"):
+        assert cache.get(key) == key + b"-value"
+    # Replacing a cached key evicts nothing
+    assert cache.set(keys[2], b"new")
+    assert cache.counters["evictions"] == 1
+    assert cache.get(keys[3]) == b"key3-value"
+
+
+def test_values_that_do_not_fit_in_a_slot_are_not_cached(cache):
+    assert not cache.set(b"key", b"x" * SLOT_SIZE)
+    assert not cache.set(b"key", b"")
+    assert cache.get(b"key") is None
+    assert cache.counters["too_large"] == 2
+
+
+def test_file_of_another_format_is_refused(tmp_path):
+    path = tmp_path / "cache"
+    path.write_bytes(b"\0" * 128)
+    with pytest.raises(ValueError):
+        SharedCache(str(path), 1 << 20)
+
+
+def test_no_cache_without_a_path():
+    assert SharedCache.from_config({}) is None
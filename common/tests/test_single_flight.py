@@ -0,0 +1,131 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from common.admission import Overloaded
+from common.file_client import FileClient
+
+GENOME_UUID = "a7335667-93e7-11ec-a39d-005056b38ce3"
+DATA_ROOT = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+VARIANT_ID = "1:10007:rs1639538116"
+OTHER_VARIANT_ID = "13:32341045:rs919611062"
+
+
+@pytest.fixture
+def file_client():
+    client = FileClient(
+        {
+            "data_root": DATA_ROOT,
+            "dataset_reload_interval": "0",
+            "csq_offload_threshold": "0",
+        }
+    )
+    yield client
+    client.executor.shutdown()
+    for dataset in client.datasets.values():
+        dataset.close()
+
+
+class Reads:
+    """
+    Variant ids read from the files, each read held until release is set
+    and then failing with error, if one is given
+    """
+
+    def __init__(self, file_client: FileClient) -> None:
+        self.ids = []
+        self.release = threading.Event()
+        self.error = None
+        self.get_variant_record = file_client.get_variant_record
+        file_client.get_variant_record = self.read
+
+    def read(self, genome_uuid: str, variant_id: str):
+        self.ids.append(variant_id)
+        self.release.wait(5)
+        if self.error:
+            raise self.error
+        return self.get_variant_record(genome_uuid, variant_id)
+
+
+@pytest.fixture
+def reads(file_client):
+    return Reads(file_client)
+
+
+async def fetch_together(file_client, reads, variant_ids, deadlines=None):
+    deadlines = deadlines or [None] * len(variant_ids)
+    fetches = [
+        asyncio.ensure_future(
+            file_client.fetch_variant_record(GENOME_UUID, variant_id, deadline)
+        )
+        for variant_id, deadline in zip(variant_ids, deadlines)
+    ]
+    # Every fetch has joined or started its read before the reads finish
+    await asyncio.sleep(0.05)
+    reads.release.set()
+    return await asyncio.gather(*fetches, return_exceptions=True)
+
+
+def test_concurrent_fetches_of_a_variant_share_one_read(file_client, reads):
+    results = asyncio.run(fetch_together(file_client, reads, [VARIANT_ID] * 10))
+    assert reads.ids == [VARIANT_ID]
+    assert file_client.coalesced == 9
+    assert results[0] is not None and results[0].name == "rs1639538116"
+    assert all(result is results[0] for result in results)
+    assert file_client.inflight == {}
+
+
+def test_fetches_of_different_variants_read_separately(file_client, reads):
+    variant_ids = [VARIANT_ID, OTHER_VARIANT_ID] * 3
+    results = asyncio.run(fetch_together(file_client, reads, variant_ids))
+    assert sorted(reads.ids) == sorted([VARIANT_ID, OTHER_VARIANT_ID])
+    assert file_client.coalesced == 4
+    assert [result.name for result in results] == [
+        "rs1639538116",
+        "rs919611062",
+    ] * 3
+
+
+def test_later_fetch_reads_again(file_client, reads):
+    reads.release.set()
+    first = asyncio.run(file_client.fetch_variant_record(GENOME_UUID, VARIANT_ID))
+    second = asyncio.run(file_client.fetch_variant_record(GENOME_UUID, VARIANT_ID))
+    assert reads.ids == [VARIANT_ID, VARIANT_ID]
+    assert first is not second
+    assert file_client.coalesced == 0
+
+
+def test_error_of_a_shared_read_reaches_every_caller(file_client, reads):
+    reads.error = OSError("backend unavailable")
+    results = asyncio.run(fetch_together(file_client, reads, [VARIANT_ID] * 5))
+    assert reads.ids == [VARIANT_ID]
+    assert all(result is reads.error for result in results)
+    assert file_client.inflight == {}
+
+
+def test_each_caller_waits_until_its_own_deadline(file_client, reads):
+    deadlines = [time.monotonic() + 0.01, None, None]
+    results = asyncio.run(
+        fetch_together(file_client, reads, [VARIANT_ID] * 3, deadlines)
+    )
+    assert isinstance(results[0], Overloaded)
+    assert results[1] is results[2] is not None
+    assert reads.ids == [VARIANT_ID]
+    assert file_client.fetches.counters["timed_out"] == 1
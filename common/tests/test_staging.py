@@ -0,0 +1,108 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import shutil
+import threading
+
+import pytest
+
+from common.file_client import FileClient
+
+GENOME_UUID = "a7335667-93e7-11ec-a39d-005056b38ce3"
+BUNDLED_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data", GENOME_UUID)
+
+
+@pytest.fixture
+def file_client(tmp_path):
+    data_root = tmp_path / "data"
+    (data_root / GENOME_UUID).mkdir(parents=True)
+    for name in ("variation.vcf.gz", "variation.vcf.gz.tbi"):
+        shutil.copy2(os.path.join(BUNDLED_DIR, name), data_root / GENOME_UUID / name)
+    client = FileClient(
+        {
+            "data_root": str(data_root),
+            "staging_root": str(tmp_path / "staging"),
+            "dataset_reload_interval": "0",
+            "csq_offload_threshold": "0",
+        }
+    )
+    yield client
+    if client.staging.executor:
+        client.staging.executor.shutdown()
+    for dataset in client.datasets.values():
+        dataset.close()
+
+
+def staging_threads() -> list:
+    return [
+        thread for thread in threading.enumerate() if thread.name.startswith("staging")
+    ]
+
+
+def test_preload_starts_no_staging_thread(file_client):
+    threads = staging_threads()
+    assert file_client.preload() == [GENOME_UUID]
+    assert file_client.staging.executor is None
+    assert staging_threads() == threads
+    assert (
+        file_client.datasets[GENOME_UUID].datafile
+        == file_client.datasets[GENOME_UUID].source
+    )
+
+
+def test_start_stages_preloaded_genomes(file_client):
+    file_client.preload()
+    file_client.start()
+    file_client.staging.executor.shutdown()
+    source = file_client.datasets[GENOME_UUID].source
+    local_datafile = file_client.staging.ready(GENOME_UUID, source)
+    assert local_datafile and local_datafile != source
+    # The next check swaps the dataset for the staged copy
+    file_client.watcher.poll()
+    assert file_client.datasets[GENOME_UUID].datafile == local_datafile
+
+
+def test_request_queues_staging(file_client):
+    file_client.get_dataset(GENOME_UUID)
+    file_client.staging.executor.shutdown()
+    assert file_client.staging.ready(
+        GENOME_UUID, file_client.datasets[GENOME_UUID].source
+    )
+
+
+def test_genome_is_pending_until_its_copy_ends(file_client, monkeypatch):
+    staging = file_client.staging
+    started, release = threading.Event(), threading.Event()
+    copies = []
+    copy_dataset = staging.copy_dataset
+
+    def blocking_copy_dataset(genome_uuid, datafile):
+        copies.append(genome_uuid)
+        started.set()
+        release.wait(5)
+        copy_dataset(genome_uuid, datafile)
+
+    monkeypatch.setattr(staging, "copy_dataset", blocking_copy_dataset)
+    datafile = os.path.join(file_client.data_root, GENOME_UUID, "variation.vcf.gz")
+    staging.schedule(GENOME_UUID, datafile)
+    assert started.wait(5)
+    assert staging.stats()["pending"] == [GENOME_UUID]
+    # Scheduled again while it is copied, it is not queued twice
+    staging.schedule(GENOME_UUID, datafile)
+    release.set()
+    staging.executor.shutdown()
+    assert copies == [GENOME_UUID]
+    assert staging.stats()["pending"] == []
+    assert staging.ready(GENOME_UUID, datafile)
@@ -0,0 +1,248 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import os
+import random
+import shutil
+
+import pysam
+import pytest
+
+from common.tabix import BGZFFile, BlockCache, TabixFile
+
+GENOME_UUID = "a7335667-93e7-11ec-a39d-005056b38ce3"
+BUNDLED_VCF = os.path.join(
+    os.path.dirname(__file__), "..", "..", "data", GENOME_UUID, "variation.vcf.gz"
+)
+SYNTHETIC_CONTIGS = {"chr1": 2_000_000, "chr2": 500_000}
+
+
+def write_synthetic_vcf(path: str) -> str:
+    """
+    A bgzipped, indexed VCF spanning many BGZF blocks, with deletions and
+    records whose INFO END reaches far past their REF
+    """
+    rng = random.Random(29)
+    lines = ["##fileformat=VCFv4.2"]
+    lines += [
+        f"##contig=<ID={contig},length={length}>"
+        for contig, length in SYNTHETIC_CONTIGS.items()
+    ]
+    lines.append('##INFO=<ID=END,Number=1,Type=Integer,Description="End position">')
+    lines.append('##INFO=<ID=NOTE,Number=1,Type=String,Description="Padding">')
+    lines.append("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO")
+    for contig, length in SYNTHETIC_CONTIGS.items():
+        position = 1
+        for number in range(4000 if contig == "chr1" else 500):
+            position += rng.choice([0, 1, 7, 50, 300])
+            if position >= length - 20_000:
+                break
+            ref = rng.choice(["A", "C", "GT", "TTAGGC"])
+            info = f"NOTE={'x' * rng.randint(1, 40)}"
+            if number % 37 == 0:
+                info = f"END={position + rng.randint(100, 20_000)};{info}"
+            elif number % 53 == 0:
+                # END= in another key must not be read as the end
+                info = f"XEND=1;{info}"
+            lines.append(f"{contig}\t{position}\trs{number}\t{ref}\tN\t.\tPASS\t{info}")
+    plain_path = os.path.join(path, "synthetic.vcf")
+    with open(plain_path, "w") as vcf:
+        vcf.write("\n".join(lines) + "\n")
+    datafile = plain_path + ".gz"
+    pysam.tabix_compress(plain_path, datafile)
+    pysam.tabix_index(datafile, preset="vcf")
+    return datafile
+
+
+@pytest.fixture(scope="module")
+def synthetic_vcf(tmp_path_factory):
+    return write_synthetic_vcf(str(tmp_path_factory.mktemp("tabix")))
+
+
+def pysam_fetch(datafile: str, contig: str, beg: int, end: int) -> list:
+    tabix_file = pysam.TabixFile(datafile)
+    try:
+        return list(tabix_file.fetch(contig, beg, end))
+    finally:
+        tabix_file.close()
+
+
+def assert_same_regions(
+    datafile: str, regions: list, block_cache: BlockCache = None
+) -> None:
+    tabix_file = TabixFile(datafile, block_cache=block_cache)
+    expected_file = pysam.TabixFile(datafile)
+    try:
+        for contig, beg, end in regions:
+            assert list(tabix_file.fetch(contig, beg, end)) == list(
+                expected_file.fetch(contig, beg, end)
+            ), (
+                contig,
+                beg,
+                end,
+            )
+    finally:
+        tabix_file.close()
+        expected_file.close()
+
+
+def record_regions(datafile: str, every: int = 1) -> list:
+    """
+    Regions around the start and the end of records: each edge, one base
+    before and after it, and the empty region at the edge. Every record
+    with an INFO END is included and, of the others, one in every
+    """
+    regions = []
+    tabix_file = pysam.TabixFile(datafile)
+    try:
+        for contig in tabix_file.contigs:
+            for number, line in enumerate(tabix_file.fetch(contig)):
+                columns = line.split("\t")
+                beg = int(columns[1]) - 1
+                end = beg + len(columns[3])
+                for field in columns[7].split(";"):
+                    if field.startswith("END="):
+                        end = int(field[4:])
+                if number % every and end == beg + len(columns[3]):
+                    continue
+                for edge in (beg, end):
+                    regions += [
+                        (contig, max(edge - 1, 0), edge),
+                        (contig, edge, edge + 1),
+                        (contig, max(edge - 1, 0), edge + 1),
+                        (contig, edge, edge),
+                    ]
+    finally:
+        tabix_file.close()
+    return regions
+
+
+def test_bundled_contigs_match_pysam():
+    expected_file = pysam.TabixFile(BUNDLED_VCF)
+    tabix_file = TabixFile(BUNDLED_VCF)
+    try:
+        assert tabix_file.contigs == list(expected_file.contigs)
+        for contig in expected_file.contigs:
+            assert list(tabix_file.fetch(contig, 0, 2**29)) == list(
+                expected_file.fetch(contig)
+            ), contig
+    finally:
+        tabix_file.close()
+        expected_file.close()
+
+
+def test_bundled_region_edges_match_pysam():
+    assert_same_regions(BUNDLED_VCF, record_regions(BUNDLED_VCF))
+
+
+def test_unknown_contig_has_no_records():
+    tabix_file = TabixFile(BUNDLED_VCF)
+    try:
+        assert list(tabix_file.fetch("not_a_contig", 0, 1000)) == []
+    finally:
+        tabix_file.close()
+    # pysam raises instead, which callers turned into an unknown variant too
+    with pytest.raises(ValueError):
+        pysam_fetch(BUNDLED_VCF, "not_a_contig", 0, 1000)
+
+
+def test_synthetic_records_cross_block_boundaries(synthetic_vcf):
+    bgzf = BGZFFile(synthetic_vcf)
+    try:
+        offset, blocks, split_lines = 0, 0, 0
+        while True:
+            data, block_size = bgzf.inflate_block(offset)
+            if not data:
+                break
+            blocks += 1
+            split_lines += not data.endswith(b"\n")
+            offset += block_size
+    finally:
+        bgzf.close()
+    assert blocks > 3
+    assert split_lines > 0
+
+
+def test_synthetic_contigs_match_pysam(synthetic_vcf):
+    assert_same_regions(
+        synthetic_vcf,
+        [(contig, 0, length) for contig, length in SYNTHETIC_CONTIGS.items()],
+    )
+
+
+def test_synthetic_region_edges_match_pysam(synthetic_vcf):
+    assert_same_regions(synthetic_vcf, record_regions(synthetic_vcf, every=20))
+
+
+def test_synthetic_random_regions_match_pysam(synthetic_vcf):
+    rng = random.Random(2929)
+    regions = []
+    for _ in range(500):
+        contig = rng.choice(list(SYNTHETIC_CONTIGS))
+        beg = rng.randrange(SYNTHETIC_CONTIGS[contig])
+        regions.append((contig, beg, beg + rng.choice([1, 10, 1000, 50_000])))
+    assert_same_regions(synthetic_vcf, regions)
+    # and again through a block cache, cold then warm
+    block_cache = BlockCache(16 * 1024 * 1024)
+    assert_same_regions(synthetic_vcf, regions, block_cache)
+    assert_same_regions(synthetic_vcf, regions, block_cache)
+    assert block_cache.stats()["hits"] > 0
+
+
+def test_block_cache_is_bounded_in_bytes_and_evicts_the_least_recently_used():
+    block_cache = BlockCache(10)
+    block_cache.put(("file", 0), (b"aaaa", 100))
+    block_cache.put(("file", 1), (b"bbbb", 100))
+    assert block_cache.get(("file", 0)) == (b"aaaa", 100)
+    block_cache.put(("file", 2), (b"cccc", 100))
+    assert block_cache.get(("file", 1)) is None
+    assert block_cache.get(("file", 0)) == (b"aaaa", 100)
+    assert block_cache.get(("file", 2)) == (b"cccc", 100)
+    # A block already cached is not counted twice
+    block_cache.put(("file", 2), (b"cccc", 100))
+    # A block larger than the whole cache is not cached and evicts nothing
+    block_cache.put(("file", 3), (b"d" * 11, 100))
+    stats = block_cache.stats()
+    assert (stats["blocks"], stats["bytes"], stats["evictions"]) == (2, 8, 1)
+    assert stats["bytes"] <= stats["max_bytes"]
+    block_cache.put(("file", 4), (b"eeeeeeeee", 100))
+    stats = block_cache.stats()
+    assert (stats["blocks"], stats["bytes"], stats["evictions"]) == (1, 9, 3)
+
+
+def test_blocks_of_a_replaced_file_are_never_served(tmp_path, synthetic_vcf):
+    block_cache = BlockCache(16 * 1024 * 1024)
+    path = str(tmp_path / "variation.vcf.gz")
+    shutil.copyfile(BUNDLED_VCF, path)
+    bgzf = BGZFFile(path, block_cache)
+    bundled_block = bgzf.read_block(0)
+    assert bgzf.read_block(0) == bundled_block
+    bgzf.close()
+    assert block_cache.stats()["hits"] == 1
+
+    # Replaced by a rename, as new releases are
+    shutil.copyfile(synthetic_vcf, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    bgzf = BGZFFile(path, block_cache)
+    assert bgzf.read_block(0) == bgzf.inflate_block(0) != bundled_block
+    bgzf.close()
+
+    # Overwritten in place, keeping the inode
+    with open(BUNDLED_VCF, "rb") as source, open(path, "r+b") as target:
+        target.truncate(0)
+        target.write(source.read())
+    bgzf = BGZFFile(path, block_cache)
+    assert bgzf.read_block(0) == bundled_block
+    bgzf.close()
+    assert block_cache.stats()["hits"] == 1
@@ -0,0 +1,74 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import time
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from common.admission import AdmissionController, Overloaded
+
+
+class AdmissionMiddleware:
+    """
+    Limits how many GraphQL requests a worker executes at once. Requests
+    over the limit wait in a bounded queue; when the queue is full, or the
+    request could not start before its deadline, it is answered straight
+    away with a 503 and a Retry-After header instead of piling up. The
+    deadline is stored in the request state so resolvers can give up on
+    slow reads at the same time
+    """
+
+    def __init__(
+        self, app: ASGIApp, controller: AdmissionController, timeout: float
+    ) -> None:
+        self.app = app
+        self.controller = controller
+        self.timeout = timeout
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # Only POST requests execute queries, the explorer and /stats are not limited
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        deadline = time.monotonic() + self.timeout
+        scope.setdefault("state", {})["deadline"] = deadline
+        try:
+            granted = await self.controller.acquire(deadline)
+        except Overloaded as e:
+            await overloaded_response(e)(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(granted)
+
+
+def overloaded_response(error: Overloaded) -> JSONResponse:
+    return JSONResponse(
+        {
+            "data": None,
+            "errors": [
+                {
+                    "message": str(error),
+                    "extensions": {
+                        "code": "SERVICE_UNAVAILABLE",
+                        "retry_after": error.retry_after,
+                    },
+                }
+            ],
+        },
+        status_code=503,
+        headers={"Retry-After": str(error.retry_after)},
+    )
@@ -0,0 +1,388 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Any, Iterator, List, Mapping, Optional, Tuple
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from common.file_client import FileClient
+from common.genome_dataset import GenomeDataset
+from common.tabix import TabixIndex
+from graphql_service.ariadne_app import prepare_executable_schema
+from graphql_service.export import VariantExporter
+
+log = logging.getLogger(__name__)
+
+# Variant ids are partitioned by contig and by windows of this many bases,
+# so that the largest contigs are shared between processes
+PARTITION_SIZE = 10_000_000
+# Ids held in memory before being appended to their partition files
+PARTITION_BUFFER = 100_000
+PARQUET_BATCH_SIZE = 10_000
+
+# FileClient and VariantExporter of a pool process, set by init_worker
+_worker = None
+
+
+def parse_variant_id(variant_id: str) -> Optional[Tuple[str, int, str]]:
+    """
+    Splits contig:position:identifier, None when it is not in that format
+    """
+    parts = variant_id.split(":")
+    if len(parts) != 3 or not parts[0] or not parts[2]:
+        return None
+    try:
+        return parts[0], int(parts[1]), parts[2]
+    except ValueError:
+        return None
+
+
+def partition_ids(
+    input_path: str, tmp_dir: str
+) -> Tuple[Mapping[Tuple[str, int], str], str, int]:
+    """
+    Streams the variant ids of input_path into one file per (contig,
+    window) partition and the ids that cannot be parsed into another.
+    Returns the partition files, the file of invalid ids and the id count
+    """
+    partitions = {}
+    buffers = {}
+    buffered = 0
+    count = 0
+    invalid_path = os.path.join(tmp_dir, "invalid.txt")
+
+    def flush():
+        for key, lines in buffers.items():
+            with open(partitions[key], "a") as partition_file:
+                partition_file.writelines(lines)
+        buffers.clear()
+
+    with open(input_path) as input_file, open(invalid_path, "w") as invalid_file:
+        for line in input_file:
+            variant_id = line.strip()
+            if not variant_id or variant_id.startswith("#"):
+                continue
+            count += 1
+            parsed = parse_variant_id(variant_id)
+            if parsed is None:
+                invalid_file.write(f"{variant_id}\n")
+                continue
+            contig, pos, name = parsed
+            key = (contig, pos // PARTITION_SIZE)
+            if key not in partitions:
+                partitions[key] = os.path.join(
+                    tmp_dir, f"partition-{len(partitions)}.txt"
+                )
+            buffers.setdefault(key, []).append(f"{pos}\t{name}\t{variant_id}\n")
+            buffered += 1
+            if buffered >= PARTITION_BUFFER:
+                flush()
+                buffered = 0
+    flush()
+    return partitions, invalid_path, count
+
+
+def init_worker(
+    data_root: str, fields: Optional[List[str]], exclude: Optional[List[str]]
+) -> None:
+    global _worker
+    # One sequential sweep per process: no reloads, no nested process pool
+    file_client = FileClient(
+        {
+            "data_root": data_root,
+            "dataset_reload_interval": 0,
+            "csq_offload_threshold": 0,
+        }
+    )
+    _worker = (
+        file_client,
+        VariantExporter(
+            prepare_executable_schema(),
+            fields,
+            exclude,
+            context={"file_client": file_client, "request": None},
+        ),
+    )
+
+
+def sweep(
+    file_client: FileClient,
+    genome_uuid: str,
+    contig: str,
+    ids: List[Tuple[int, str, str]],
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Yields (requested id, Variant or None) for ids sorted by position, in
+    one pass over the contig. Nearby variants are read together
+    """
+    collection = file_client.get_dataset(genome_uuid)
+    wanted = sorted(
+        {
+            (contig, pos, name)
+            for pos, name, _ in ids
+            if collection.may_contain(f"{contig}:{pos}:{name}")
+        },
+        key=lambda key: (key[1], key[2]),
+    )
+    lines = collection.fetch_variants(wanted)
+    # Records at the position being looked up, and the next one read
+    current = {}
+    next_line = next(lines, None)
+    for pos, name, variant_id in ids:
+        if current and next(iter(current))[0] < pos:
+            current = {}
+        while next_line is not None:
+            columns = next_line.split("\t", 3)
+            line_pos = int(columns[1])
+            if line_pos > pos:
+                break
+            if line_pos == pos:
+                current[(line_pos, columns[2].split(";")[0])] = next_line
+            next_line = next(lines, None)
+        line = current.get((pos, name))
+        if line is None:
+            yield variant_id, None
+            continue
+        rec = collection.parse(line)
+        yield variant_id, file_client.make_variant(
+            collection, line, rec, collection.get_precomputed(rec)
+        )
+
+
+def annotate_partition(task: Tuple[str, str, str, str]) -> Tuple[str, int, int]:
+    """
+    Runs in a pool process: resolves the ids of one partition into
+    {"variant_id", "variant"} JSON lines, variant being null when the id is
+    not in the genome
+    """
+    genome_uuid, contig, partition_path, output_path = task
+    file_client, exporter = _worker
+    with open(partition_path) as partition_file:
+        ids = []
+        for line in partition_file:
+            pos, name, variant_id = line.rstrip("\n").split("\t")
+            ids.append((int(pos), name, variant_id))
+    ids.sort()
+    found = 0
+    with open(output_path, "w") as output_file:
+        for variant_id, variant in sweep(file_client, genome_uuid, contig, ids):
+            payload = (
+                exporter.serialise_variant(variant) if variant is not None else None
+            )
+            found += payload is not None
+            output_file.write(
+                json.dumps(
+                    {"variant_id": variant_id, "variant": payload},
+                    separators=(",", ":"),
+                )
+                + "\n"
+            )
+    return output_path, len(ids), found
+
+
+def write_parquet(part_paths: List[str], output_path: str) -> None:
+    """
+    Concatenates JSON lines parts into a Parquet file with a variant_id
+    column and a variant column holding the payload as JSON
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet output needs pyarrow, pip install pyarrow")
+    schema = pyarrow.schema(
+        [("variant_id", pyarrow.string()), ("variant", pyarrow.string())]
+    )
+    with pyarrow.parquet.ParquetWriter(
+        output_path, schema, compression="zstd"
+    ) as writer:
+        for part_path in part_paths:
+            with open(part_path) as part_file:
+                batch = {"variant_id": [], "variant": []}
+                for line in part_file:
+                    row = json.loads(line)
+                    batch["variant_id"].append(row["variant_id"])
+                    batch["variant"].append(
+                        json.dumps(row["variant"], separators=(",", ":"))
+                        if row["variant"]
+                        else None
+                    )
+                    if len(batch["variant_id"]) >= PARQUET_BATCH_SIZE:
+                        writer.write_table(pyarrow.Table.from_pydict(batch, schema))
+                        batch = {"variant_id": [], "variant": []}
+                if batch["variant_id"]:
+                    writer.write_table(pyarrow.Table.from_pydict(batch, schema))
+
+
+def annotate(
+    data_root: str,
+    genome_uuid: str,
+    input_path: str,
+    output_path: str,
+    output_format: str,
+    processes: int,
+    fields: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
+) -> Tuple[int, int]:
+    """
+    Resolves the variant ids listed in input_path into output_path, in
+    genomic order followed by the ids that cannot be parsed. Returns the
+    number of ids and the number found
+    """
+    datafile = GenomeDataset.datafile_for(data_root, genome_uuid)
+    if not os.path.isfile(datafile):
+        raise ValueError(f"No {datafile}")
+    contig_ranks = {
+        contig: rank
+        for rank, contig in enumerate(TabixIndex.from_path(datafile + ".tbi").contigs)
+    }
+
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    with tempfile.TemporaryDirectory(prefix=".annotate-", dir=output_dir) as tmp_dir:
+        partitions, invalid_path, total = partition_ids(input_path, tmp_dir)
+        log.info("%s variant ids in %s partitions", total, len(partitions))
+        # Contigs missing from the genome come last, their ids are all reported as not found
+        keys = sorted(
+            partitions,
+            key=lambda key: (
+                contig_ranks.get(key[0], len(contig_ranks)),
+                key[0],
+                key[1],
+            ),
+        )
+        tasks = [
+            (
+                genome_uuid,
+                key[0],
+                partitions[key],
+                os.path.join(tmp_dir, f"part-{index}.jsonl"),
+            )
+            for index, key in enumerate(keys)
+        ]
+        found = 0
+        with multiprocessing.Pool(
+            processes, init_worker, (data_root, fields, exclude)
+        ) as pool:
+            for part_path, count, part_found in pool.imap_unordered(
+                annotate_partition, tasks
+            ):
+                log.info(
+                    "%s: %s of %s variants found",
+                    os.path.basename(part_path),
+                    part_found,
+                    count,
+                )
+                found += part_found
+
+        invalid_part = os.path.join(tmp_dir, "part-invalid.jsonl")
+        with open(invalid_path) as invalid_file, open(invalid_part, "w") as output_file:
+            for line in invalid_file:
+                output_file.write(
+                    json.dumps(
+                        {"variant_id": line.rstrip("\n"), "variant": None},
+                        separators=(",", ":"),
+                    )
+                    + "\n"
+                )
+        part_paths = [task[3] for task in tasks] + [invalid_part]
+
+        tmp_output = os.path.join(tmp_dir, "output")
+        if output_format == "parquet":
+            write_parquet(part_paths, tmp_output)
+        else:
+            with open(tmp_output, "wb") as output_file:
+                for part_path in part_paths:
+                    with open(part_path, "rb") as part_file:
+                        shutil.copyfileobj(part_file, output_file)
+        os.replace(tmp_output, output_path)
+    return total, found
+
+
+def main(args: Any = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Resolve a file of variant ids, one contig:position:identifier per line, into the variant payloads of the API"
+    )
+    parser.add_argument(
+        "--data_root",
+        default=os.getenv("data_root"),
+        help="directory holding <genome_uuid>/variation.vcf.gz",
+    )
+    parser.add_argument("--genome_uuid", required=True)
+    parser.add_argument("--input", required=True, help="file of variant ids")
+    parser.add_argument(
+        "--output", required=True, help="JSON lines or Parquet file to write"
+    )
+    parser.add_argument(
+        "--format",
+        choices=["jsonl", "parquet"],
+        help="output format, by default from the output file extension",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count(),
+        help="number of partitions processed in parallel",
+    )
+    parser.add_argument(
+        "--fields", help="comma-separated dotted paths of the only fields to output"
+    )
+    parser.add_argument(
+        "--exclude", help="comma-separated dotted paths of fields to leave out"
+    )
+    options = parser.parse_args(args)
+    if not options.data_root:
+        parser.error(
+            "--data_root is required when data_root is not set in the environment"
+        )
+    output_format = options.format or (
+        "parquet" if options.output.endswith(".parquet") else "jsonl"
+    )
+    fields = options.fields.split(",") if options.fields else None
+    exclude = options.exclude.split(",") if options.exclude else None
+    try:
+        VariantExporter(prepare_executable_schema(), fields, exclude)
+    except ValueError as e:
+        parser.error(str(e))
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+    start = time.perf_counter()
+    total, found = annotate(
+        options.data_root,
+        options.genome_uuid,
+        options.input,
+        options.output,
+        output_format,
+        options.processes,
+        fields,
+        exclude,
+    )
+    log.info(
+        "%s of %s variant ids written to %s in %.1fs",
+        found,
+        total,
+        options.output,
+        time.perf_counter() - start,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -11,9 +11,15 @@
    See the License for the specific language governing permissions and
    limitations under the License.
 """
-from typing import Dict, Callable
+from typing import Any, Dict, Callable, Optional
+import argparse
+import hashlib
+import os
+import pickle
+import platform
 
 import ariadne
+import graphql
 from graphql import GraphQLSchema
 from starlette.requests import Request
 from ariadne import ScalarType
@@ -25,11 +31,38 @@ from graphql_service.resolver.variant_model import (
 )
 
 
-def prepare_executable_schema() -> GraphQLSchema:
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common", "schemas")
+RESOLVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resolver")
+
+
+def schema_fingerprint() -> str:
+    """
+    Hash of the schema definitions, of the resolver modules and of the
+    versions that a pickled executable schema depends on
+    """
+    # Ariadne has no version attribute, and importlib.metadata costs more to
+    # import than the cache saves, so its installed files stand in for it
+    ariadne_stat = os.stat(ariadne.__file__)
+    digest = hashlib.sha256(
+        f"{platform.python_version()} {graphql.__version__} {ariadne.__file__} {ariadne_stat.st_size} "
+        f"{ariadne_stat.st_mtime_ns}".encode()
+    )
+    # The resolvers are pickled by reference, so a cache built before a
+    # resolver was bound, renamed or removed must not be used
+    for directory, suffix in ((SCHEMA_DIR, ".graphql"), (RESOLVER_DIR, ".py")):
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(suffix):
+                digest.update(name.encode())
+                with open(os.path.join(directory, name), "rb") as source_file:
+                    digest.update(source_file.read())
+    return digest.hexdigest()
+
+
+def build_executable_schema() -> GraphQLSchema:
     """
     Combine schema definitions with corresponding resolvers
     """
-    schema = ariadne.load_schema_from_path("common/schemas")
+    schema = ariadne.load_schema_from_path(SCHEMA_DIR)
     return ariadne.make_executable_schema(
         schema,
         QUERY_TYPE,
@@ -38,6 +71,33 @@ def prepare_executable_schema() -> GraphQLSchema:
     )
 
 
+def prepare_executable_schema(cache_path: Optional[str] = None) -> GraphQLSchema:
+    """
+    The executable schema, unpickled from cache_path when it was written by
+    write_schema_cache for the same definitions, built otherwise. The cache
+    is a build artifact and must only come from a trusted path
+    """
+    if cache_path:
+        try:
+            with open(cache_path, "rb") as cache_file:
+                cached = pickle.load(cache_file)
+            if cached["fingerprint"] == schema_fingerprint():
+                return cached["schema"]
+            print(f"Schema cache {cache_path} is out of date, building the schema")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Cannot load schema cache {cache_path}, building the schema - {e}")
+    return build_executable_schema()
+
+
+def write_schema_cache(cache_path: str) -> None:
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "wb") as cache_file:
+        pickle.dump({"fingerprint": schema_fingerprint(), "schema": build_executable_schema()}, cache_file)
+    os.replace(tmp_path, cache_path)
+
+
 def prepare_context_provider(context: Dict) -> Callable[[Request], Dict]:
     """
     Returns function for injecting context to graphql executors.
@@ -55,6 +115,19 @@ def prepare_context_provider(context: Dict) -> Callable[[Request], Dict]:
         return {
             "request": request,
             "file_client": file_client,
+            # Set by the admission middleware for GraphQL requests
+            "deadline": getattr(request.state, "deadline", None),
         }
 
     return context_provider
+
+
+def main(args: Any = None) -> None:
+    parser = argparse.ArgumentParser(description="Build the executable schema once and pickle it for faster startup")
+    parser.add_argument("cache_path", help="file to write, passed to the service as schema_cache")
+    options = parser.parse_args(args)
+    write_schema_cache(options.cache_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Any, Mapping, Optional
+import json
+import urllib.error
+import urllib.request
+
+
+def decode_response(content_type: str, body: bytes) -> Any:
+    """
+    Decodes a response body of the API by its Content-Type, msgpack, CBOR
+    or JSON
+    """
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type in (
+        "application/msgpack",
+        "application/x-msgpack",
+        "application/vnd.msgpack",
+    ):
+        import msgpack
+
+        return msgpack.unpackb(body, raw=False)
+    if media_type == "application/cbor":
+        import cbor2
+
+        return cbor2.loads(body)
+    return json.loads(body)
+
+
+def execute(
+    url: str,
+    query: str,
+    variables: Optional[Mapping] = None,
+    media_type: str = "application/msgpack",
+    timeout: float = 60,
+) -> Mapping:
+    """
+    Posts a GraphQL query and returns the decoded result, with its data and
+    errors. The response is requested in media_type, with JSON accepted too
+    for servers without the library for it. Errors of the API, such as
+    invalid queries or an overloaded service, are returned as results;
+    other HTTP errors are raised
+    """
+    request = urllib.request.Request(
+        url,
+        data=json.dumps({"query": query, "variables": variables or {}}).encode(),
+        headers={
+            "Content-Type": "application/json",
+            "Accept": f"{media_type}, application/json;q=0.5",
+        },
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return decode_response(
+                response.headers.get("Content-Type", ""), response.read()
+            )
+    except urllib.error.HTTPError as e:
+        body = e.read()
+        try:
+            return decode_response(e.headers.get("Content-Type", ""), body)
+        except ValueError:
+            raise e
@@ -0,0 +1,300 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Any, Iterator, List, Mapping, Optional, Tuple
+from collections.abc import Mapping as MappingABC
+import inspect
+import json
+
+from graphql import (
+    GraphQLField,
+    GraphQLList,
+    GraphQLNonNull,
+    GraphQLObjectType,
+    GraphQLInterfaceType,
+    GraphQLResolveInfo,
+    GraphQLSchema,
+    GraphQLScalarType,
+    GraphQLEnumType,
+    Undefined,
+)
+from graphql.pyutils import Path
+
+from common.file_model.variant import Variant
+from common.genome_dataset import GenomeDataset
+
+# Largest position a tabix index can address
+MAX_POSITION = 2**29
+CHUNK_SIZE = 65536
+
+
+def parse_region(region: str) -> Tuple[str, int, int]:
+    """
+    Parses "contig" or "contig:start-end" (1-based, inclusive) into a
+    contig and a 0-based half-open interval
+    """
+    contig, _, interval = region.partition(":")
+    if not interval:
+        return contig, 0, MAX_POSITION
+    start, _, end = interval.replace(",", "").partition("-")
+    start, end = int(start), int(end) if end else MAX_POSITION
+    if not contig or start < 1 or end < start:
+        raise ValueError(f"Invalid region {region}")
+    return contig, start - 1, end
+
+
+def path_tree(paths: List[str]) -> Optional[dict]:
+    """
+    Turns dotted field paths into a tree of field names, where None stands
+    for a field with everything below it
+    """
+    if not paths:
+        return None
+    tree = {}
+    for path in paths:
+        node = tree
+        names = path.split(".")
+        for name in names[:-1]:
+            if name in node and node[name] is None:
+                break
+            node = node.setdefault(name, {})
+        else:
+            node[names[-1]] = None
+    return tree
+
+
+def named_type(gql_type: Any) -> Any:
+    while isinstance(gql_type, (GraphQLNonNull, GraphQLList)):
+        gql_type = gql_type.of_type
+    return gql_type
+
+
+def is_exportable(field: GraphQLField) -> bool:
+    """
+    Whether a field can be exported outside of a GraphQL request: its
+    resolver, if any, is synchronous and all its arguments have defaults
+    """
+    if field.resolve and (
+        inspect.iscoroutinefunction(field.resolve)
+        or inspect.isasyncgenfunction(field.resolve)
+    ):
+        return False
+    return all(
+        arg.default_value is not Undefined or not isinstance(arg.type, GraphQLNonNull)
+        for arg in field.args.values()
+    )
+
+
+def check_paths(
+    tree: Optional[dict], gql_type: Any, prefix: str = "", exportable: bool = False
+) -> None:
+    """
+    Raises ValueError for a path that is not a field of the schema, or,
+    with exportable, a field that cannot be exported
+    """
+    for name, subtree in (tree or {}).items():
+        if (
+            not isinstance(gql_type, (GraphQLObjectType, GraphQLInterfaceType))
+            or name not in gql_type.fields
+        ):
+            raise ValueError(f"Unknown field {prefix}{name}")
+        if exportable and not is_exportable(gql_type.fields[name]):
+            raise ValueError(f"Field {prefix}{name} cannot be exported")
+        check_paths(
+            subtree,
+            named_type(gql_type.fields[name].type),
+            f"{prefix}{name}.",
+            exportable,
+        )
+
+
+class VariantExporter:
+    """
+    Serialises variants the way the GraphQL API does, by calling the
+    resolvers bound in the executable schema, optionally restricted to some
+    fields and without others. A field whose resolver or serialisation
+    fails, or that is null although non-null, is null and recorded as an
+    error with its path, as in a GraphQL response. Unlike GraphQL, the null
+    does not spread to the parent of a non-null field: fields the schema
+    declares but the files do not provide, such as Region.length, would
+    otherwise null every variant of a full export.
+
+    Resolvers get a GraphQLResolveInfo for their field, without field
+    nodes or an operation as there is no query, with context as its
+    context, and the default values of the field arguments. Fields with
+    asynchronous resolvers or required arguments, which only a GraphQL
+    request can resolve, are left out of exports and cannot be selected
+    """
+
+    def __init__(
+        self,
+        schema: GraphQLSchema,
+        fields: List[str] = None,
+        exclude: List[str] = None,
+        context: Any = None,
+    ) -> None:
+        self.schema = schema
+        self.variant_type = schema.type_map["Variant"]
+        self.include = path_tree(fields)
+        self.exclude = path_tree(exclude) or {}
+        self.context = {} if context is None else context
+        self.unexportable = {
+            (gql_type.name, name)
+            for gql_type in schema.type_map.values()
+            if isinstance(gql_type, (GraphQLObjectType, GraphQLInterfaceType))
+            for name, field in gql_type.fields.items()
+            if not is_exportable(field)
+        }
+        check_paths(self.include, self.variant_type, exportable=True)
+        check_paths(self.exclude, self.variant_type)
+
+    def resolve(
+        self, value: Any, parent_type: Any, name: str, field: GraphQLField, path: List
+    ) -> Any:
+        graphql_path = None
+        for key in path:
+            graphql_path = Path(graphql_path, key, None)
+        graphql_path = Path(graphql_path, name, parent_type.name)
+        info = GraphQLResolveInfo(
+            name,
+            [],
+            field.type,
+            parent_type,
+            graphql_path,
+            self.schema,
+            {},
+            None,
+            None,
+            {},
+            self.context,
+            inspect.isawaitable,
+        )
+        arguments = {
+            arg_name: arg.default_value
+            for arg_name, arg in field.args.items()
+            if arg.default_value is not Undefined
+        }
+        field_value = field.resolve(value, info, **arguments)
+        if inspect.isawaitable(field_value):
+            if inspect.iscoroutine(field_value):
+                field_value.close()
+            raise TypeError(f"Cannot export {name}, its resolver is asynchronous")
+        return field_value
+
+    def serialise(
+        self,
+        value: Any,
+        gql_type: Any,
+        include: Optional[dict],
+        exclude: dict,
+        path: List,
+        errors: List[dict],
+    ) -> Any:
+        if isinstance(gql_type, GraphQLNonNull):
+            if value is None:
+                field_name = ".".join(str(key) for key in path)
+                errors.append(
+                    {
+                        "message": f"Cannot return null for non-nullable field {field_name}",
+                        "path": path,
+                    }
+                )
+                return None
+            return self.serialise(
+                value, gql_type.of_type, include, exclude, path, errors
+            )
+        if value is None:
+            return None
+        if isinstance(gql_type, GraphQLList):
+            return [
+                self.serialise(
+                    item, gql_type.of_type, include, exclude, path + [index], errors
+                )
+                for index, item in enumerate(value)
+            ]
+        if isinstance(gql_type, (GraphQLScalarType, GraphQLEnumType)):
+            try:
+                return gql_type.serialize(value)
+            except Exception as e:
+                errors.append({"message": str(e), "path": path})
+                return None
+
+        result = {}
+        for name in include if include is not None else gql_type.fields:
+            if name in exclude and exclude[name] is None:
+                continue
+            field = gql_type.fields[name]
+            if include is None and (gql_type.name, name) in self.unexportable:
+                continue
+            try:
+                if field.resolve:
+                    field_value = self.resolve(value, gql_type, name, field, path)
+                elif isinstance(value, MappingABC):
+                    field_value = value.get(name)
+                else:
+                    field_value = getattr(value, name, None)
+            except Exception as e:
+                errors.append({"message": str(e), "path": path + [name]})
+                result[name] = None
+                continue
+            result[name] = self.serialise(
+                field_value,
+                field.type,
+                include[name] if include else None,
+                exclude.get(name) or {},
+                path + [name],
+                errors,
+            )
+        return result
+
+    def serialise_variant(self, variant: Variant) -> Mapping:
+        """
+        The serialised variant, with the errors met on the way, if any, under "errors"
+        """
+        errors: List[dict] = []
+        result = self.serialise(
+            variant, self.variant_type, self.include, self.exclude, [], errors
+        )
+        if errors:
+            result["errors"] = errors
+        return result
+
+    def export(
+        self, dataset: GenomeDataset, contig: str, beg: int, end: int
+    ) -> Iterator[bytes]:
+        """
+        Yields newline-delimited JSON for the variants of a region, in
+        chunks of about CHUNK_SIZE bytes, holding one chunk at a time. The
+        scan bypasses the block cache so it does not evict the blocks of
+        interactive lookups
+        """
+        chunk = []
+        size = 0
+        for line in dataset.fetch(contig, beg, end, cache=False):
+            rec = dataset.parse(line)
+            variant = Variant(
+                rec, dataset.header, dataset.genome_uuid, dataset.get_precomputed(rec)
+            )
+            data = (
+                json.dumps(self.serialise_variant(variant), separators=(",", ":"))
+                + "\n"
+            ).encode()
+            chunk.append(data)
+            size += len(data)
+            if size >= CHUNK_SIZE:
+                yield b"".join(chunk)
+                chunk = []
+                size = 0
+        if chunk:
+            yield b"".join(chunk)
@@ -0,0 +1,304 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Any, Callable, Optional
+from functools import partial
+import json
+
+from ariadne import graphql
+from ariadne.asgi.handlers import GraphQLHTTPHandler
+from ariadne.exceptions import HttpError
+from ariadne.types import GraphQLResult
+from graphql import DocumentNode
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from common.admission import Overloaded
+from graphql_service.admission_middleware import overloaded_response
+from graphql_service.incremental import IncrementalPublisher, uses_incremental_delivery
+from graphql_service.query_cost import QueryCost
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# Size of the body messages an encoded response is sent in
+CHUNK_SIZE = 64 * 1024
+
+
+def encode_json(content: Any) -> bytes:
+    """
+    Compact UTF-8 JSON, with orjson when it is installed and with the same
+    settings as Starlette's JSONResponse otherwise
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(content)
+        except TypeError:
+            # Values orjson does not know, such as dicts with non-str keys
+            pass
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def encode_msgpack(content: Any) -> bytes:
+    return msgpack.packb(content, use_bin_type=True)
+
+
+# Encoders of the media types a query result can be returned in
+ENCODERS = {"application/json": encode_json}
+if msgpack is not None:
+    ENCODERS["application/msgpack"] = encode_msgpack
+if cbor2 is not None:
+    ENCODERS["application/cbor"] = cbor2.dumps
+
+MEDIA_TYPE_ALIASES = {
+    "application/x-msgpack": "application/msgpack",
+    "application/vnd.msgpack": "application/msgpack",
+}
+
+
+def negotiate(accept: str) -> str:
+    """
+    Media type of ENCODERS rated highest by an Accept header, the first one
+    listed on a tie and JSON when none is listed
+    """
+    best, best_quality = "application/json", 0.0
+    for item in accept.split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        media_type = MEDIA_TYPE_ALIASES.get(media_type.lower(), media_type.lower())
+        if media_type not in ENCODERS:
+            continue
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > best_quality:
+            best, best_quality = media_type, quality
+    return best
+
+
+class EncodedResponse(Response):
+    """
+    Response encoded once by one of ENCODERS and sent in CHUNK_SIZE body
+    messages, so the server can apply back pressure from slow clients
+    between them. Content-Length is set as for any other Response
+    """
+
+    def __init__(
+        self,
+        content: Any,
+        status_code: int,
+        media_type: str = "application/json",
+        headers: dict = None,
+    ) -> None:
+        self.encode: Callable[[Any], bytes] = ENCODERS[media_type]
+        super().__init__(content, status_code, headers, media_type)
+
+    def render(self, content: Any) -> bytes:
+        return self.encode(content)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        body = self.body
+        for offset in range(0, len(body), CHUNK_SIZE):
+            end = offset + CHUNK_SIZE
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": body[offset:end],
+                    "more_body": end < len(body),
+                }
+            )
+        if not body:
+            await send({"type": "http.response.body", "body": b""})
+
+
+def multipart_part(payload: Any) -> bytes:
+    return (
+        b"\r\n---\r\nContent-Type: application/json; charset=utf-8\r\n\r\n"
+        + encode_json(payload)
+    )
+
+
+def incremental_response(
+    result: dict,
+    publisher: IncrementalPublisher,
+    error_formatter: Callable,
+    debug: bool,
+    on_close: Callable[[], None],
+) -> Response:
+    """
+    multipart/mixed response of the incremental delivery format: the
+    initial result, then one part per deferred fragment or streamed list
+    as they are executed. on_close is called once the last one is sent
+    """
+
+    async def parts():
+        try:
+            yield multipart_part({**result, "hasNext": True})
+            async for payload in publisher.payloads(
+                result.get("data"), error_formatter, debug
+            ):
+                yield multipart_part(payload)
+            yield b"\r\n-----\r\n"
+        finally:
+            on_close()
+
+    return StreamingResponse(
+        parts(),
+        media_type='multipart/mixed; boundary="-"; deferSpec=20220824',
+        headers={"Vary": "Accept"},
+    )
+
+
+class FastJSONHTTPHandler(GraphQLHTTPHandler):
+    """
+    GraphQLHTTPHandler whose query results are encoded with encode_json. The
+    stdlib encoder of JSONResponse is a large share of the time spent on
+    variants with many transcript consequences or population frequencies.
+
+    Clients that send Accept: application/msgpack or application/cbor get
+    the same result in that encoding instead, when the library for it is
+    installed.
+
+    Queries with @defer or @stream from clients that accept multipart/mixed
+    get the initial result first and the deferred and streamed parts after
+    it. Other clients get everything in one response.
+
+    With a QueryCost, documents are costed when they are validated, and
+    rejected or throttled when they are too expensive
+    """
+
+    def __init__(
+        self, *args: Any, query_cost: Optional[QueryCost] = None, **kwargs: Any
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.query_cost = query_cost
+
+    def release_query_cost(self, context_value: Any) -> None:
+        if self.query_cost:
+            self.query_cost.release(context_value)
+
+    async def graphql_http_server(self, request: Request) -> Response:
+        try:
+            data = await self.extract_data_from_request(request)
+        except HttpError as error:
+            return PlainTextResponse(error.message or error.status, status_code=400)
+
+        publisher = None
+        if "multipart/mixed" in request.headers.get(
+            "accept", ""
+        ) and uses_incremental_delivery(data):
+            publisher = IncrementalPublisher()
+        context_value = await self.get_context_for_request(request, data)
+        streaming = False
+        try:
+            success, result = await self.execute_graphql_query(
+                request, data, context_value=context_value, publisher=publisher
+            )
+            if publisher:
+                publisher.drop_unreachable(result.get("data"))
+            if publisher and publisher.has_next():
+                # An expensive query keeps its slot until its last part is sent
+                streaming = True
+                return incremental_response(
+                    result,
+                    publisher,
+                    self.error_formatter,
+                    self.debug,
+                    lambda: self.release_query_cost(context_value),
+                )
+            return await self.create_json_response(request, result, success)
+        except Overloaded as e:
+            return overloaded_response(e)
+        finally:
+            if not streaming:
+                self.release_query_cost(context_value)
+
+    async def execute_graphql_query(
+        self,
+        request: Any,
+        data: Any,
+        *,
+        context_value: Any = None,
+        query_document: Optional[DocumentNode] = None,
+        publisher: Optional[IncrementalPublisher] = None,
+    ) -> GraphQLResult:
+        """
+        As in GraphQLHTTPHandler, with the execution context of the
+        publisher when there is one, and the validation rules and throttling
+        of the query cost
+        """
+        if context_value is None:
+            context_value = await self.get_context_for_request(request, data)
+        extensions = await self.get_extensions_for_request(request, context_value)
+        middleware = await self.get_middleware_for_request(request, context_value)
+        root_value = self.root_value
+        validation_rules = self.validation_rules
+        if self.query_cost:
+            root_value = partial(self.query_cost.throttle, root_value=root_value)
+            validation_rules = partial(
+                self.query_cost.validation_rules, rules=validation_rules
+            )
+
+        return await graphql(
+            self.schema,
+            data,
+            context_value=context_value,
+            root_value=root_value,
+            query_parser=self.query_parser,
+            query_document=query_document,
+            validation_rules=validation_rules,
+            debug=self.debug,
+            introspection=self.introspection,
+            logger=self.logger,
+            error_formatter=self.error_formatter,
+            extensions=extensions,
+            middleware=middleware,
+            middleware_manager_class=self.middleware_manager_class,
+            execution_context_class=publisher.execution_context_class()
+            if publisher
+            else self.execution_context_class,
+        )
+
+    async def create_json_response(
+        self, request: Request, result: dict, success: bool
+    ) -> Response:
+        return EncodedResponse(
+            result,
+            status_code=200 if success else 400,
+            media_type=negotiate(request.headers.get("accept", "")),
+            headers={"Vary": "Accept"},
+        )
@@ -0,0 +1,402 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, Type
+import collections
+
+from graphql import GraphQLError, GraphQLObjectType, GraphQLOutputType, SelectionSetNode
+from graphql.error import located_error
+from graphql.execution import ExecutionContext
+from graphql.execution.collect_fields import (
+    does_fragment_condition_match,
+    get_field_entry_key,
+    should_include_node,
+)
+from graphql.execution.execute import CollectedErrors
+from graphql.execution.values import get_directive_values
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+from graphql.pyutils import Path, is_iterable
+
+
+def uses_incremental_delivery(data: Any) -> bool:
+    """
+    Whether the query of a request may have @defer or @stream directives
+    """
+    query = data.get("query") if isinstance(data, dict) else None
+    return isinstance(query, str) and ("@defer" in query or "@stream" in query)
+
+
+class DeferredFragment:
+    """
+    Fragment marked @defer, to be executed on source at path once the
+    initial result is sent
+    """
+
+    def __init__(
+        self,
+        label: Optional[str],
+        path: Optional[Path],
+        parent_type: GraphQLObjectType,
+        source: Any,
+        selection_set: SelectionSetNode,
+    ) -> None:
+        self.label = label
+        self.path = path
+        # Where the initial data must have a value for the fragment to be sent
+        self.anchor = path.as_list() if path else []
+        self.parent_type = parent_type
+        self.source = source
+        self.selection_set = selection_set
+
+    async def execute(self, context: "IncrementalExecutionContext") -> Dict:
+        fields = context.collect_incremental_fields(
+            self.parent_type, [self.selection_set], self.path, self.source
+        )
+        data = context.execute_fields(self.parent_type, self.source, self.path, fields)
+        if context.is_awaitable(data):
+            data = await data
+        return {"data": data}
+
+
+class StreamedItems:
+    """
+    An item of a list field marked @stream after its initialCount first
+    ones, to be completed once the initial result is sent. Items are sent
+    one per payload, each queueing the next when it is done
+    """
+
+    def __init__(
+        self,
+        label: Optional[str],
+        path: Path,
+        item_type: GraphQLOutputType,
+        field_nodes: List[FieldNode],
+        info: Any,
+        items: List,
+        index: int,
+    ) -> None:
+        self.label = label
+        self.path = path.add_key(index, None)
+        self.list_path = path
+        self.anchor = path.as_list()
+        self.item_type = item_type
+        self.field_nodes = field_nodes
+        self.info = info
+        self.items = items
+        self.index = index
+
+    def next(self) -> Optional["StreamedItems"]:
+        """
+        The record of the following item, if there is one
+        """
+        if self.index + 1 >= len(self.items):
+            return None
+        return StreamedItems(
+            self.label,
+            self.list_path,
+            self.item_type,
+            self.field_nodes,
+            self.info,
+            self.items,
+            self.index + 1,
+        )
+
+    async def execute(self, context: "IncrementalExecutionContext") -> Dict:
+        try:
+            completed = context.complete_value(
+                self.item_type,
+                self.field_nodes,
+                self.info,
+                self.path,
+                self.items[self.index],
+            )
+            if context.is_awaitable(completed):
+                completed = await completed
+        except Exception as raw_error:
+            error = located_error(raw_error, self.field_nodes, self.path.as_list())
+            # Raises again for non-null items, which null the whole entry
+            context.handle_field_error(error, self.item_type, self.path)
+            completed = None
+        return {"items": [completed]}
+
+
+class IncrementalExecutionContext(ExecutionContext):
+    """
+    ExecutionContext that leaves fragments marked @defer and the items of
+    list fields marked @stream after their initialCount first ones out of
+    the initial result and queues them in its publisher. graphql-core 3.2
+    has no incremental delivery of its own and Ariadne needs 3.2, so this
+    follows the collection and completion methods of its ExecutionContext.
+    A subclass bound to a publisher is made per request by
+    IncrementalPublisher.execution_context_class
+    """
+
+    publisher: "IncrementalPublisher"
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.defer_directive = self.schema.get_directive("defer")
+        self.stream_directive = self.schema.get_directive("stream")
+        self._incremental_cache: Dict[Tuple, Tuple[Dict, List]] = {}
+        self.publisher.context = self
+
+    def directive_values(self, directive: Any, node: Any) -> Optional[Dict]:
+        """
+        Arguments of a @defer or @stream directive of a node, None when the
+        node has none or its if argument is false
+        """
+        if directive is None:
+            return None
+        values = get_directive_values(directive, node, self.variable_values)
+        return values if values and values["if"] else None
+
+    def collect(
+        self,
+        runtime_type: GraphQLObjectType,
+        selection_set: SelectionSetNode,
+        fields: Dict,
+        deferred: List,
+        visited_fragment_names: set,
+    ) -> None:
+        """
+        collect_fields_impl of graphql-core, with the fragments marked
+        @defer added to deferred instead of fields
+        """
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                if should_include_node(self.variable_values, selection):
+                    fields.setdefault(get_field_entry_key(selection), []).append(
+                        selection
+                    )
+            elif isinstance(selection, InlineFragmentNode):
+                if not should_include_node(
+                    self.variable_values, selection
+                ) or not does_fragment_condition_match(
+                    self.schema, selection, runtime_type
+                ):
+                    continue
+                defer = self.directive_values(self.defer_directive, selection)
+                if defer:
+                    deferred.append((defer.get("label"), selection.selection_set))
+                    continue
+                self.collect(
+                    runtime_type,
+                    selection.selection_set,
+                    fields,
+                    deferred,
+                    visited_fragment_names,
+                )
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                if name in visited_fragment_names or not should_include_node(
+                    self.variable_values, selection
+                ):
+                    continue
+                fragment = self.fragments.get(name)
+                if not fragment or not does_fragment_condition_match(
+                    self.schema, fragment, runtime_type
+                ):
+                    continue
+                defer = self.directive_values(self.defer_directive, selection)
+                if defer:
+                    deferred.append((defer.get("label"), fragment.selection_set))
+                    continue
+                visited_fragment_names.add(name)
+                self.collect(
+                    runtime_type,
+                    fragment.selection_set,
+                    fields,
+                    deferred,
+                    visited_fragment_names,
+                )
+
+    def collect_incremental_fields(
+        self,
+        runtime_type: GraphQLObjectType,
+        selection_sets: List[SelectionSetNode],
+        path: Optional[Path],
+        source: Any,
+    ) -> Dict[str, List[FieldNode]]:
+        """
+        Fields of selection sets to execute now on source. Their deferred
+        fragments are queued in the publisher. Results are cached by
+        selection sets, like collect_subfields does
+        """
+        key = (runtime_type, *map(id, selection_sets))
+        cached = self._incremental_cache.get(key)
+        if cached is None:
+            fields, deferred, visited_fragment_names = {}, [], set()
+            for selection_set in selection_sets:
+                self.collect(
+                    runtime_type,
+                    selection_set,
+                    fields,
+                    deferred,
+                    visited_fragment_names,
+                )
+            cached = self._incremental_cache[key] = (fields, deferred)
+        fields, deferred = cached
+        for label, selection_set in deferred:
+            self.publisher.pending.append(
+                DeferredFragment(label, path, runtime_type, source, selection_set)
+            )
+        return fields
+
+    def execute_operation(self, operation: Any, root_value: Any) -> Any:
+        if operation.operation.value != "query":
+            return super().execute_operation(operation, root_value)
+        root_type = self.schema.query_type
+        fields = self.collect_incremental_fields(
+            root_type, [operation.selection_set], None, root_value
+        )
+        return self.execute_fields(root_type, root_value, None, fields)
+
+    def complete_object_value(
+        self,
+        return_type: GraphQLObjectType,
+        field_nodes: List[FieldNode],
+        info: Any,
+        path: Path,
+        result: Any,
+    ) -> Any:
+        # No type of the schema has an is_type_of check to run first
+        selection_sets = [
+            node.selection_set for node in field_nodes if node.selection_set
+        ]
+        fields = self.collect_incremental_fields(
+            return_type, selection_sets, path, result
+        )
+        return self.execute_fields(return_type, result, path, fields)
+
+    def complete_list_value(
+        self,
+        return_type: Any,
+        field_nodes: List[FieldNode],
+        info: Any,
+        path: Path,
+        result: Any,
+    ) -> Any:
+        # Only the list of the field itself is streamed, not nested lists
+        stream = (
+            self.directive_values(self.stream_directive, field_nodes[0])
+            if isinstance(path.key, str)
+            else None
+        )
+        if stream is None or not is_iterable(result):
+            return super().complete_list_value(
+                return_type, field_nodes, info, path, result
+            )
+        initial_count = stream["initialCount"]
+        if initial_count is None or initial_count < 0:
+            raise GraphQLError(
+                "initialCount of @stream must be a non-negative integer", field_nodes
+            )
+        items = list(result)
+        if len(items) > initial_count:
+            self.publisher.pending.append(
+                StreamedItems(
+                    stream.get("label"),
+                    path,
+                    return_type.of_type,
+                    field_nodes,
+                    info,
+                    items,
+                    initial_count,
+                )
+            )
+        return super().complete_list_value(
+            return_type, field_nodes, info, path, items[:initial_count]
+        )
+
+
+def is_reachable(data: Any, path: List) -> bool:
+    """
+    Whether the initial data has a value at path, which it does not when
+    an error nulled one of its parents
+    """
+    for key in path:
+        try:
+            data = data[key]
+        except (KeyError, IndexError, TypeError):
+            return False
+        if data is None:
+            return False
+    return True
+
+
+class IncrementalPublisher:
+    """
+    Deferred fragments and streamed items of one request, executed one at a
+    time after the initial result, in the order they were found. Fragments
+    and streams found while executing them are queued behind them, except
+    for the next item of a stream, which follows the item before it
+    """
+
+    def __init__(self) -> None:
+        self.context: Optional[IncrementalExecutionContext] = None
+        self.pending = collections.deque()
+
+    def execution_context_class(self) -> Type[ExecutionContext]:
+        return type(
+            "IncrementalExecutionContext",
+            (IncrementalExecutionContext,),
+            {"publisher": self},
+        )
+
+    def has_next(self) -> bool:
+        return bool(self.pending)
+
+    def drop_unreachable(self, data: Any) -> None:
+        """
+        Forgets the records whose parent an error nulled in the initial data
+        """
+        self.pending = collections.deque(
+            record for record in self.pending if is_reachable(data, record.anchor)
+        )
+
+    async def payloads(
+        self, data: Any, error_formatter: Callable, debug: bool
+    ) -> AsyncIterator[Dict]:
+        """
+        Yields the subsequent payloads of the incremental delivery format,
+        one incremental entry each, once the initial result is sent and the
+        records it cannot reach are dropped
+        """
+        context = self.context
+        while self.pending:
+            record = self.pending.popleft()
+            context.collected_errors = CollectedErrors()
+            following = None
+            try:
+                entry = await record.execute(context)
+                errors = context.collected_errors.errors
+                if isinstance(record, StreamedItems):
+                    following = record.next()
+            except GraphQLError as error:
+                # A null that reaches the list also ends its stream
+                entry = (
+                    {"items": None}
+                    if isinstance(record, StreamedItems)
+                    else {"data": None}
+                )
+                errors = [*context.collected_errors.errors, error]
+            entry["path"] = record.path.as_list() if record.path else []
+            if record.label is not None:
+                entry["label"] = record.label
+            if errors:
+                entry["errors"] = [error_formatter(error, debug) for error in errors]
+            if following:
+                # The rest of a stream goes before what its item queued
+                self.pending.appendleft(following)
+            yield {"incremental": [entry], "hasNext": self.has_next()}
@@ -0,0 +1,159 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Any, Dict
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+from common.memory_usage import read_memory_usage
+
+log = logging.getLogger(__name__)
+
+MIB = 1024 * 1024
+
+
+def serve_worker(app: Any, sock: socket.socket, options: argparse.Namespace) -> None:
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # Log through the handlers configured by the master
+    config = uvicorn.Config(
+        app,
+        host=options.host,
+        port=options.port,
+        log_level=options.log_level,
+        log_config=None,
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def report_memory(workers: Dict[int, float]) -> None:
+    """
+    Logs unique and shared resident memory of the master and every worker
+    """
+    for role, pid in [("master", os.getpid())] + [
+        ("worker", pid) for pid in sorted(workers)
+    ]:
+        usage = read_memory_usage(pid)
+        if usage:
+            log.info(
+                "%s %s: rss %.1f MiB, unique %.1f MiB, shared %.1f MiB, pss %.1f MiB",
+                role,
+                pid,
+                usage["rss"] / MIB,
+                usage["unique"] / MIB,
+                usage["shared"] / MIB,
+                usage["pss"] / MIB,
+            )
+
+
+def main(args: Any = None) -> None:
+    """
+    Pre-fork startup mode.
+
+    The master process builds everything that is read-only - the executable
+    schema, and for every genome under data_root the VCF header, CSQ layout,
+    population plan and tabix index - and only then forks the workers, which
+    share those pages copy-on-write instead of each building their own copy.
+    Sidecar databases are still opened lazily by each worker, SQLite
+    connections must not cross a fork.
+
+        python -m graphql_service.prefork --workers 2 --host 0.0.0.0 --port 8000
+    """
+    parser = argparse.ArgumentParser(
+        description="Serve the API from workers forked after preloading all genomes"
+    )
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("WORKER_COUNT", 2))
+    )
+    parser.add_argument(
+        "--memory_report_interval",
+        type=float,
+        default=300,
+        help="seconds between memory reports",
+    )
+    parser.add_argument("--log_level", default="info")
+    options = parser.parse_args(args)
+    logging.basicConfig(
+        level=options.log_level.upper(), format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    from graphql_service import server
+
+    start = time.perf_counter()
+    genomes = server.FILE_CLIENT.preload()
+    log.info("Preloaded %s genomes in %.1fs", len(genomes), time.perf_counter() - start)
+    # Keep the garbage collector from touching, and so copying, preloaded objects
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((options.host, options.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    workers: Dict[int, float] = {}
+    stopping = False
+
+    def spawn() -> None:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve_worker(server.APP, sock, options)
+            finally:
+                os._exit(0)
+        workers[pid] = time.monotonic()
+        log.info("Started worker %s", pid)
+
+    def stop(signum: int, frame: Any) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(options.workers):
+        spawn()
+
+    next_report = time.monotonic() + options.memory_report_interval
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            workers.pop(pid, None)
+            if not stopping:
+                log.warning("Worker %s exited with status %s, restarting", pid, status)
+                spawn()
+            continue
+        if time.monotonic() >= next_report:
+            report_memory(workers)
+            next_report += options.memory_report_interval
+        time.sleep(0.5)
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
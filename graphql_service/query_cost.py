@@ -0,0 +1,240 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+from typing import Any, Dict, List, Mapping, Optional, Type
+from inspect import isawaitable
+import time
+
+from graphql import GraphQLSchema, get_named_type
+from graphql.execution.values import get_argument_values
+from graphql.language import (
+    FieldNode,
+    FragmentSpreadNode,
+    InlineFragmentNode,
+    SelectionSetNode,
+)
+from graphql.validation import ValidationContext, ValidationRule
+
+from common.admission import AdmissionController
+from graphql_service.resolver.exceptions import QueryTooExpensiveError
+
+# Cost of one result of a field, on top of the cost of its selection.
+# Fields not listed cost nothing
+DEFAULT_WEIGHTS = {
+    "Query.variant": 1,
+    "Query.variants_by_gene": 1,
+    "Query.variants_by_phenotype": 1,
+    "Query.variants_in_region": 1,
+    "Query.variant_density": 5,
+    "VariantAllele.predicted_molecular_consequences": 10,
+    "VariantAllele.population_frequencies": 5,
+    "VariantAllele.phenotype_assertions": 2,
+}
+
+# Argument giving how many results a field returns, which its cost and the
+# cost of its selection are multiplied by
+MULTIPLIER_ARGUMENTS = {
+    "Query.variants_by_gene": "first",
+    "Query.variants_by_phenotype": "first",
+    "Query.variants_in_region": "first",
+}
+
+
+def parse_weights(value: str) -> Dict[str, int]:
+    """
+    Weights from a comma-separated list of Type.field=weight
+    """
+    weights = {}
+    for item in value.split(","):
+        if item.strip():
+            field, weight = item.split("=")
+            weights[field.strip()] = int(weight)
+    return weights
+
+
+class QueryCost:
+    """
+    Static cost of GraphQL documents, computed when they are validated from
+    the weights of the fields they select, so that a document asking for
+    dozens of aliased variants with all their consequences and frequencies
+    is known to be expensive before it runs. Documents over max_cost are
+    rejected. Documents over throttle_cost run only when a slot of the
+    expensive queries admission controller is free, so a few of them cannot
+    take every thread of a worker
+    """
+
+    def __init__(
+        self,
+        weights: Mapping[str, int],
+        max_cost: int,
+        throttle_cost: int,
+        admission: AdmissionController,
+    ) -> None:
+        self.weights = weights
+        self.max_cost = max_cost
+        self.throttle_cost = throttle_cost
+        self.admission = admission
+        self.counters = {"rejected": 0, "throttled": 0}
+
+    @classmethod
+    def from_config(cls, config: Mapping) -> "QueryCost":
+        weights = dict(DEFAULT_WEIGHTS)
+        weights.update(parse_weights(config.get("query_cost_weights", "")))
+        return cls(
+            weights,
+            int(config.get("max_query_cost", 2000)),
+            int(config.get("throttle_query_cost", 200)),
+            AdmissionController.from_config(config, "expensive_queries", 2, 8),
+        )
+
+    def multiplier(
+        self, field: Any, node: FieldNode, variables: Optional[Dict], argument: str
+    ) -> int:
+        try:
+            return max(int(get_argument_values(field, node, variables)[argument]), 0)
+        except Exception:
+            # Invalid arguments are reported by the other validation rules
+            return 1
+
+    def selection_cost(
+        self,
+        context: ValidationContext,
+        parent_type: Any,
+        selection_set: SelectionSetNode,
+        variables: Optional[Dict],
+        visited_fragment_names: frozenset = frozenset(),
+    ) -> int:
+        cost = 0
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                field = getattr(parent_type, "fields", {}).get(selection.name.value)
+                if field is None:
+                    continue
+                key = f"{parent_type.name}.{selection.name.value}"
+                field_cost = self.weights.get(key, 0)
+                if selection.selection_set:
+                    field_cost += self.selection_cost(
+                        context,
+                        get_named_type(field.type),
+                        selection.selection_set,
+                        variables,
+                        visited_fragment_names,
+                    )
+                if key in MULTIPLIER_ARGUMENTS:
+                    field_cost *= self.multiplier(
+                        field, selection, variables, MULTIPLIER_ARGUMENTS[key]
+                    )
+                cost += field_cost
+            elif isinstance(selection, InlineFragmentNode):
+                fragment_type = parent_type
+                if selection.type_condition:
+                    fragment_type = context.schema.get_type(
+                        selection.type_condition.name.value
+                    )
+                cost += self.selection_cost(
+                    context,
+                    fragment_type,
+                    selection.selection_set,
+                    variables,
+                    visited_fragment_names,
+                )
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = context.get_fragment(name)
+                if fragment is None or name in visited_fragment_names:
+                    continue
+                cost += self.selection_cost(
+                    context,
+                    context.schema.get_type(fragment.type_condition.name.value),
+                    fragment.selection_set,
+                    variables,
+                    visited_fragment_names | {name},
+                )
+        return cost
+
+    def validation_rules(
+        self, context_value: Any, document: Any, data: Mapping, rules: Any = None
+    ) -> List[Type[ValidationRule]]:
+        """
+        Validation rules for Ariadne: the rules configured for the handler,
+        a list or a callable as Ariadne takes them, and the cost rule of one
+        request, which stores the cost of the operation to execute in the
+        context
+        """
+        if callable(rules):
+            rules = rules(context_value, document, data)
+        query_cost = self
+        variables = data.get("variables")
+        operation_name = data.get("operationName")
+
+        class QueryCostRule(ValidationRule):
+            def enter_operation_definition(self, node, *_args):
+                if operation_name and (
+                    not node.name or node.name.value != operation_name
+                ):
+                    return
+                schema: GraphQLSchema = self.context.schema
+                cost = query_cost.selection_cost(
+                    self.context,
+                    schema.get_root_type(node.operation),
+                    node.selection_set,
+                    variables,
+                )
+                if isinstance(context_value, dict):
+                    context_value["query_cost"] = cost
+                if cost > query_cost.max_cost:
+                    query_cost.counters["rejected"] += 1
+                    self.report_error(QueryTooExpensiveError(cost, query_cost.max_cost))
+
+        return [*(rules or []), QueryCostRule]
+
+    async def throttle(
+        self,
+        context_value: Any,
+        operation_name: Optional[str] = None,
+        variables: Optional[Dict] = None,
+        document: Any = None,
+        root_value: Any = None,
+    ) -> Any:
+        """
+        Root value for Ariadne, called once the document is validated and
+        before it is executed: waits for an expensive queries slot when the
+        cost is over throttle_cost, then returns the root value configured
+        for the handler, calling it as Ariadne would. Overloaded is raised
+        when no slot frees up before the deadline of the request
+        """
+        if (
+            isinstance(context_value, dict)
+            and context_value.get("query_cost", 0) > self.throttle_cost
+        ):
+            self.counters["throttled"] += 1
+            deadline = context_value.get("deadline") or time.monotonic() + 30
+            context_value["query_cost_slot"] = await self.admission.acquire(deadline)
+        if callable(root_value):
+            root_value = root_value(context_value, operation_name, variables, document)
+            if isawaitable(root_value):
+                root_value = await root_value
+        return root_value
+
+    def release(self, context_value: Any) -> None:
+        if isinstance(context_value, dict) and "query_cost_slot" in context_value:
+            self.admission.release(context_value.pop("query_cost_slot"))
+
+    def stats(self) -> Mapping:
+        return {
+            "max_cost": self.max_cost,
+            "throttle_cost": self.throttle_cost,
+            **self.counters,
+            "admission": self.admission.stats(),
+        }
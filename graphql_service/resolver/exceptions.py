@@ -39,3 +39,63 @@ class VariantNotFoundError(FieldNotFoundError):
     ):
         super().__init__("variant_id", {"variant_id": variant_id})
 
+
+
+class ServiceUnavailableError(GraphQLError):
+    """
+    Custom error to be raised if a request is shed because the service is overloaded
+    """
+    def __init__(self, reason: str, retry_after: int):
+        self.extensions = {"code": "SERVICE_UNAVAILABLE", "retry_after": retry_after}
+        message = f"Service temporarily unavailable ({reason}), retry after {retry_after}s"
+        super().__init__(message, extensions=self.extensions)
+
+
+
+class GenomeNotFoundError(FieldNotFoundError):
+    """
+    Custom error to be raised if there is no data for a genome
+    """
+    def __init__(
+        self, genome_id: str
+    ):
+        super().__init__("genome_id", {"genome_id": genome_id})
+
+
+
+class IndexNotAvailableError(GraphQLError):
+    """
+    Custom error to be raised if a genome has no gene or phenotype index
+    """
+    def __init__(self, genome_id: str, index: str):
+        self.extensions = {"code": "INDEX_NOT_AVAILABLE", "genome_id": genome_id, "index": index}
+        message = f"Variants of genome {genome_id} cannot be looked up by {index}"
+        super().__init__(message, extensions=self.extensions)
+
+
+
+class InvalidArgumentError(GraphQLError):
+    """
+    Custom error to be raised if an argument has an unusable value
+    """
+    def __init__(self, argument: str, message: str):
+        self.extensions = {"code": "INVALID_ARGUMENT", "argument": argument}
+        super().__init__(f"Invalid {argument}: {message}", extensions=self.extensions)
+
+
+class QueryTooExpensiveError(GraphQLError):
+    """
+    Custom error to be raised if the static cost of a query is over the budget
+    """
+
+    def __init__(self, cost: int, max_cost: int):
+        self.extensions = {
+            "code": "QUERY_TOO_EXPENSIVE",
+            "cost": cost,
+            "max_cost": max_cost,
+        }
+        message = (
+            f"Query cost {cost} exceeds the maximum of {max_cost}, request fewer variants or leave out "
+            "predicted_molecular_consequences, population_frequencies or phenotype_assertions"
+        )
+        super().__init__(message, extensions=self.extensions)
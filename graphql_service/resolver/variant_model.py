@@ -12,14 +12,23 @@
    limitations under the License.
 """
 
-from typing import Dict, Optional, List, Any
-import json, os
+from typing import Dict, Optional, List, Any, Tuple
+import base64
+import binascii
 from ariadne import QueryType, ObjectType
 from graphql import GraphQLResolveInfo
 import subprocess
-import json
 
+from common.admission import Overloaded
+from common.file_model.frequency_filter import UnknownPopulation
+from common.file_model.population_registry import get_population_registry
+from common.genome_dataset import IndexNotAvailable
+from graphql_service.export import parse_region
 from graphql_service.resolver.exceptions import (
+    GenomeNotFoundError,
+    IndexNotAvailableError,
+    InvalidArgumentError,
+    ServiceUnavailableError,
     VariantNotFoundError
 )
 
@@ -31,6 +40,9 @@ VARIANT_TYPE = ObjectType("Variant")
 VARIANT_ALLELE_TYPE = ObjectType("VariantAllele")
 POPULATION_TYPE = ObjectType("Population")
 
+MAX_PAGE_SIZE = 100
+MAX_DENSITY_BINS = 10000
+
 @QUERY_TYPE.field("variant")
 async def resolve_variant(
         _,
@@ -45,7 +57,12 @@ async def resolve_variant(
         "genome_id": by_id["genome_id"],
     }
     file_client = info.context["file_client"]
-    result = file_client.get_variant_record(by_id["genome_id"], by_id["variant_id"])
+    try:
+        result = await file_client.fetch_variant_record(
+            by_id["genome_id"], by_id["variant_id"], info.context.get("deadline")
+        )
+    except Overloaded as e:
+        raise ServiceUnavailableError(e.reason, e.retry_after)
     if not result:
         raise VariantNotFoundError(by_id["variant_id"])
     return result
@@ -175,11 +192,142 @@ def resolve_api(
     return {"api": {"major": "0", "minor": "1", "patch": "0-beta"}}
 
 @QUERY_TYPE.field("populations")
-def resolve_populations(_: None, info: GraphQLResolveInfo, genome_id: str = None) -> List: 
-    current_directory = os.path.dirname(__file__)
-    population_metadata_file = f"{current_directory}/../../common/file_model/population_metadata.json"
-    with open(population_metadata_file) as pop_file:
-            population_metadata = json.load(pop_file)
-    return population_metadata.get(genome_id,[]) 
+def resolve_populations(
+    _: None,
+    info: GraphQLResolveInfo,
+    genome_id: str = None,
+    name: Optional[str] = None,
+    is_global: Optional[bool] = None,
+    display_group_name: Optional[str] = None,
+) -> List:
+    """
+    Populations of a genome from the population registry, optionally
+    filtered by name, whether they are global and display group
+    """
+    genome_populations = get_population_registry().get(genome_id)
+    if genome_populations is None:
+        return []
+    return genome_populations.find(name=name, is_global=is_global, display_group_name=display_group_name)
+
+
+
+
+def encode_cursor(key: Tuple) -> str:
+    return base64.urlsafe_b64encode(":".join(map(str, key)).encode()).decode()
+
+def decode_cursor(cursor: str, types: Tuple[type, ...]) -> Tuple:
+    """
+    Turns a cursor back into its key, the last part of which may contain colons
+    """
+    try:
+        parts = base64.urlsafe_b64decode(cursor.encode()).decode().split(":", len(types) - 1)
+        if len(parts) != len(types):
+            raise ValueError(cursor)
+        return tuple(part_type(part) for part_type, part in zip(types, parts))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidArgumentError("after", "not a cursor returned by a previous page")
+
+def variant_page(page: Dict) -> Dict:
+    return {
+        "variants": page["variants"],
+        "page_info": {
+            "end_cursor": encode_cursor(page["end_key"]) if page["end_key"] else None,
+            "has_next_page": page["has_next_page"],
+        },
+    }
+
+def check_page_size(first: int) -> None:
+    if not 1 <= first <= MAX_PAGE_SIZE:
+        raise InvalidArgumentError("first", f"must be between 1 and {MAX_PAGE_SIZE}")
+
+async def resolve_indexed_variants(
+        info: GraphQLResolveInfo, genome_id: str, index: str, value: str, first: int, after: Optional[str]
+) -> Dict:
+    """
+    Load a page of variants through the gene or phenotype index of the sidecar
+    """
+    check_page_size(first)
+    after_key = decode_cursor(after, (int, int, str)) if after else None
+    file_client = info.context["file_client"]
+    try:
+        page = await file_client.fetch_indexed_variants(
+            genome_id, index, value, first, after_key, info.context.get("deadline")
+        )
+    except Overloaded as e:
+        raise ServiceUnavailableError(e.reason, e.retry_after)
+    except IndexNotAvailable:
+        raise IndexNotAvailableError(genome_id, index)
+    if page is None:
+        raise GenomeNotFoundError(genome_id)
+    return variant_page(page)
 
+@QUERY_TYPE.field("variants_by_gene")
+async def resolve_variants_by_gene(
+        _, info: GraphQLResolveInfo, genome_id: str, gene: str, first: int = 20, after: str = None
+) -> Dict:
+    "Load variants within a gene, by Ensembl gene id or symbol"
+    return await resolve_indexed_variants(info, genome_id, "gene", gene, first, after)
 
+@QUERY_TYPE.field("variants_by_phenotype")
+async def resolve_variants_by_phenotype(
+        _, info: GraphQLResolveInfo, genome_id: str, phenotype: str, first: int = 20, after: str = None
+) -> Dict:
+    "Load variants associated with a phenotype"
+    return await resolve_indexed_variants(info, genome_id, "phenotype", phenotype, first, after)
+
+@QUERY_TYPE.field("variants_in_region")
+async def resolve_variants_in_region(
+        _,
+        info: GraphQLResolveInfo,
+        genome_id: str,
+        region: str,
+        population: str = None,
+        max_af: float = None,
+        first: int = 20,
+        after: str = None,
+) -> Dict:
+    "Load variants overlapping a region, optionally only those rare in a population"
+    check_page_size(first)
+    try:
+        region_interval = parse_region(region)
+    except ValueError:
+        raise InvalidArgumentError("region", "expected contig or contig:start-end")
+    if (population is None) != (max_af is None):
+        raise InvalidArgumentError("max_af", "population and max_af go together")
+    after_key = decode_cursor(after, (int, str)) if after else None
+    file_client = info.context["file_client"]
+    try:
+        page = await file_client.fetch_region_variants(
+            genome_id, region_interval, first, after_key, population, max_af, info.context.get("deadline")
+        )
+    except Overloaded as e:
+        raise ServiceUnavailableError(e.reason, e.retry_after)
+    except UnknownPopulation as e:
+        raise InvalidArgumentError("population", str(e))
+    if page is None:
+        raise GenomeNotFoundError(genome_id)
+    return variant_page(page)
+
+@QUERY_TYPE.field("variant_density")
+async def resolve_variant_density(
+        _, info: GraphQLResolveInfo, genome_id: str, region: str, max_bins: int = 1000
+) -> Dict:
+    "Load variant counts per bin over a region from the precomputed density tiles"
+    if not 1 <= max_bins <= MAX_DENSITY_BINS:
+        raise InvalidArgumentError("max_bins", f"must be between 1 and {MAX_DENSITY_BINS}")
+    try:
+        region_interval = parse_region(region)
+    except ValueError:
+        raise InvalidArgumentError("region", "expected contig or contig:start-end")
+    file_client = info.context["file_client"]
+    try:
+        density = await file_client.fetch_variant_density(
+            genome_id, region_interval, max_bins, info.context.get("deadline")
+        )
+    except Overloaded as e:
+        raise ServiceUnavailableError(e.reason, e.retry_after)
+    except IndexNotAvailable:
+        raise IndexNotAvailableError(genome_id, "density")
+    if density is None:
+        raise GenomeNotFoundError(genome_id)
+    return density
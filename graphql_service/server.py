@@ -11,25 +11,34 @@
    See the License for the specific language governing permissions and
    limitations under the License.
 """
+import gc
 import logging
 import os
+import time
 from typing import Optional
 
 from ariadne.asgi import GraphQL
-from ariadne.asgi.handlers import GraphQLHTTPHandler
-from ariadne.contrib.tracing.apollotracing import ApolloTracingExtension
 from ariadne.explorer import ExplorerGraphiQL, render_template, escape_default_query
 from ariadne.explorer.template import read_template
 from ariadne.types import ExtensionList
-from pymongo import monitoring
 from starlette.applications import Starlette
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
 
-from common.logger import CommandLogger
 # from common.crossrefs import XrefResolver
+from common.admission import AdmissionController, Overloaded
 from common.file_client import FileClient
-from common.extensions import QueryExecutionTimeExtension
+from common.file_model.population_registry import get_population_registry
+from common.extensions import QueryCostExtension, QueryExecutionTimeExtension
+from common.memory_usage import read_memory_usage
+from graphql_service.admission_middleware import AdmissionMiddleware, overloaded_response
+from graphql_service.export import VariantExporter, parse_region
+from graphql_service.http_handler import FastJSONHTTPHandler
+from graphql_service.query_cost import QueryCost
 from graphql_service.ariadne_app import (
     prepare_executable_schema,
     prepare_context_provider,
@@ -46,31 +55,40 @@ EXTENSIONS: Optional[
     ExtensionList
 ] = None  # mypy will throw an incompatible type error without this type cast
 
-# Including the execution time in the response
-EXTENSIONS = [QueryExecutionTimeExtension]
+# Including the execution time and the query cost in the response
+EXTENSIONS = [QueryExecutionTimeExtension, QueryCostExtension]
 
 if DEBUG_MODE:
     log = logging.getLogger()
     log.setLevel(logging.DEBUG)
     logging.basicConfig(level=logging.DEBUG)
 
-    monitoring.register(CommandLogger(log))
+    # Only imported for debugging, it is not needed to serve requests
+    from ariadne.contrib.tracing.apollotracing import ApolloTracingExtension
 
     # Apollo Tracing extension will display information about which resolvers are used and their duration
     # https://ariadnegraphql.org/docs/apollo-tracing
     EXTENSIONS.append(ApolloTracingExtension(trace_default_resolver=True))
 
 FILE_CLIENT = FileClient(os.environ)
+# Loaded now rather than by the first request that needs populations
+get_population_registry()
 CONTEXT_PROVIDER = prepare_context_provider(
     {
         "file_client": FILE_CLIENT
     }
 )
-EXECUTABLE_SCHEMA = prepare_executable_schema()
+# Unpickled from the artifact written when the image was built, when there is one
+EXECUTABLE_SCHEMA = prepare_executable_schema(os.getenv("schema_cache"))
 
 
+REQUEST_ADMISSION = AdmissionController.from_config(os.environ, "requests", 64, 128)
+EXPORT_ADMISSION = AdmissionController.from_config(os.environ, "exports", 2, 4)
+QUERY_COST = QueryCost.from_config(os.environ)
+
 starlette_middleware = [
-    Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["GET", "POST"])
+    Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["GET", "POST"]),
+    Middleware(AdmissionMiddleware, controller=REQUEST_ADMISSION, timeout=FILE_CLIENT.request_timeout),
 ]
 
 # The original HTML file can be found under
@@ -149,16 +167,97 @@ class CustomExplorerGraphiQL(ExplorerGraphiQL):
         )
 
 
-APP = Starlette(debug=DEBUG_MODE, middleware=starlette_middleware)
+async def stats(request: Request) -> JSONResponse:
+    """
+    Cache, admission and memory statistics of the worker process serving the request
+    """
+    return JSONResponse(
+        {
+            **FILE_CLIENT.get_stats(),
+            "requests": REQUEST_ADMISSION.stats(),
+            "exports": EXPORT_ADMISSION.stats(),
+            "query_cost": QUERY_COST.stats(),
+            "memory": read_memory_usage(),
+        }
+    )
+
+
+async def export_variants(request: Request) -> StreamingResponse:
+    """
+    Streams the variants of a region or a whole contig as newline-delimited
+    JSON, one GraphQL-shaped Variant per line.
+
+    Query parameters: genome_id, region ("contig" or "contig:start-end"),
+    and optionally fields and exclude, comma-separated dotted field paths
+    such as "name,alleles.population_frequencies" or
+    "alleles.predicted_molecular_consequences"
+    """
+    params = request.query_params
+    try:
+        contig, beg, end = parse_region(params["region"])
+        exporter = VariantExporter(
+            EXECUTABLE_SCHEMA,
+            [path for path in params.get("fields", "").split(",") if path],
+            [path for path in params.get("exclude", "").split(",") if path],
+            context={"request": request, "file_client": FILE_CLIENT},
+        )
+    except KeyError as e:
+        return JSONResponse({"error": f"Missing parameter {e}"}, status_code=400)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    try:
+        # Held until the last line is streamed, a reload then waits for it
+        dataset = await run_in_threadpool(FILE_CLIENT.acquire_dataset, params["genome_id"])
+    except KeyError as e:
+        return JSONResponse({"error": f"Missing parameter {e}"}, status_code=400)
+    except Exception:
+        return JSONResponse({"error": f"Unknown genome {params['genome_id']}"}, status_code=404)
+    if contig not in dataset.tabix_file.contigs:
+        dataset.release()
+        return JSONResponse({"error": f"Unknown region {contig}"}, status_code=404)
+
+    try:
+        granted = await EXPORT_ADMISSION.acquire(time.monotonic() + FILE_CLIENT.request_timeout)
+    except Overloaded as e:
+        dataset.release()
+        return overloaded_response(e)
+
+    async def stream():
+        chunks = exporter.export(dataset, contig, beg, end)
+        try:
+            async for chunk in iterate_in_threadpool(chunks):
+                yield chunk
+        finally:
+            chunks.close()
+            EXPORT_ADMISSION.release(granted)
+            dataset.release()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+APP = Starlette(
+    debug=DEBUG_MODE,
+    middleware=starlette_middleware,
+    routes=[Route("/stats", stats), Route("/export/variants", export_variants)],
+    # The watcher thread is started per worker, never in a pre-fork master
+    on_startup=[FILE_CLIENT.start],
+    on_shutdown=[FILE_CLIENT.stop],
+)
 APP.mount(
     "/",
     GraphQL(
         EXECUTABLE_SCHEMA,
         debug=DEBUG_MODE,
         context_value=CONTEXT_PROVIDER,
-        http_handler=GraphQLHTTPHandler(
+        http_handler=FastJSONHTTPHandler(
             extensions=EXTENSIONS,
+            query_cost=QUERY_COST,
         ),
         explorer=CustomExplorerGraphiQL(),
     ),
 )
+
+# The schema, resolvers and modules loaded above live as long as the worker:
+# keep them out of garbage collections, the first of which would otherwise
+# scan them all during the first request
+gc.freeze()
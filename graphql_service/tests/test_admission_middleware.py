@@ -0,0 +1,96 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import asyncio
+import json
+import time
+
+from starlette.responses import PlainTextResponse
+
+from common.admission import AdmissionController
+from graphql_service.admission_middleware import AdmissionMiddleware
+
+
+async def call(app, method: str = "POST") -> tuple:
+    """
+    Status, headers and body of a request to an ASGI app
+    """
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"{}", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(
+        {
+            "type": "http",
+            "method": method,
+            "path": "/",
+            "headers": [],
+            "query_string": b"",
+        },
+        receive,
+        send,
+    )
+    headers = {
+        key.decode(): value.decode() for key, value in messages[0].get("headers", [])
+    }
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return messages[0]["status"], headers, body
+
+
+def make_app(controller: AdmissionController) -> AdmissionMiddleware:
+    async def app(scope, receive, send):
+        assert scope["state"]["deadline"] > time.monotonic()
+        await PlainTextResponse("ok")(scope, receive, send)
+
+    return AdmissionMiddleware(app, controller, 10)
+
+
+def test_admitted_request_reaches_the_app_and_frees_its_slot():
+    controller = AdmissionController("requests", 1, 0)
+    status, _, body = asyncio.run(call(make_app(controller)))
+    assert (status, body) == (200, b"ok")
+    assert controller.active == 0
+
+
+def test_shed_request_is_a_503_with_retry_after():
+    async def scenario():
+        controller = AdmissionController("requests", 1, 0)
+        controller.service_time = 1.5
+        granted = await controller.acquire(time.monotonic() + 10)
+        response = await call(make_app(controller))
+        controller.release(granted)
+        return response
+
+    status, headers, body = asyncio.run(scenario())
+    assert status == 503
+    assert headers["retry-after"] == "2"
+    error = json.loads(body)["errors"][0]
+    assert error["extensions"] == {"code": "SERVICE_UNAVAILABLE", "retry_after": 2}
+    assert "queue full" in error["message"]
+
+
+def test_get_requests_are_not_limited():
+    async def scenario():
+        controller = AdmissionController("requests", 1, 0)
+        granted = await controller.acquire(time.monotonic() + 10)
+        app = AdmissionMiddleware(PlainTextResponse("explorer"), controller, 10)
+        response = await call(app, "GET")
+        controller.release(granted)
+        return response
+
+    assert asyncio.run(scenario())[0] == 200
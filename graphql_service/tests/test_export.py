@@ -0,0 +1,315 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import asyncio
+import os
+
+import pytest
+
+from ariadne import ObjectType, make_executable_schema
+from graphql import GraphQLInterfaceType, GraphQLObjectType, graphql
+
+from common.file_client import FileClient
+from graphql_service.ariadne_app import prepare_executable_schema
+from graphql_service.export import VariantExporter, named_type
+
+GENOME_UUID = "a7335667-93e7-11ec-a39d-005056b38ce3"
+DATA_ROOT = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+# Non-null in the schema but not provided by the VCF
+REGION_STUB_FIELDS = ("length", "assembly", "sequence", "metadata")
+
+ERROR_SCHEMA = """
+type Query {
+  variant: Variant
+}
+type Variant {
+  name: String!
+  broken: String
+  count: Int
+  child: Child
+  required_child: Child!
+  children: [Child]
+  strict_children: [Child!]
+}
+type Child {
+  value: String!
+  note: String
+}
+"""
+
+
+def selection(gql_type, seen: tuple = ()) -> str:
+    """
+    Every field of a type, recursively, leaving out fields that lead back to
+    a type of the path, such as Assembly.regions, and the Region stubs
+    """
+    fields = []
+    for name, field in gql_type.fields.items():
+        if gql_type.name == "Region" and name in REGION_STUB_FIELDS:
+            continue
+        field_type = named_type(field.type)
+        if isinstance(field_type, (GraphQLObjectType, GraphQLInterfaceType)):
+            if field_type.name not in seen:
+                fields.append(
+                    f"{name} {{ {selection(field_type, seen + (field_type.name,))} }}"
+                )
+        else:
+            fields.append(name)
+    return " ".join(fields)
+
+
+def project(exported, selected):
+    """
+    The exported value restricted to the fields of a GraphQL result
+    """
+    if isinstance(selected, dict) and isinstance(exported, dict):
+        return {
+            name: project(exported.get(name), value) for name, value in selected.items()
+        }
+    if isinstance(selected, list) and isinstance(exported, list):
+        return [
+            project(item, selected_item)
+            for item, selected_item in zip(exported, selected)
+        ] + exported[len(selected) :]
+    return exported
+
+
+def error_exporter(**resolvers) -> VariantExporter:
+    variant = ObjectType("Variant")
+    for name, resolver in resolvers.items():
+        variant.set_field(name, resolver)
+    return VariantExporter(make_executable_schema(ERROR_SCHEMA, variant))
+
+
+def fail(*_):
+    raise ValueError("no data")
+
+
+def test_export_matches_graphql_for_bundled_variants():
+    schema = prepare_executable_schema(None)
+    file_client = FileClient(
+        {
+            "data_root": DATA_ROOT,
+            "dataset_reload_interval": "0",
+            "csq_offload_threshold": "0",
+        }
+    )
+    exporter = VariantExporter(schema)
+    query = (
+        "query q($g: String!, $v: String!) { variant(by_id: {genome_id: $g, variant_id: $v}) { "
+        + selection(schema.type_map["Variant"], ("Variant",))
+        + " } }"
+    )
+    dataset = file_client.acquire_dataset(GENOME_UUID)
+    try:
+        lines = list(dataset.fetch("13", 0, 2**29))
+        assert lines
+        for line in lines:
+            record = dataset.parse(line)
+            variant = file_client.make_variant(
+                dataset, line, record, dataset.get_precomputed(record)
+            )
+            variant_id = f"{record.CHROM}:{record.POS}:{record.ID[0]}"
+            result = asyncio.run(
+                graphql(
+                    schema,
+                    query,
+                    variable_values={"g": GENOME_UUID, "v": variant_id},
+                    context_value={"file_client": file_client, "request": None},
+                )
+            )
+            assert not result.errors
+            exported = exporter.serialise_variant(variant)
+            assert {tuple(error["path"][-3:]) for error in exported["errors"]} == {
+                ("slice", "region", name) for name in REGION_STUB_FIELDS
+            }
+            assert (
+                project(exported, result.data["variant"]) == result.data["variant"]
+            ), variant_id
+    finally:
+        dataset.release()
+
+
+def test_variant_without_errors_has_no_errors_key():
+    exporter = error_exporter()
+    assert exporter.serialise_variant(
+        {"name": "rs1", "required_child": {"value": "a"}}
+    ) == {
+        "name": "rs1",
+        "broken": None,
+        "count": None,
+        "child": None,
+        "required_child": {"value": "a", "note": None},
+        "children": None,
+        "strict_children": None,
+    }
+
+
+def test_failing_nullable_field_is_null_with_an_error():
+    exporter = error_exporter(broken=fail)
+    result = exporter.serialise_variant(
+        {"name": "rs1", "required_child": {"value": "a"}}
+    )
+    assert result["broken"] is None
+    assert result["name"] == "rs1"
+    assert result["errors"] == [{"message": "no data", "path": ["broken"]}]
+
+
+def test_scalar_that_cannot_be_serialised_is_an_error():
+    exporter = error_exporter()
+    result = exporter.serialise_variant(
+        {"name": "rs1", "count": "many", "required_child": {"value": "a"}}
+    )
+    assert result["count"] is None
+    assert [error["path"] for error in result["errors"]] == [["count"]]
+
+
+def test_null_in_non_null_field_is_an_error_kept_in_place():
+    exporter = error_exporter()
+    result = exporter.serialise_variant(
+        {
+            "name": "rs1",
+            "required_child": {"value": "a"},
+            "child": {"note": "no value"},
+            "strict_children": [{"value": "c"}, {"note": "no value"}],
+        }
+    )
+    assert result["child"] == {"value": None, "note": "no value"}
+    assert result["strict_children"] == [
+        {"value": "c", "note": None},
+        {"value": None, "note": "no value"},
+    ]
+    assert result["errors"] == [
+        {
+            "message": "Cannot return null for non-nullable field child.value",
+            "path": ["child", "value"],
+        },
+        {
+            "message": "Cannot return null for non-nullable field strict_children.1.value",
+            "path": ["strict_children", 1, "value"],
+        },
+    ]
+
+
+def test_failing_non_null_field_keeps_the_rest_of_the_variant():
+    exporter = error_exporter(name=fail)
+    result = exporter.serialise_variant({"required_child": {"value": "a"}})
+    assert result["name"] is None
+    assert result["required_child"] == {"value": "a", "note": None}
+    assert result["errors"] == [{"message": "no data", "path": ["name"]}]
+
+
+def test_export_reports_the_region_fields_the_files_do_not_provide():
+    schema = prepare_executable_schema(None)
+    file_client = FileClient(
+        {
+            "data_root": DATA_ROOT,
+            "dataset_reload_interval": "0",
+            "csq_offload_threshold": "0",
+        }
+    )
+    dataset = file_client.acquire_dataset(GENOME_UUID)
+    try:
+        line = next(dataset.fetch("13", 0, 2**29))
+        record = dataset.parse(line)
+        variant = file_client.make_variant(
+            dataset, line, record, dataset.get_precomputed(record)
+        )
+    finally:
+        dataset.release()
+    exported = VariantExporter(schema, fields=["name", "slice"]).serialise_variant(
+        variant
+    )
+    assert [error["path"] for error in exported["errors"]] == [
+        ["slice", "region", name] for name in REGION_STUB_FIELDS
+    ]
+    assert exported["slice"]["region"]["name"] == "13"
+    exclude = [f"slice.region.{name}" for name in REGION_STUB_FIELDS]
+    exported = VariantExporter(
+        schema, fields=["name", "slice"], exclude=exclude
+    ).serialise_variant(variant)
+    assert "errors" not in exported
+
+
+INFO_SCHEMA = """
+type Query {
+  variant: Variant
+}
+type Variant {
+  name: String!
+  label(prefix: String = "rs", upper: Boolean): String
+  children: [Child]
+  remote: String
+  lookup(key: String!): String
+}
+type Child {
+  where: String
+}
+"""
+
+
+def info_exporter(**resolvers) -> VariantExporter:
+    variant = ObjectType("Variant")
+    child = ObjectType("Child")
+    for name, resolver in resolvers.items():
+        variant.set_field(name, resolver)
+    child.set_field("where", lambda _, info: ".".join(map(str, info.path.as_list())))
+    return VariantExporter(
+        make_executable_schema(INFO_SCHEMA, variant, child),
+        context={"file_client": "client"},
+    )
+
+
+async def fetch_remote(*_):
+    return "remote"
+
+
+def test_resolvers_get_info_and_argument_defaults():
+    calls = []
+
+    def label(variant, info, **arguments):
+        calls.append((info.field_name, info.parent_type.name, info.context, arguments))
+        return arguments["prefix"] + variant["name"]
+
+    exporter = info_exporter(label=label, remote=fetch_remote)
+    result = exporter.serialise_variant({"name": "1", "children": [{}, {}]})
+    assert result == {
+        "name": "1",
+        "label": "rs1",
+        "children": [{"where": "children.0.where"}, {"where": "children.1.where"}],
+    }
+    assert calls == [("label", "Variant", {"file_client": "client"}, {"prefix": "rs"})]
+
+
+def test_fields_only_a_request_can_resolve_cannot_be_selected():
+    exporter = info_exporter(remote=fetch_remote)
+    with pytest.raises(ValueError, match="remote cannot be exported"):
+        VariantExporter(exporter.schema, fields=["name", "remote"])
+    with pytest.raises(ValueError, match="lookup cannot be exported"):
+        VariantExporter(exporter.schema, fields=["lookup"])
+    assert VariantExporter(exporter.schema, fields=["name"]).serialise_variant(
+        {"name": "1"}
+    ) == {"name": "1"}
+
+
+def test_awaitable_from_a_synchronous_resolver_is_an_error():
+    exporter = info_exporter(label=lambda *_, **__: fetch_remote())
+    result = exporter.serialise_variant({"name": "1"})
+    assert result["label"] is None
+    assert result["errors"] == [
+        {
+            "message": "Cannot export label, its resolver is asynchronous",
+            "path": ["label"],
+        }
+    ]
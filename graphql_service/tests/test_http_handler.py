@@ -0,0 +1,208 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import asyncio
+import json
+import os
+
+import pytest
+from ariadne.asgi import GraphQL
+
+from common.file_client import FileClient
+from graphql_service import http_handler
+from graphql_service.ariadne_app import (
+    prepare_context_provider,
+    prepare_executable_schema,
+)
+from graphql_service.client import decode_response
+from graphql_service.http_handler import ENCODERS, FastJSONHTTPHandler, negotiate
+
+GENOME_UUID = "a7335667-93e7-11ec-a39d-005056b38ce3"
+ROOT = os.path.join(os.path.dirname(__file__), "..", "..")
+EXAMPLE_ID = "1:230710048:rs699"
+
+
+@pytest.mark.parametrize(
+    "accept, media_type",
+    [
+        ("", "application/json"),
+        ("*/*", "application/json"),
+        ("text/html", "application/json"),
+        ("application/msgpack", "application/msgpack"),
+        ("application/x-msgpack", "application/msgpack"),
+        ("application/vnd.msgpack", "application/msgpack"),
+        ("Application/MsgPack", "application/msgpack"),
+        ("application/cbor", "application/cbor"),
+        # The first listed wins a tie
+        ("application/json, application/msgpack", "application/json"),
+        ("application/msgpack, application/json", "application/msgpack"),
+        ("application/json;q=0.5, application/msgpack", "application/msgpack"),
+        (
+            "application/msgpack;q=0.2, application/cbor;q=0.8, application/json;q=0.5",
+            "application/cbor",
+        ),
+        (
+            "application/msgpack ; q=0.9 , application/json ; q=0.1",
+            "application/msgpack",
+        ),
+        # q=0 means not acceptable
+        ("application/msgpack;q=0", "application/json"),
+        ("application/msgpack;q=0, application/cbor;q=0.1", "application/cbor"),
+        ("application/json;q=0, application/x-msgpack", "application/msgpack"),
+        ("application/msgpack;q=high", "application/json"),
+    ],
+)
+def test_negotiate(accept, media_type):
+    assert negotiate(accept) == media_type
+
+
+def test_negotiate_skips_encodings_that_are_not_installed(monkeypatch):
+    monkeypatch.delitem(ENCODERS, "application/cbor")
+    assert (
+        negotiate("application/cbor, application/msgpack;q=0.5")
+        == "application/msgpack"
+    )
+    monkeypatch.delitem(ENCODERS, "application/msgpack")
+    assert negotiate("application/x-msgpack") == "application/json"
+
+
+def post(app, body: dict, accept: str):
+    """
+    Posts a JSON body to an ASGI app, returning the status, the headers
+    and the body messages of the response
+    """
+    messages = []
+    request = {
+        "type": "http.request",
+        "body": json.dumps(body).encode(),
+        "more_body": False,
+    }
+
+    async def receive():
+        return request
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/",
+        "raw_path": b"/",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"accept", accept.encode()),
+        ],
+        "client": ("127.0.0.1", 1),
+        "server": ("127.0.0.1", 80),
+    }
+    asyncio.run(app(scope, receive, send))
+    start, *bodies = messages
+    headers = {key.decode(): value.decode() for key, value in start["headers"]}
+    return start["status"], headers, [message["body"] for message in bodies]
+
+
+@pytest.fixture(scope="module")
+def app():
+    file_client = FileClient(
+        {
+            "data_root": os.path.join(ROOT, "data"),
+            "dataset_reload_interval": "0",
+            "csq_offload_threshold": "0",
+        }
+    )
+    yield GraphQL(
+        prepare_executable_schema(None),
+        context_value=prepare_context_provider({"file_client": file_client}),
+        http_handler=FastJSONHTTPHandler(),
+    )
+    for dataset in file_client.datasets.values():
+        dataset.close()
+
+
+def bundled_variant_ids() -> list:
+    file_client = FileClient(
+        {
+            "data_root": os.path.join(ROOT, "data"),
+            "dataset_reload_interval": "0",
+            "csq_offload_threshold": "0",
+        }
+    )
+    dataset = file_client.get_dataset(GENOME_UUID)
+    try:
+        return [
+            ":".join(line.split("\t", 3)[:3])
+            for contig in dataset.tabix_file.contigs
+            for line in dataset.fetch(contig, 0, 2**29)
+        ]
+    finally:
+        dataset.close()
+
+
+@pytest.mark.parametrize("media_type", sorted(set(ENCODERS) - {"application/json"}))
+def test_encodings_decode_to_the_json_result(app, media_type):
+    with open(os.path.join(ROOT, "examples", "variant.graphql")) as query_file:
+        query = query_file.read()
+    assert f'"{EXAMPLE_ID}"' in query
+    query = query.replace(f'"{EXAMPLE_ID}"', "$variant_id").replace(
+        "query variant_example {", "query variant_example($variant_id: String!) {"
+    )
+    variant_ids = bundled_variant_ids()
+    assert len(variant_ids) > 50
+    for variant_id in variant_ids:
+        body = {"query": query, "variables": {"variant_id": variant_id}}
+        status, headers, json_chunks = post(app, body, "application/json")
+        assert status == 200 and headers["content-type"].startswith("application/json")
+        expected = json.loads(b"".join(json_chunks))
+        assert expected["data"]["variant"]["name"] == variant_id.split(":")[2]
+
+        status, headers, chunks = post(
+            app, body, f"{media_type}, application/json;q=0.5"
+        )
+        assert status == 200
+        assert headers["content-type"] == media_type
+        assert headers["vary"] == "Accept"
+        assert (
+            decode_response(headers["content-type"], b"".join(chunks)) == expected
+        ), variant_id
+
+
+def test_errors_are_encoded_with_a_400(app):
+    status, headers, chunks = post(app, {"query": "{ nothing }"}, "application/msgpack")
+    assert status == 400
+    result = decode_response(headers["content-type"], b"".join(chunks))
+    assert result["errors"][0]["message"].startswith("Cannot query field 'nothing'")
+
+
+def test_large_results_are_sent_in_chunks(app, monkeypatch):
+    monkeypatch.setattr(http_handler, "CHUNK_SIZE", 16)
+    body = {
+        "query": '{ variant(by_id: {genome_id: "%s", variant_id: "%s"}) { name alleles { name } } }'
+        % (GENOME_UUID, EXAMPLE_ID)
+    }
+    _, headers, chunks = post(app, body, "application/msgpack")
+    assert len(chunks) > 1
+    assert all(len(chunk) == 16 for chunk in chunks[:-1]) and 0 < len(chunks[-1]) <= 16
+    assert int(headers["content-length"]) == sum(len(chunk) for chunk in chunks)
+    assert (
+        decode_response(headers["content-type"], b"".join(chunks))["data"]["variant"][
+            "name"
+        ]
+        == "rs699"
+    )
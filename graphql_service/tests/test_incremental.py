@@ -0,0 +1,292 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import asyncio
+import json
+import os
+
+import pytest
+from ariadne.asgi import GraphQL
+
+from common.file_client import FileClient
+from graphql_service.ariadne_app import (
+    prepare_context_provider,
+    prepare_executable_schema,
+)
+from graphql_service.http_handler import FastJSONHTTPHandler
+from graphql_service.incremental import is_reachable
+
+GENOME_UUID = "a7335667-93e7-11ec-a39d-005056b38ce3"
+DATA_ROOT = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+# A variant with three alleles
+VARIANT = '{genome_id: "%s", variant_id: "1:10007:rs1639538116"}' % GENOME_UUID
+ALLELE_NAMES = ["1:10007:T:C", "1:10007:T:G", "1:10007:T:T"]
+# Region.length is non-null but never provided, selecting it nulls the variant
+NULLED_FIELD = "slice { region { length } }"
+
+
+@pytest.fixture(scope="module")
+def app():
+    file_client = FileClient(
+        {
+            "data_root": DATA_ROOT,
+            "dataset_reload_interval": "0",
+            "csq_offload_threshold": "0",
+        }
+    )
+    yield GraphQL(
+        prepare_executable_schema(None),
+        context_value=prepare_context_provider({"file_client": file_client}),
+        http_handler=FastJSONHTTPHandler(),
+    )
+    for dataset in file_client.datasets.values():
+        dataset.close()
+
+
+def post(app, query: str, accept: str = "multipart/mixed"):
+    """
+    Posts a query to an ASGI app and returns the Content-Type and body of
+    the response. The client stays connected until the last body message
+    """
+    messages = []
+
+    async def run():
+        sent = asyncio.Event()
+        received = []
+
+        async def receive():
+            if not received:
+                received.append(True)
+                body = json.dumps({"query": query}).encode()
+                return {"type": "http.request", "body": body, "more_body": False}
+            await sent.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            messages.append(message)
+            if message["type"] == "http.response.body" and not message.get("more_body"):
+                sent.set()
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "POST",
+            "scheme": "http",
+            "path": "/",
+            "raw_path": b"/",
+            "root_path": "",
+            "query_string": b"",
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"accept", accept.encode()),
+            ],
+            "client": ("127.0.0.1", 1),
+            "server": ("127.0.0.1", 80),
+        }
+        await app(scope, receive, send)
+
+    asyncio.run(run())
+    start, *bodies = messages
+    assert start["status"] == 200
+    headers = {key.decode(): value.decode() for key, value in start["headers"]}
+    return headers["content-type"], b"".join(body.get("body", b"") for body in bodies)
+
+
+def payloads(app, query: str) -> list:
+    """
+    The JSON parts of a multipart/mixed response
+    """
+    content_type, body = post(app, query)
+    assert content_type.startswith("multipart/mixed")
+    assert body.endswith(b"\r\n-----\r\n")
+    parts = body[: -len(b"\r\n-----\r\n")].split(b"\r\n---\r\n")[1:]
+    result = []
+    for part in parts:
+        headers, content = part.split(b"\r\n\r\n", 1)
+        assert headers == b"Content-Type: application/json; charset=utf-8"
+        result.append(json.loads(content))
+    assert [payload["hasNext"] for payload in result] == [True] * (len(result) - 1) + [
+        False
+    ]
+    return result
+
+
+def test_deferred_fragments_follow_the_initial_result(app):
+    initial, *subsequent = payloads(
+        app,
+        '{ variant(by_id: %s) { name ... @defer(label: "type") { type } '
+        "alleles { name ... @defer { allele_sequence } } } }" % VARIANT,
+    )
+    assert initial == {
+        "data": {
+            "variant": {
+                "name": "rs1639538116",
+                "alleles": [{"name": name} for name in ALLELE_NAMES],
+            }
+        },
+        "hasNext": True,
+    }
+    assert [payload["incremental"] for payload in subsequent] == [
+        [{"data": {"type": "Variant"}, "path": ["variant"], "label": "type"}],
+        [{"data": {"allele_sequence": "C"}, "path": ["variant", "alleles", 0]}],
+        [{"data": {"allele_sequence": "G"}, "path": ["variant", "alleles", 1]}],
+        [{"data": {"allele_sequence": "T"}, "path": ["variant", "alleles", 2]}],
+    ]
+
+
+def test_named_fragment_spread_can_be_deferred(app):
+    initial, deferred = payloads(
+        app,
+        '{ variant(by_id: %s) { name ...Type @defer(label: "named") } } '
+        "fragment Type on Variant { type }" % VARIANT,
+    )
+    assert initial["data"] == {"variant": {"name": "rs1639538116"}}
+    assert deferred["incremental"] == [
+        {"data": {"type": "Variant"}, "path": ["variant"], "label": "named"}
+    ]
+
+
+def test_defer_if_false_is_not_deferred(app):
+    content_type, body = post(
+        app, "{ variant(by_id: %s) { name ... @defer(if: false) { type } } }" % VARIANT
+    )
+    assert content_type == "application/json"
+    assert json.loads(body) == {
+        "data": {"variant": {"name": "rs1639538116", "type": "Variant"}}
+    }
+
+
+@pytest.mark.parametrize("initial_count", [0, 1, 2])
+def test_streamed_items_are_sent_one_per_payload(app, initial_count):
+    initial, *subsequent = payloads(
+        app,
+        '{ variant(by_id: %s) { alleles @stream(initialCount: %d, label: "alleles") '
+        "{ name } } }" % (VARIANT, initial_count),
+    )
+    assert initial["data"]["variant"]["alleles"] == [
+        {"name": name} for name in ALLELE_NAMES[:initial_count]
+    ]
+    assert [payload["incremental"] for payload in subsequent] == [
+        [
+            {
+                "items": [{"name": name}],
+                "path": ["variant", "alleles", index],
+                "label": "alleles",
+            }
+        ]
+        for index, name in enumerate(ALLELE_NAMES)
+        if index >= initial_count
+    ]
+
+
+@pytest.mark.parametrize("initial_count", [3, 10])
+def test_stream_with_every_item_in_the_initial_count_is_one_response(
+    app, initial_count
+):
+    content_type, body = post(
+        app,
+        "{ variant(by_id: %s) { alleles @stream(initialCount: %d) { name } } }"
+        % (VARIANT, initial_count),
+    )
+    assert content_type == "application/json"
+    assert json.loads(body) == {
+        "data": {"variant": {"alleles": [{"name": name} for name in ALLELE_NAMES]}}
+    }
+
+
+def test_fragments_found_in_streamed_items_are_queued_behind(app):
+    _, *subsequent = payloads(
+        app,
+        "{ variant(by_id: %s) { alleles @stream(initialCount: 2) "
+        "{ name ... @defer { allele_sequence } } } }" % VARIANT,
+    )
+    # The stream was found before the fragments of the first two items
+    assert [payload["incremental"][0]["path"] for payload in subsequent] == [
+        ["variant", "alleles", 2],
+        ["variant", "alleles", 0],
+        ["variant", "alleles", 1],
+        ["variant", "alleles", 2],
+    ]
+    assert subsequent[0]["incremental"][0]["items"] == [{"name": ALLELE_NAMES[2]}]
+    assert subsequent[3]["incremental"][0]["data"] == {"allele_sequence": "T"}
+
+
+def test_deferred_fragment_of_a_nulled_parent_is_dropped(app):
+    initial, *subsequent = payloads(
+        app,
+        '{ kept: variant(by_id: %s) { name ... @defer(label: "kept") { type } } '
+        'nulled: variant(by_id: %s) { name ... @defer(label: "nulled") { type } %s } }'
+        % (VARIANT, VARIANT, NULLED_FIELD),
+    )
+    assert initial["data"] == {"kept": {"name": "rs1639538116"}, "nulled": None}
+    assert initial["errors"][0]["path"] == ["nulled", "slice", "region", "length"]
+    assert [payload["incremental"][0]["label"] for payload in subsequent] == ["kept"]
+
+
+def test_response_without_reachable_fragments_is_complete(app):
+    content_type, body = post(
+        app,
+        "{ variant(by_id: %s) { name ... @defer { type } %s } }"
+        % (VARIANT, NULLED_FIELD),
+    )
+    assert content_type == "application/json"
+    result = json.loads(body)
+    assert result["data"] == {"variant": None}
+    assert "hasNext" not in result
+
+
+def test_negative_initial_count_is_an_error(app):
+    content_type, body = post(
+        app,
+        "{ variant(by_id: %s) { alleles @stream(initialCount: -1) { name } } }"
+        % VARIANT,
+    )
+    assert content_type == "application/json"
+    result = json.loads(body)
+    assert result["data"] == {"variant": None}
+    assert result["errors"][0]["message"] == (
+        "initialCount of @stream must be a non-negative integer"
+    )
+    assert result["errors"][0]["path"] == ["variant", "alleles"]
+
+
+def test_clients_without_multipart_get_one_response(app):
+    content_type, body = post(
+        app,
+        "{ variant(by_id: %s) { name ... @defer { type } alleles @stream { name } } }"
+        % VARIANT,
+        accept="application/json",
+    )
+    assert content_type == "application/json"
+    assert json.loads(body) == {
+        "data": {
+            "variant": {
+                "name": "rs1639538116",
+                "type": "Variant",
+                "alleles": [{"name": name} for name in ALLELE_NAMES],
+            }
+        }
+    }
+
+
+def test_is_reachable():
+    data = {"variant": {"alleles": [{"name": "a"}, None]}, "nulled": None}
+    assert is_reachable(data, [])
+    assert is_reachable(data, ["variant", "alleles", 0])
+    assert not is_reachable(data, ["variant", "alleles", 1])
+    assert not is_reachable(data, ["variant", "alleles", 2])
+    assert not is_reachable(data, ["nulled"])
+    assert not is_reachable(data, ["missing"])
+    assert not is_reachable(None, ["variant"])
@@ -0,0 +1,245 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import asyncio
+import json
+import os
+import time
+
+import pytest
+from ariadne import make_executable_schema
+from ariadne.asgi import GraphQL
+from graphql import NoSchemaIntrospectionCustomRule, parse, validate
+
+from common.admission import AdmissionController
+from common.extensions import QueryCostExtension
+from common.file_client import FileClient
+from graphql_service.ariadne_app import (
+    prepare_context_provider,
+    prepare_executable_schema,
+)
+from graphql_service.http_handler import FastJSONHTTPHandler
+from graphql_service.query_cost import DEFAULT_WEIGHTS, QueryCost, parse_weights
+
+GENOME_UUID = "a7335667-93e7-11ec-a39d-005056b38ce3"
+DATA_ROOT = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+SCHEMA = prepare_executable_schema(None)
+
+# variant 1, consequences 10 and frequencies 5
+VARIANT_QUERY = (
+    '{ variant(by_id: {genome_id: "%s", variant_id: "1:10007:rs1639538116"}) '
+    "{ name alleles { predicted_molecular_consequences { __typename } "
+    "population_frequencies { __typename } } } }" % GENOME_UUID
+)
+
+
+def query_cost(max_cost: int = 2000, throttle_cost: int = 200) -> QueryCost:
+    return QueryCost(
+        DEFAULT_WEIGHTS,
+        max_cost,
+        throttle_cost,
+        AdmissionController("expensive_queries", 1, 0),
+    )
+
+
+def cost(query: str, variables: dict = None, operation_name: str = None) -> int:
+    context = {}
+    data = {"query": query, "variables": variables, "operationName": operation_name}
+    document = parse(query)
+    rules = query_cost().validation_rules(context, document, data)
+    assert validate(SCHEMA, document, rules) == []
+    return context["query_cost"]
+
+
+def test_weighted_selection():
+    assert cost(VARIANT_QUERY) == 16
+    assert cost("{ version { api { major } } }") == 0
+    # Aliases are each paid for
+    assert cost("{ a: %s b: %s }" % (VARIANT_QUERY[2:-2], VARIANT_QUERY[2:-2])) == 32
+
+
+def test_first_multiplies_the_cost_of_the_selection():
+    region = (
+        '{ variants_in_region(genome_id: "%s", region: "1"%s) '
+        "{ variants { alleles { population_frequencies { __typename } } } } }"
+    )
+    assert cost(region % (GENOME_UUID, ", first: 10")) == (1 + 5) * 10
+    # The default of the argument applies when it is left out
+    assert cost(region % (GENOME_UUID, "")) == (1 + 5) * 20
+    with_variable = (
+        'query q($n: Int) { variants_in_region(genome_id: "%s", region: "1", first: $n) '
+        "{ variants { name } } }" % GENOME_UUID
+    )
+    assert cost(with_variable, {"n": 3}) == 3
+    assert cost(with_variable, {"n": -3}) == 0
+
+
+def test_multiplier_is_carried_through_fragment_spreads():
+    query = (
+        '{ variants_by_gene(genome_id: "%s", gene: "BRCA2", first: 5) '
+        "{ variants { ...Consequences } } } "
+        "fragment Consequences on Variant "
+        "{ alleles { ... on VariantAllele { predicted_molecular_consequences "
+        "{ __typename } } } }" % GENOME_UUID
+    )
+    assert cost(query) == (1 + 10) * 5
+
+
+def test_only_the_operation_to_execute_is_costed():
+    query = "query cheap { version { api { major } } } query expensive %s" % (
+        VARIANT_QUERY
+    )
+    assert cost(query, operation_name="cheap") == 0
+    assert cost(query, operation_name="expensive") == 16
+
+
+def test_parse_weights():
+    assert parse_weights("Query.variant=3, VariantAllele.phenotype_assertions=0,") == {
+        "Query.variant": 3,
+        "VariantAllele.phenotype_assertions": 0,
+    }
+
+
+def post(app, query: str) -> tuple:
+    """
+    Posts a query to an ASGI app, returning the status, headers and the
+    decoded JSON body of the response
+    """
+    messages = []
+    body = json.dumps({"query": query}).encode()
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/",
+        "raw_path": b"/",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1),
+        "server": ("127.0.0.1", 80),
+    }
+    asyncio.run(app(scope, receive, send))
+    start, *bodies = messages
+    headers = {key.decode(): value.decode() for key, value in start["headers"]}
+    content = b"".join(message.get("body", b"") for message in bodies)
+    return start["status"], headers, json.loads(content)
+
+
+@pytest.fixture
+def file_client():
+    client = FileClient(
+        {
+            "data_root": DATA_ROOT,
+            "dataset_reload_interval": "0",
+            "csq_offload_threshold": "0",
+        }
+    )
+    yield client
+    for dataset in client.datasets.values():
+        dataset.close()
+
+
+def cost_app(file_client, cost: QueryCost) -> GraphQL:
+    return GraphQL(
+        SCHEMA,
+        context_value=prepare_context_provider({"file_client": file_client}),
+        http_handler=FastJSONHTTPHandler(
+            extensions=[QueryCostExtension], query_cost=cost
+        ),
+    )
+
+
+def test_cost_is_reported_in_the_extensions(file_client):
+    status, _, result = post(cost_app(file_client, query_cost()), VARIANT_QUERY)
+    assert status == 200
+    assert result["data"]["variant"]["name"] == "rs1639538116"
+    assert result["extensions"]["query_cost"] == 16
+
+
+def test_query_over_max_cost_is_rejected(file_client):
+    expensive = query_cost(max_cost=15)
+    status, _, result = post(cost_app(file_client, expensive), VARIANT_QUERY)
+    assert status == 400
+    assert "data" not in result
+    [error] = result["errors"]
+    assert error["extensions"] == {
+        "code": "QUERY_TOO_EXPENSIVE",
+        "cost": 16,
+        "max_cost": 15,
+    }
+    assert expensive.counters["rejected"] == 1
+
+
+def test_query_over_throttle_cost_waits_for_a_slot(file_client):
+    throttled = query_cost(throttle_cost=15)
+    app = cost_app(file_client, throttled)
+    granted = asyncio.run(throttled.admission.acquire(time.monotonic() + 1))
+
+    status, headers, result = post(app, VARIANT_QUERY)
+    assert status == 503
+    assert int(headers["retry-after"]) >= 1
+    assert result["errors"][0]["extensions"]["code"] == "SERVICE_UNAVAILABLE"
+    # Queries under the throttle cost do not need a slot
+    status, _, result = post(app, "{ version { api { major } } }")
+    assert status == 200 and result["extensions"]["query_cost"] == 0
+
+    throttled.admission.release(granted)
+    status, _, result = post(app, VARIANT_QUERY)
+    assert status == 200 and result["data"]["variant"]["name"] == "rs1639538116"
+    assert throttled.counters["throttled"] == 2
+    # The slot is given back once the query is answered
+    assert throttled.admission.active == 0
+
+
+def test_configured_root_value_and_validation_rules_are_kept():
+    schema = make_executable_schema("type Query { greeting: String, answer: Int }")
+    calls = []
+
+    async def root_value(context_value, operation_name, variables, document):
+        calls.append(operation_name)
+        return {"greeting": "hello", "answer": 42}
+
+    app = GraphQL(
+        schema,
+        root_value=root_value,
+        validation_rules=[NoSchemaIntrospectionCustomRule],
+        http_handler=FastJSONHTTPHandler(query_cost=query_cost()),
+    )
+    status, _, result = post(app, "query hi { greeting answer }")
+    assert status == 200
+    assert result["data"] == {"greeting": "hello", "answer": 42}
+    assert len(calls) == 1
+
+    status, _, result = post(app, "{ __schema { queryType { name } } }")
+    assert status == 400
+    assert "introspection" in result["errors"][0]["message"]
+
+    app = GraphQL(
+        schema,
+        root_value={"greeting": "static"},
+        validation_rules=lambda *_args: [NoSchemaIntrospectionCustomRule],
+        http_handler=FastJSONHTTPHandler(query_cost=query_cost()),
+    )
+    assert post(app, "{ greeting }")[2]["data"] == {"greeting": "static"}
+    assert post(app, "{ __schema { queryType { name } } }")[0] == 400
@@ -0,0 +1,108 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import shutil
+
+import pytest
+
+from graphql_service import ariadne_app
+from graphql_service.ariadne_app import (
+    prepare_executable_schema,
+    schema_fingerprint,
+    write_schema_cache,
+)
+
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    """
+    Copies of the schema definitions and resolver modules the fingerprint
+    is taken from, which tests may change
+    """
+    schema_dir = tmp_path / "schemas"
+    resolver_dir = tmp_path / "resolver"
+    shutil.copytree(ariadne_app.SCHEMA_DIR, schema_dir)
+    shutil.copytree(
+        ariadne_app.RESOLVER_DIR,
+        resolver_dir,
+        ignore=shutil.ignore_patterns("__pycache__"),
+    )
+    monkeypatch.setattr(ariadne_app, "SCHEMA_DIR", str(schema_dir))
+    monkeypatch.setattr(ariadne_app, "RESOLVER_DIR", str(resolver_dir))
+    return schema_dir, resolver_dir
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """
+    Counts the schemas built instead of read from the cache
+    """
+    calls = []
+    build = ariadne_app.build_executable_schema
+
+    def counting_build():
+        calls.append(1)
+        return build()
+
+    monkeypatch.setattr(ariadne_app, "build_executable_schema", counting_build)
+    return calls
+
+
+@pytest.fixture
+def cache_path(tmp_path, sources, builds):
+    path = str(tmp_path / "schema.pickle")
+    write_schema_cache(path)
+    builds.clear()
+    return path
+
+
+def test_cache_with_the_same_fingerprint_is_used(cache_path, builds):
+    schema = prepare_executable_schema(cache_path)
+    assert builds == []
+    assert schema.query_type.fields["variant"].resolve is not None
+
+
+def test_changed_resolver_falls_back_to_building(cache_path, sources, builds):
+    fingerprint = schema_fingerprint()
+    variant_model = sources[1] / "variant_model.py"
+    variant_model.write_text(variant_model.read_text() + "\n# changed\n")
+    assert schema_fingerprint() != fingerprint
+    schema = prepare_executable_schema(cache_path)
+    assert builds == [1]
+    assert "variant" in schema.query_type.fields
+
+
+def test_new_resolver_module_falls_back_to_building(cache_path, sources, builds):
+    fingerprint = schema_fingerprint()
+    (sources[1] / "population_model.py").write_text("")
+    assert schema_fingerprint() != fingerprint
+    prepare_executable_schema(cache_path)
+    assert builds == [1]
+
+
+def test_changed_schema_definition_falls_back_to_building(cache_path, sources, builds):
+    fingerprint = schema_fingerprint()
+    query = sources[0] / "query.graphql"
+    query.write_text(query.read_text() + "\n")
+    assert schema_fingerprint() != fingerprint
+    prepare_executable_schema(cache_path)
+    assert builds == [1]
+
+
+def test_unreadable_or_missing_cache_falls_back_to_building(cache_path, builds):
+    with open(cache_path, "wb") as cache_file:
+        cache_file.write(b"not a pickle")
+    prepare_executable_schema(cache_path)
+    prepare_executable_schema(cache_path + ".missing")
+    assert builds == [1, 1]
@@ -0,0 +1,414 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import asyncio
+import os
+import shutil
+import sqlite3
+
+import pytest
+from graphql import graphql
+
+from common.file_client import FileClient
+from common.pipeline.precompute import precompute_genome
+from common.pipeline.sidecar import SIDECAR_FILENAME, index_key
+from graphql_service.ariadne_app import prepare_executable_schema
+from graphql_service.resolver.exceptions import InvalidArgumentError
+from graphql_service.resolver.variant_model import decode_cursor, encode_cursor
+
+GENOME_UUID = "a7335667-93e7-11ec-a39d-005056b38ce3"
+BUNDLED_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data", GENOME_UUID)
+
+INDEXED_QUERY = """
+query q($g: String!, $v: String!, $first: Int, $after: String) {
+  variants_by_gene(genome_id: $g, gene: $v, first: $first, after: $after) {
+    variants { name slice { region { name } location { start } } }
+    page_info { end_cursor has_next_page }
+  }
+}
+"""
+
+
+def copy_bundled_genome(data_root) -> str:
+    (data_root / GENOME_UUID).mkdir(parents=True)
+    for name in ("variation.vcf.gz", "variation.vcf.gz.tbi"):
+        shutil.copy2(os.path.join(BUNDLED_DIR, name), data_root / GENOME_UUID / name)
+    return str(data_root / GENOME_UUID / "variation.vcf.gz")
+
+
+@pytest.fixture(scope="module")
+def sidecar_root(tmp_path_factory):
+    """
+    A copy of the bundled genome with its sidecar, built once for the module
+    """
+    data_root = tmp_path_factory.mktemp("sidecar") / "data"
+    assert precompute_genome(GENOME_UUID, copy_bundled_genome(data_root), 1) == (86, 6)
+    return data_root
+
+
+@pytest.fixture(scope="module")
+def schema():
+    return prepare_executable_schema(None)
+
+
+def make_file_client(data_root) -> FileClient:
+    return FileClient(
+        {
+            "data_root": str(data_root),
+            "dataset_reload_interval": "0",
+            "csq_offload_threshold": "0",
+        }
+    )
+
+
+@pytest.fixture
+def file_client(sidecar_root):
+    client = make_file_client(sidecar_root)
+    yield client
+    for dataset in client.datasets.values():
+        dataset.close()
+
+
+def run(schema, file_client, query: str, **variables):
+    return asyncio.run(
+        graphql(
+            schema,
+            query,
+            variable_values={"g": GENOME_UUID, **variables},
+            context_value={"file_client": file_client, "request": None},
+        )
+    )
+
+
+def keys(variants: list) -> list:
+    return [
+        (
+            variant["slice"]["region"]["name"],
+            variant["slice"]["location"]["start"],
+            variant["name"],
+        )
+        for variant in variants
+    ]
+
+
+def all_pages(schema, file_client, query: str, field: str, first: int, **variables):
+    """
+    Variants of every page of a query, following end_cursor
+    """
+    variants, after = [], None
+    while True:
+        result = run(schema, file_client, query, first=first, after=after, **variables)
+        assert not result.errors
+        page = result.data[field]
+        variants.extend(page["variants"])
+        assert len(page["variants"]) <= first
+        if not page["page_info"]["has_next_page"]:
+            return variants
+        after = page["page_info"]["end_cursor"]
+
+
+def error_extensions(result) -> dict:
+    assert result.data is None or not any(result.data.values())
+    assert len(result.errors) == 1
+    return result.errors[0].extensions
+
+
+def test_index_key_normalisation():
+    assert index_key("gene", " brca2 ") == "BRCA2"
+    assert index_key("gene", "ensg00000139618") == "ENSG00000139618"
+    assert (
+        index_key("phenotype", "Hereditary_breast_ovarian_cancer_syndrome")
+        == index_key("phenotype", "  HEREDITARY breast_ovarian   cancer Syndrome")
+        == "hereditary breast ovarian cancer syndrome"
+    )
+
+
+def test_gene_index_by_symbol_and_id(schema, file_client):
+    by_symbol = run(schema, file_client, INDEXED_QUERY, v="brca2", first=100)
+    by_id = run(schema, file_client, INDEXED_QUERY, v="ENSG00000139618", first=100)
+    assert not by_symbol.errors and not by_id.errors
+    variants = by_symbol.data["variants_by_gene"]["variants"]
+    assert len(variants) == 8
+    assert keys(variants) == keys(by_id.data["variants_by_gene"]["variants"])
+    assert keys(variants) == sorted(keys(variants), key=lambda key: key[1])
+    assert {key[0] for key in keys(variants)} == {"13"}
+    assert not by_symbol.data["variants_by_gene"]["page_info"]["has_next_page"]
+
+
+def test_phenotype_index_with_underscores_and_case(schema, file_client):
+    query = INDEXED_QUERY.replace("variants_by_gene", "variants_by_phenotype").replace(
+        "gene: $v", "phenotype: $v"
+    )
+    spellings = (
+        "Hereditary_breast_ovarian_cancer_syndrome",
+        "hereditary breast ovarian cancer syndrome",
+        "HEREDITARY  Breast_Ovarian cancer syndrome",
+    )
+    results = [
+        run(schema, file_client, query, v=spelling, first=100) for spelling in spellings
+    ]
+    assert not any(result.errors for result in results)
+    found = [
+        keys(result.data["variants_by_phenotype"]["variants"]) for result in results
+    ]
+    assert len(found[0]) == 5
+    assert found[1] == found[0] and found[2] == found[0]
+
+
+def test_unknown_gene_has_an_empty_page(schema, file_client):
+    result = run(schema, file_client, INDEXED_QUERY, v="NOT_A_GENE", first=10)
+    assert not result.errors
+    assert result.data["variants_by_gene"] == {
+        "variants": [],
+        "page_info": {"end_cursor": None, "has_next_page": False},
+    }
+
+
+@pytest.mark.parametrize("gene", ["COL6A1", "SAMD11", "BRCA2"])
+@pytest.mark.parametrize("first", [1, 3, 4])
+def test_gene_pages_add_up_to_the_unpaged_result(schema, file_client, gene, first):
+    unpaged = run(schema, file_client, INDEXED_QUERY, v=gene, first=100)
+    assert not unpaged.errors
+    paged = all_pages(
+        schema, file_client, INDEXED_QUERY, "variants_by_gene", first, v=gene
+    )
+    assert keys(paged) == keys(unpaged.data["variants_by_gene"]["variants"])
+
+
+def test_cursor_key_with_colons_in_its_last_part():
+    key = (2, 10007, "1:10007:rs1639538116")
+    assert decode_cursor(encode_cursor(key), (int, int, str)) == key
+    assert decode_cursor(encode_cursor((5, "a:b:")), (int, str)) == (5, "a:b:")
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not a cursor!",
+        encode_cursor((1, 2)),
+        encode_cursor(("x", 2, "rs1")),
+        "",
+        "Zm9v",
+    ],
+)
+def test_invalid_cursor_is_an_invalid_argument(cursor):
+    with pytest.raises(InvalidArgumentError):
+        decode_cursor(cursor, (int, int, str))
+
+
+def test_invalid_cursor_in_a_query(schema, file_client):
+    result = run(schema, file_client, INDEXED_QUERY, v="BRCA2", first=5, after="%%")
+    assert error_extensions(result) == {"code": "INVALID_ARGUMENT", "argument": "after"}
+
+
+@pytest.mark.parametrize("first", [0, -1, 101])
+def test_page_size_out_of_range(schema, file_client, first):
+    result = run(schema, file_client, INDEXED_QUERY, v="BRCA2", first=first)
+    assert error_extensions(result) == {"code": "INVALID_ARGUMENT", "argument": "first"}
+
+
+REGION_QUERY = """
+query q($g: String!, $region: String!, $population: String, $max_af: Float,
+        $first: Int, $after: String) {
+  variants_in_region(genome_id: $g, region: $region, population: $population,
+                     max_af: $max_af, first: $first, after: $after) {
+    variants { name slice { region { name } location { start } } }
+    page_info { end_cursor has_next_page }
+  }
+}
+"""
+
+
+def region_variants(schema, file_client, region: str, **variables) -> list:
+    result = run(
+        schema, file_client, REGION_QUERY, region=region, first=100, **variables
+    )
+    assert not result.errors
+    assert not result.data["variants_in_region"]["page_info"]["has_next_page"]
+    return result.data["variants_in_region"]["variants"]
+
+
+@pytest.mark.parametrize("region", ["1", "13", "1:10000-10500"])
+@pytest.mark.parametrize("first", [1, 4])
+def test_region_pages_add_up_to_the_unpaged_result(schema, file_client, region, first):
+    unpaged = region_variants(schema, file_client, region)
+    assert unpaged
+    paged = all_pages(
+        schema, file_client, REGION_QUERY, "variants_in_region", first, region=region
+    )
+    assert keys(paged) == keys(unpaged)
+
+
+def test_rare_variants_are_a_subset_and_page_the_same(schema, file_client):
+    variables = {"population": "gnomADg:ALL", "max_af": 0.001}
+    everything = region_variants(schema, file_client, "1")
+    rare = region_variants(schema, file_client, "1", **variables)
+    assert 0 < len(rare) < len(everything)
+    assert set(keys(rare)) < set(keys(everything))
+    paged = all_pages(
+        schema,
+        file_client,
+        REGION_QUERY,
+        "variants_in_region",
+        2,
+        region="1",
+        **variables,
+    )
+    assert keys(paged) == keys(rare)
+
+
+@pytest.mark.parametrize(
+    "variables",
+    [{"max_af": 0.01}, {"population": "gnomADg:ALL"}],
+)
+def test_max_af_and_population_go_together(schema, file_client, variables):
+    result = run(schema, file_client, REGION_QUERY, region="1", first=10, **variables)
+    assert error_extensions(result) == {
+        "code": "INVALID_ARGUMENT",
+        "argument": "max_af",
+    }
+
+
+def test_unknown_population_is_an_invalid_argument(schema, file_client):
+    result = run(
+        schema,
+        file_client,
+        REGION_QUERY,
+        region="1",
+        population="nowhere",
+        max_af=0.01,
+        first=10,
+    )
+    assert error_extensions(result) == {
+        "code": "INVALID_ARGUMENT",
+        "argument": "population",
+    }
+
+
+@pytest.mark.parametrize(
+    "variables",
+    [{"after": encode_cursor(("x", "rs1"))}, {"first": 0}, {"region": "1:x-y"}],
+)
+def test_invalid_region_arguments(schema, file_client, variables):
+    variables = {"region": "1", "first": 10, **variables}
+    result = run(schema, file_client, REGION_QUERY, **variables)
+    assert error_extensions(result)["code"] == "INVALID_ARGUMENT"
+
+
+DENSITY_QUERY = """
+query q($g: String!, $region: String!, $max_bins: Int) {
+  variant_density(genome_id: $g, region: $region, max_bins: $max_bins) {
+    bin_size
+    bins { start end count allele_types { value count } }
+  }
+}
+"""
+
+
+@pytest.mark.parametrize("region", ["1", "13", "1:10001-20000", "13:32000001-33000000"])
+@pytest.mark.parametrize("max_bins", [1, 10, 1000])
+def test_density_bins_add_up_to_the_region_variant_count(
+    schema, file_client, region, max_bins
+):
+    result = run(schema, file_client, DENSITY_QUERY, region=region, max_bins=max_bins)
+    assert not result.errors
+    density = result.data["variant_density"]
+    bins = density["bins"]
+    assert bins
+    assert len(bins) <= max_bins or density["bin_size"] == 10_000_000
+    for density_bin in bins:
+        assert density_bin["end"] - density_bin["start"] + 1 == density["bin_size"]
+        assert density_bin["count"] > 0
+        assert (
+            sum(count["count"] for count in density_bin["allele_types"])
+            <= density_bin["count"]
+        )
+    # The regions are whole contigs or whole bins, so no bin reaches outside
+    variants = all_pages(
+        schema, file_client, REGION_QUERY, "variants_in_region", 100, region=region
+    )
+    assert sum(density_bin["count"] for density_bin in bins) == len(variants)
+
+
+def test_density_picks_the_finest_zoom_level_within_max_bins(schema, file_client):
+    bin_sizes = [
+        run(schema, file_client, DENSITY_QUERY, region="1:1-1000000", max_bins=n).data[
+            "variant_density"
+        ]["bin_size"]
+        for n in (100, 10, 1)
+    ]
+    assert bin_sizes == [10_000, 100_000, 1_000_000]
+
+
+@pytest.mark.parametrize("max_bins", [0, 10001])
+def test_max_bins_out_of_range(schema, file_client, max_bins):
+    result = run(schema, file_client, DENSITY_QUERY, region="1", max_bins=max_bins)
+    assert error_extensions(result) == {
+        "code": "INVALID_ARGUMENT",
+        "argument": "max_bins",
+    }
+
+
+@pytest.fixture
+def stripped_root(tmp_path):
+    """
+    A genome whose sidecar was built before the indexes and tiles existed
+    """
+    data_root = tmp_path / "data"
+    precompute_genome(GENOME_UUID, copy_bundled_genome(data_root), 1)
+    connection = sqlite3.connect(str(data_root / GENOME_UUID / SIDECAR_FILENAME))
+    for table in ("gene_variant", "phenotype_variant", "density_tile"):
+        connection.execute(f"DROP TABLE {table}")
+    connection.commit()
+    connection.close()
+    return data_root
+
+
+@pytest.fixture
+def bare_root(tmp_path):
+    """
+    A genome without a sidecar
+    """
+    data_root = tmp_path / "data"
+    copy_bundled_genome(data_root)
+    return data_root
+
+
+@pytest.mark.parametrize("root", ["stripped_root", "bare_root"])
+def test_index_not_available(schema, request, root):
+    file_client = make_file_client(request.getfixturevalue(root))
+    try:
+        queries = [
+            ("gene", INDEXED_QUERY, {"v": "BRCA2", "first": 10}),
+            (
+                "phenotype",
+                INDEXED_QUERY.replace(
+                    "variants_by_gene", "variants_by_phenotype"
+                ).replace("gene: $v", "phenotype: $v"),
+                {"v": "diastolic blood pressure", "first": 10},
+            ),
+            ("density", DENSITY_QUERY, {"region": "1", "max_bins": 10}),
+        ]
+        for index, query, variables in queries:
+            result = run(schema, file_client, query, **variables)
+            assert error_extensions(result) == {
+                "code": "INDEX_NOT_AVAILABLE",
+                "genome_id": GENOME_UUID,
+                "index": index,
+            }
+        # Queries that do not need the indexes still work
+        assert region_variants(schema, file_client, "13")
+    finally:
+        for dataset in file_client.datasets.values():
+            dataset.close()
@@ -31,4 +31,11 @@ setup(
         # Make sure schema makes it to distro
         "common": ["*.graphql"]
     },
+    entry_points={
+        "console_scripts": [
+            "hypsipyle-precompute=common.pipeline.precompute:main",
+            "hypsipyle-build-bloom=common.pipeline.bloom:main",
+            "hypsipyle-annotate=graphql_service.annotate:main",
+        ]
+    },
 )